@@ -0,0 +1,96 @@
+"""
+Aggregates of the reviews of each :model:`app.Ticket`, stored in its
+review_count, rating_sum and last_review_time fields.
+
+The signal receivers update them with F expressions, in the UPDATE of the
+ticket, when a review is created, edited or deleted, so that concurrent
+reviews of a ticket do not overwrite each other's counts. The bulk inserts
+and the reconcile_review_aggregates command recompute them from the
+reviews with :func:`refresh`.
+"""
+from datetime import datetime, timezone
+
+from django.db.models import (Count, F, IntegerField, Max, OuterRef, Q,
+                              Subquery, Sum, Value)
+from django.db.models.functions import Coalesce, Greatest
+
+from . import models
+
+
+def review_added(ticket_id, rating, time_created, using=None):
+    models.Ticket.objects.using(using).filter(id=ticket_id).update(
+        review_count=F('review_count') + 1,
+        rating_sum=F('rating_sum') + rating,
+        last_review_time=Greatest(
+            Coalesce('last_review_time', Value(time_created)),
+            Value(time_created)))
+
+
+def review_removed(ticket_id, rating, using=None):
+    models.Ticket.objects.using(using).filter(id=ticket_id).update(
+        review_count=F('review_count') - 1,
+        rating_sum=F('rating_sum') - rating,
+        last_review_time=latest_review_time())
+
+
+def rating_changed(ticket_id, previous_rating, rating, using=None):
+    if rating != previous_rating:
+        models.Ticket.objects.using(using).filter(id=ticket_id).update(
+            rating_sum=F('rating_sum') + (rating - previous_rating))
+
+
+def review_subquery(aggregate):
+    """
+    Return the subquery computing an aggregate of the reviews of the
+    ticket of the outer query.
+    """
+    return Subquery(models.Review.objects.filter(ticket=OuterRef('pk'))
+                    .order_by().values('ticket')
+                    .annotate(value=aggregate).values('value'))
+
+
+def latest_review_time():
+    return review_subquery(Max('time_created'))
+
+
+def computed():
+    """
+    Return the expressions of the aggregates computed from the reviews.
+    """
+    return {
+        'review_count': Coalesce(review_subquery(Count('id')), 0,
+                                 output_field=IntegerField()),
+        'rating_sum': Coalesce(review_subquery(Sum('rating')), 0,
+                               output_field=IntegerField()),
+        'last_review_time': latest_review_time(),
+    }
+
+
+def drifted(tickets=None):
+    """
+    Return the tickets (every ticket by default) whose stored aggregates
+    differ from their reviews.
+    """
+    if tickets is None:
+        tickets = models.Ticket.objects.all()
+    expressions = computed()
+    # compares the times of the tickets without review too
+    never = Value(datetime.min.replace(tzinfo=timezone.utc))
+    return tickets.annotate(
+        computed_review_count=expressions['review_count'],
+        computed_rating_sum=expressions['rating_sum'],
+        stored_time=Coalesce('last_review_time', never),
+        computed_time=Coalesce(expressions['last_review_time'], never),
+    ).filter(~Q(review_count=F('computed_review_count'))
+             | ~Q(rating_sum=F('computed_rating_sum'))
+             | ~Q(stored_time=F('computed_time')))
+
+
+def refresh(tickets=None):
+    """
+    Recompute the aggregates of the tickets (every ticket by default)
+    from their reviews. Return the number of tickets updated.
+    """
+    if tickets is None:
+        tickets = models.Ticket.objects.all()
+    return tickets.update(**computed())
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        # connects the signal receivers keeping the timelines and the feed
+        # cache up to date
+        from . import signals  # noqa: F401
+        # registers the background jobs
+        from . import tasks  # noqa: F401
+        # tunes the SQLite connections
+        from . import database  # noqa: F401
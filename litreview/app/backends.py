@@ -0,0 +1,32 @@
+"""
+Authentication backend caching the users loaded by
+``AuthenticationMiddleware`` on every request.
+
+The users are cached for ``settings.USER_CACHE_TIMEOUT`` seconds, and
+forgotten when they are saved, e.g. on a password change, a login or a
+profile change, or deleted (see :mod:`app.signals`): the session hash of
+the password, checked on every request, is then computed from the saved
+user. The updates of querysets, which send no signal, are not seen until
+the timeout.
+"""
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+USER_KEY = 'auth:user:{}'
+
+
+class CachedModelBackend(ModelBackend):
+
+    def get_user(self, user_id):
+        key = USER_KEY.format(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+        return user
+
+
+def forget_user(user_id):
+    cache.delete(USER_KEY.format(user_id))
@@ -0,0 +1,97 @@
+"""
+Measures of the views for the benchmark commands: latency percentiles,
+number of queries and peak memory of a request.
+"""
+import math
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# keys of a measure compared with a baseline: the lower, the better
+COMPARED_KEYS = ('p50_ms', 'p95_ms', 'queries', 'peak_kib')
+
+
+def percentile(values, rank):
+    """
+    Return the rank (0 to 100) percentile of the values, by the nearest
+    rank method.
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    position = max(math.ceil(rank / 100 * len(values)), 1)
+    return values[position - 1]
+
+
+def client_host():
+    """
+    Return a host name of ``settings.ALLOWED_HOSTS`` for the requests of
+    the test client.
+    """
+    hosts = [host for host in settings.ALLOWED_HOSTS
+             if host != '*' and not host.startswith('.')]
+    return hosts[0] if hosts else 'localhost'
+
+
+def measure_view(client, url, requests, warmup=0, before_request=None):
+    """
+    Request the url requests times with the test client, after warmup
+    unmeasured requests. Return the latency percentiles, in milliseconds,
+    and the number of queries and peak memory of one more request.
+
+    The latencies are measured without tracing the memory, which slows
+    down the requests.
+
+    :arg: before_request: Callable called before each request, e.g. to
+    clear the caches.
+    """
+    before_request = before_request or (lambda: None)
+    for _ in range(warmup):
+        check(client.get(url), url)
+    latencies = []
+    for _ in range(requests):
+        before_request()
+        start = time.perf_counter()
+        response = client.get(url)
+        latencies.append((time.perf_counter() - start) * 1000)
+        check(response, url)
+
+    before_request()
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            check(client.get(url), url)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'queries': len(queries),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def check(response, url):
+    if response.status_code != 200:
+        raise RuntimeError(f'{url} answered {response.status_code}.')
+
+
+def compare(measures, baseline):
+    """
+    Generate (name, key, baseline value, value, change in percent) for the
+    COMPARED_KEYS of the measures also in the baseline.
+    """
+    for name, measure in measures.items():
+        if name not in baseline:
+            continue
+        for key in COMPARED_KEYS:
+            before, after = baseline[name].get(key), measure[key]
+            if before is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            yield name, key, before, after, change
@@ -0,0 +1,85 @@
+"""
+Cached ticket and review cards of the flux and posts pages.
+
+The cards are cached by the ``{% cache %}`` tag of
+:template:`app/ticket_snippet.html` and :template:`app/review_snippet.html`,
+keyed on the id and time_updated of their post and on the flags relative to
+the viewer: the page displaying the card, whether the viewer wrote the post
+and, for tickets, whether it has a review. Editing a post changes the key of
+its cards, and the cards of the edited and deleted posts are deleted once
+the change is committed, along with those rendered from the previous post
+in between.
+"""
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+from django.db.models import Q
+from django.utils.safestring import mark_safe
+
+from . import feed, feed_cache, models, sharding
+
+# fragment names of the {% cache %} tags of the templates
+FRAGMENTS = {feed.TICKET: 'ticket_card', feed.REVIEW: 'review_card'}
+PAGES = ('flux', 'posts')
+
+MAX_RATING = 5
+FULL_STAR = '<i class="fas fa-star"></i>'
+EMPTY_STAR = '<i class="far fa-star"></i>'
+# HTML of the stars of each rating
+STARS = tuple(
+    mark_safe(' '.join([FULL_STAR] * rating
+                       + [EMPTY_STAR] * (MAX_RATING - rating)))
+    for rating in range(MAX_RATING + 1))
+
+
+def card_keys(content_type, post_id, time_updated):
+    """
+    Return the cache keys of every card of a post.
+    """
+    variants = [[page, own] for page in PAGES for own in (True, False)]
+    if content_type == feed.TICKET:
+        variants = [[*flags, has_review] for flags in variants
+                    for has_review in (True, False)]
+    return [make_template_fragment_key(FRAGMENTS[content_type],
+                                       [post_id, time_updated, *flags])
+            for flags in variants]
+
+
+def invalidate(content_type, posts, using=None):
+    """
+    Delete the cached cards of the posts, given as (id, time_updated), once
+    the transaction of the using database is committed.
+    """
+    keys = [key for post_id, time_updated in posts
+            for key in card_keys(content_type, post_id, time_updated)]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys), using=using)
+
+
+def invalidate_user(user_id):
+    """
+    Delete the cached cards displaying the username of the user: the cards
+    of their posts and of the reviews of their tickets.
+    """
+    for alias in sharding.databases():
+        tickets = models.Ticket.objects.using(alias).filter(user=user_id)
+        invalidate(feed.TICKET, tickets.values_list('id', 'time_updated'))
+        reviews = models.Review.objects.using(alias)\
+            .filter(Q(user=user_id) | Q(ticket__user=user_id))
+        invalidate(feed.REVIEW, reviews.values_list('id', 'time_updated'))
+
+
+def touch_reviews(ticket_ids, time_updated, using=None):
+    """
+    Set the time_updated of the reviews of the tickets, which display them,
+    delete their previous cards and invalidate the pages displaying them.
+    """
+    reviews = models.Review.objects.using(using)\
+        .filter(ticket__in=ticket_ids)
+    touched = list(reviews.values_list('id', 'time_updated', 'user'))
+    invalidate(feed.REVIEW, [(review_id, previous_time_updated)
+                             for review_id, previous_time_updated, _
+                             in touched], reviews.db)
+    reviews.update(time_updated=time_updated)
+    feed_cache.invalidate_authors({author_id for *_, author_id in touched},
+                                  reviews.db)
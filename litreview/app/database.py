@@ -0,0 +1,174 @@
+"""
+Tuning of the SQLite connections and routing of the feed reads to a
+replica.
+
+Every new SQLite connection runs the pragmas of ``settings.SQLITE_PRAGMAS``
+(write-ahead log, relaxed synchronous mode, memory-mapped reads, larger
+page cache), which last as long as the connection: together with
+``CONN_MAX_AGE``, a process serves many requests with the same warm
+connection.
+
+When ``settings.REPLICA_DATABASE`` is set, the read-only views decorated by
+:func:`read_from_replica` read from the ``replica`` database, a copy of the
+primary database refreshed by the sync_replica command, through
+:class:`ReplicaRouter`; the writes always go to the primary database. The
+replica lags behind the primary database by up to
+``settings.REPLICA_MAX_LAG`` seconds, so that:
+
+- a user who has just written is pinned to the primary database for that
+  long by :class:`app.middleware.ReplicaPinMiddleware`, and reads their
+  own writes;
+- the feed pages built from the replica are cached for that long only (see
+  :func:`app.feed_cache.get_page`), and have no ETag (see
+  :func:`app.views.feed_validator`);
+- the in-process follow graph, cached until the next follow, is loaded from
+  the primary database (see :func:`primary_reads`).
+"""
+import contextvars
+import functools
+import sqlite3
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+PRIMARY = 'default'
+REPLICA = 'replica'
+# cookie of the users reading from the primary database after a write
+PIN_COOKIE = 'primary'
+
+# whether the current request may read from the replica
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    """
+    Tune each new SQLite connection, the replica ones being read-only. The
+    shards do not hold the users their posts refer to (see
+    :mod:`app.sharding`).
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        if connection.alias == REPLICA:
+            cursor.execute('PRAGMA query_only = ON')
+        if connection.alias in settings.POST_SHARDS:
+            cursor.execute('PRAGMA foreign_keys = OFF')
+
+
+def upsert(queryset, defaults, **lookup):
+    """
+    Update the row of the queryset matching lookup with defaults, or insert
+    it. Unlike update_or_create, which reads the row before writing it, the
+    first statement of the transaction is a write: it waits for the other
+    writers of the SQLite database, whereas a read transaction upgraded to a
+    write one fails at once with "database is locked" when another
+    connection has written in between.
+    """
+    with transaction.atomic(using=queryset.db):
+        if not queryset.filter(**lookup).update(**defaults):
+            queryset.create(**lookup, **defaults)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """
+    Route the reads of the block to the replica, if there is one
+    (enabled=True), or to the primary database (enabled=False).
+    """
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def primary_reads():
+    return replica_reads(enabled=False)
+
+
+def reading_replica():
+    """
+    Return True if the reads of the current code go to the replica. The
+    reads of a transaction of the primary database never do, so that they
+    see its writes.
+    """
+    return _replica_reads.get() and replica_configured() \
+        and not connections[PRIMARY].in_atomic_block
+
+
+def read_alias():
+    """
+    Return the alias of the database read by the current code, for the raw
+    queries.
+    """
+    return REPLICA if reading_replica() else PRIMARY
+
+
+def read_from_replica(view):
+    """
+    Decorator of the read-only views, whose reads go to the replica unless
+    the user is pinned to the primary database.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with replica_reads(PIN_COOKIE not in request.COOKIES):
+            return view(request, *args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """
+    Send the reads of :func:`replica_reads` blocks to the replica and
+    everything else to the primary database.
+    """
+
+    def db_for_read(self, model, **hints):
+        return REPLICA if reading_replica() else None
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None \
+                and instance._state.db not in (None, PRIMARY, REPLICA):
+            # e.g. the instances of a shard, see app.sharding
+            return None
+        # the instances read from the replica are saved to the primary
+        # database too
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica is a copy of the primary database; the other
+        # databases keep to themselves
+        if {obj1._state.db, obj2._state.db} <= {PRIMARY, REPLICA}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # the replica gets its schema from the primary database
+        return db != REPLICA
+
+
+def sync_replica():
+    """
+    Copy the primary database to the replica with the SQLite backup API.
+    The replica being in WAL mode, its readers keep reading the previous
+    copy while it is written.
+    """
+    source = connections[PRIMARY]
+    source.ensure_connection()
+    target = sqlite3.connect(settings.DATABASES[REPLICA]['NAME'])
+    try:
+        target.execute('PRAGMA journal_mode = WAL')
+        source.connection.backup(target)
+    finally:
+        target.close()
@@ -0,0 +1,123 @@
+"""
+Streaming export of :model:`app.Ticket` and :model:`app.Review` as NDJSON
+or CSV, read by :mod:`app.imports`.
+
+The posts are read with ``QuerySet.iterator`` and encoded one at a time, so
+that the memory used does not grow with the number of posts. The tickets
+come first, then the reviews, each ordered by time_created: an incremental
+export passes the latest time_created already exported as since. When the
+posts are sharded, the ordered posts of the shards are merged, and the
+usernames read from the default database by chunk.
+"""
+import csv
+import heapq
+import json
+from datetime import datetime, time
+from itertools import islice
+from operator import itemgetter
+
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import feed, models, sharding
+
+CHUNK_SIZE = 2000
+# columns of the CSV export, the keys of the NDJSON records
+FIELDS = ('type', 'id', 'user', 'time_created', 'title', 'description',
+          'image', 'ticket', 'rating', 'headline', 'body')
+TICKET_FIELDS = {'id': 'id', 'user': 'user__username',
+                 'time_created': 'time_created', 'title': 'title',
+                 'description': 'description', 'image': 'image'}
+REVIEW_FIELDS = {'id': 'id', 'user': 'user__username',
+                 'time_created': 'time_created', 'ticket': 'ticket_id',
+                 'rating': 'rating', 'headline': 'headline', 'body': 'body'}
+
+
+def parse_since(value):
+    """
+    Return the aware datetime of an ISO 8601 date or date and time, the
+    dates meaning midnight in the current time zone. Raise ValueError if
+    the value is invalid.
+    """
+    since = parse_datetime(value)
+    if since is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f'Invalid date: {value!r}.')
+        since = datetime.combine(date, time.min)
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+
+def records(users=None, since=None):
+    """
+    Generate the posts of the users (everyone by default) created after
+    since, as dicts of FIELDS.
+    """
+    if sharding.enabled() and isinstance(users, QuerySet):
+        # the shards cannot run a subquery of the default database
+        users = list(users.values_list('id', flat=True))
+    sources = ((feed.TICKET, models.Ticket, TICKET_FIELDS),
+               (feed.REVIEW, models.Review, REVIEW_FIELDS))
+    for content_type, model, fields in sources:
+        if sharding.enabled():
+            fields = {**fields, 'user': 'user_id'}
+        querysets = []
+        for queryset in sharding.managers(model):
+            if users is not None:
+                queryset = queryset.filter(user__in=users)
+            if since is not None:
+                queryset = queryset.filter(time_created__gt=since)
+            querysets.append(queryset.order_by('time_created', 'id')
+                             .values_list(*fields.values())
+                             .iterator(chunk_size=CHUNK_SIZE))
+        keys = list(fields)
+        rows = heapq.merge(*querysets, key=itemgetter(
+            keys.index('time_created'), keys.index('id')))
+        while chunk := list(islice(rows, CHUNK_SIZE)):
+            posts = [dict(zip(fields, row)) for row in chunk]
+            if sharding.enabled():
+                usernames = dict(User.objects.filter(
+                    id__in={post['user'] for post in posts})
+                    .values_list('id', 'username'))
+                for post in posts:
+                    post['user'] = usernames.get(post['user'])
+            for post in posts:
+                record = dict.fromkeys(FIELDS)
+                record['type'] = content_type
+                record.update(post)
+                record['time_created'] = record['time_created'].isoformat()
+                yield record
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+class Echo:
+    """
+    File-like object returning what is written, for csv.writer.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for record in records:
+        yield writer.writerow(
+            ['' if record[field] is None else record[field]
+             for field in FIELDS])
+
+
+# format: (content type, extension, function encoding the records as lines)
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson', ndjson_lines),
+    'csv': ('text/csv', 'csv', csv_lines),
+}
@@ -0,0 +1,210 @@
+"""
+Paginated feed of :model:`app.Ticket` and :model:`app.Review`.
+
+Both post types are merged by the database with a ``UNION ALL`` ordered by
+(time_created, content_type, post_id), newest first. Pages are addressed by
+an opaque keyset cursor holding the sort key of the last post displayed, so
+that every page costs the same whatever its depth.
+
+When the posts are sharded (see :mod:`app.sharding`), the sources of each
+database are merged by a query run on that database, in parallel, and the
+sorted rows of the databases are merged with a heap.
+"""
+import base64
+import binascii
+import heapq
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from itertools import islice
+from operator import itemgetter
+
+from django.db.models import CharField, F, Q, Value
+
+from . import models, sharding
+
+PAGE_SIZE = 20
+
+TICKET = 'TICKET'
+REVIEW = 'REVIEW'
+
+ORDERING = ('-time_created', '-content_type', '-post_id')
+
+FeedPage = namedtuple('FeedPage', ['posts', 'next_cursor'])
+
+sort_key = itemgetter('time_created', 'content_type', 'post_id')
+
+
+def encode_cursor(time_created, content_type, post_id):
+    """
+    Return the opaque cursor pointing right after the given post.
+    """
+    raw = f'{time_created.isoformat()}|{content_type}|{post_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Return the (time_created, content_type, post_id) tuple held by a cursor,
+    or None if the cursor is missing or invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        time_created, content_type, post_id = raw.decode().split('|')
+        return (datetime.fromisoformat(time_created),
+                content_type,
+                int(post_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def post_rows(queryset, content_type):
+    """
+    Return the sort keys of the posts of a :model:`app.Ticket` or
+    :model:`app.Review` queryset, in the shape expected by :func:`get_page`.
+    """
+    return queryset.annotate(
+        content_type=Value(content_type, CharField()),
+        post_id=F('id'),
+    ).values('time_created', 'content_type', 'post_id')
+
+
+def post_sources(users):
+    """
+    Return the row sources of the posts published by the given users, on
+    each database holding posts.
+    """
+    sources = []
+    for alias in sharding.databases():
+        sources += [
+            post_rows(models.Ticket.objects.using(alias)
+                      .filter(user__in=users), TICKET),
+            post_rows(models.Review.objects.using(alias)
+                      .filter(user__in=users), REVIEW),
+        ]
+    return sources
+
+
+def after(cursor):
+    """
+    Return the condition selecting the rows sorted after the cursor.
+    The redundant ``time_created <= ...`` bound lets the database walk
+    the time_created indexes as a range.
+    """
+    time_created, content_type, post_id = cursor
+    return Q(time_created__lte=time_created) & (
+        Q(time_created__lt=time_created)
+        | Q(time_created=time_created, content_type__lt=content_type)
+        | Q(time_created=time_created,
+            content_type=content_type,
+            post_id__lt=post_id))
+
+
+def page_queryset(sources, cursor=None, page_size=PAGE_SIZE):
+    """
+    Return the queryset merging the row sources in the database and
+    selecting the rows of page_size + 1 posts following the cursor.
+    """
+    if cursor is not None:
+        sources = [source.filter(after(cursor)) for source in sources]
+    queryset = sources[0]
+    if len(sources) > 1:
+        queryset = queryset.union(*sources[1:], all=True)
+    return queryset.order_by(*ORDERING)[:page_size + 1]
+
+
+def get_rows(sources, cursor=None, page_size=PAGE_SIZE):
+    """
+    Return the rows of at most page_size posts following the cursor, and
+    the cursor of the next page (None on the last page).
+
+    The sources of different databases are merged by one query per
+    database, run in parallel, whose rows are merged by their sort key.
+    """
+    by_database = defaultdict(list)
+    for source in sources:
+        # the threads see the database chosen by the current one
+        by_database[source.db].append(source.using(source.db))
+    if len(by_database) == 1:
+        rows = list(page_queryset(sources, cursor, page_size))
+    else:
+        results = sharding.scatter(
+            lambda alias: list(page_queryset(by_database[alias], cursor,
+                                             page_size)),
+            by_database)
+        rows = list(islice(heapq.merge(*results, key=sort_key,
+                                       reverse=True),
+                           page_size + 1))
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(
+            last['time_created'], last['content_type'], last['post_id'])
+    return rows, next_cursor
+
+
+def get_page(sources, cursor=None, page_size=PAGE_SIZE):
+    """
+    Return a :class:`FeedPage` of at most page_size posts following the
+    cursor.
+    """
+    rows, next_cursor = get_rows(sources, cursor, page_size)
+    return FeedPage(hydrate(rows), next_cursor)
+
+
+def hydrate(rows):
+    """
+    Fetch the posts referenced by the rows, in the order of the rows.
+    Each post gets a content_type attribute ('TICKET' or 'REVIEW'). The
+    has_review flag of the tickets is read from their review_count, see
+    :mod:`app.aggregates`. The users and tickets displayed by the snippets
+    are fetched in the same queries, or, when the posts are sharded, the
+    users in one more query of the default database.
+    """
+    if sharding.enabled():
+        querysets = {
+            TICKET: models.Ticket.objects.all(),
+            REVIEW: models.Review.objects.select_related('ticket'),
+        }
+    else:
+        querysets = {
+            TICKET: models.Ticket.objects.select_related('user'),
+            REVIEW: models.Review.objects.select_related('user',
+                                                         'ticket__user'),
+        }
+    instances = {}
+    for content_type, queryset in querysets.items():
+        ids = [row['post_id'] for row in rows
+               if row['content_type'] == content_type]
+        if ids and sharding.enabled():
+            instances[content_type] = sharding.in_bulk(queryset, ids)
+        elif ids:
+            instances[content_type] = queryset.in_bulk(ids)
+    posts = []
+    for row in rows:
+        post = instances[row['content_type']].get(row['post_id'])
+        if post is not None:
+            post.content_type = row['content_type']
+            if 'rating' in row:
+                post.rating = row['rating']
+            posts.append(post)
+    if sharding.enabled():
+        sharding.attach_users(posts)
+    return posts
+
+
+def post_flags(posts):
+    """
+    Return the rows of hydrated posts, holding the ratings of the reviews,
+    as stored by :mod:`app.feed_cache`.
+    """
+    rows = []
+    for post in posts:
+        row = {'content_type': post.content_type, 'post_id': post.id}
+        if post.content_type == REVIEW:
+            row['rating'] = post.rating
+        rows.append(row)
+    return rows
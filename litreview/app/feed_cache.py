@@ -0,0 +1,137 @@
+"""
+Per-user cache of the flux and posts pages.
+
+A cached page holds the rows of its posts (ids and ratings) and the cursor
+of the next page. Its key embeds the feed version
+of the viewer and of the authors whose posts the viewer reads on demand
+(see :mod:`app.timeline`). Once a version is invalidated (see
+:mod:`app.versions`), the stale pages are never read again and expire.
+The versions are invalidated once the change is committed: a page read in
+between would be cached under the new version otherwise.
+
+A hit skips the page query, which merges and sorts the sources, but still
+fetches the posts of the page by primary key, in one query per post type
+(see :func:`feed.hydrate`): the cached pages hold no post content, so that
+an edited post, or its new image variants, is displayed at once without
+invalidating every page displaying it. The cards of the posts, which
+display the username of their authors, are cached apart (see
+:mod:`app.cards`): those of a renamed user are deleted by a job.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import database, feed, follow_graph, timeline, versions
+
+VERSION_KEY = 'feed:version:{}'
+PAGE_KEY = 'feed:page:{}'
+STATS_KEYS = {
+    'hits': 'feed:stats:hits',
+    'misses': 'feed:stats:misses',
+}
+
+
+def invalidate(user_ids, using=None):
+    """
+    Invalidate every cached page of the users, once the transaction of the
+    using database is committed.
+    """
+    user_ids = list(user_ids)
+    transaction.on_commit(
+        lambda: versions.invalidate(VERSION_KEY, user_ids), using=using)
+
+
+def invalidate_authors(author_ids, using=None):
+    """
+    Invalidate the cached pages displaying the posts of the authors, once
+    the transaction of the using database is committed: their own pages
+    and, for the authors fanned out, the pages of their followers. The
+    followers of other authors read the author's version.
+    """
+    author_ids = list(author_ids)
+
+    def committed():
+        user_ids = set(author_ids)
+        for author_id in author_ids:
+            if timeline.is_fanned_out(author_id):
+                user_ids.update(follow_graph.followers(author_id))
+        versions.invalidate(VERSION_KEY, user_ids)
+
+    transaction.on_commit(committed, using=using)
+
+
+def invalidate_author(author_id, using=None):
+    invalidate_authors([author_id], using)
+
+
+def count(name):
+    """
+    Increment the hits or misses counter.
+    """
+    key = STATS_KEYS[name]
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # the counter was evicted meanwhile
+            cache.add(key, 1, timeout=None)
+
+
+def stats():
+    """
+    Return the hits and misses counters.
+    """
+    values = cache.get_many(STATS_KEYS.values())
+    return {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+
+
+def reset_stats():
+    cache.delete_many(STATS_KEYS.values())
+
+
+def page_validator(kind, viewer_id, read_authors=()):
+    """
+    Return the ETag of the viewer's kind page, from the feed versions of
+    the page (see :func:`get_page`) and the version of the users followed
+    by the viewer, without querying the database: the creation, edition
+    and deletion of a post invalidate the versions of the pages displaying
+    it.
+    """
+    validator = (kind, viewer_id,
+                 versions.get(VERSION_KEY, [viewer_id, *read_authors]),
+                 follow_graph.following_version(viewer_id))
+    return hashlib.sha1(repr(validator).encode()).hexdigest()
+
+
+def get_page(kind, viewer_id, cursor, sources, authors=()):
+    """
+    Return the :class:`feed.FeedPage` following the cursor (a string) of
+    the viewer's kind ('flux' or 'posts') page, from the cache if possible.
+
+    :arg: sources: Callable returning the row sources of the page.
+    :arg: authors: Ids of the authors whose posts are read on demand.
+    """
+    cursor = feed.decode_cursor(cursor)
+    page_versions = versions.get(VERSION_KEY, [viewer_id, *authors])
+    digest = hashlib.sha1(
+        repr((kind, viewer_id, page_versions, cursor)).encode()).hexdigest()
+    key = PAGE_KEY.format(digest)
+
+    entry = cache.get(key)
+    if entry is not None:
+        count('hits')
+        return feed.FeedPage(feed.hydrate(entry['rows']),
+                             entry['next_cursor'])
+    count('misses')
+    rows, next_cursor = feed.get_rows(sources(), cursor)
+    posts = feed.hydrate(rows)
+    timeout = settings.FEED_CACHE_TIMEOUT
+    if database.reading_replica():
+        # the replica may not hold the changes of the page versions yet
+        timeout = min(timeout, settings.REPLICA_MAX_LAG)
+    cache.set(key,
+              {'rows': feed.post_flags(posts), 'next_cursor': next_cursor},
+              timeout)
+    return feed.FeedPage(posts, next_cursor)
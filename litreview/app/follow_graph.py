@@ -0,0 +1,224 @@
+"""
+Follow graph service: the ids of the users followed by and following each
+user, served from an in-process LRU cache.
+
+Each cached set is tagged with a version shared by every process through
+the Django cache (see :mod:`app.versions`), so that a set changed by
+another process is reloaded with one query. Once a follow or an unfollow
+is committed, its versions are invalidated and the cached sets of this
+process updated in place.
+
+The authors followed by at least ``settings.TIMELINE_FANOUT_LIMIT`` users
+are recorded in :model:`app.HighFollowerAuthor` by the follow or unfollow
+crossing the limit, so that loading them counts no followers.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from . import database, models, versions
+
+FOLLOWING_KEY = 'follow:following:{}'
+FOLLOWERS_KEY = 'follow:followers:{}'
+HIGH_FOLLOWER_KEY = 'follow:high-follower:{}'
+
+
+class LRUCache:
+    """
+    Thread-safe mapping of frozensets of ids, evicting the least recently
+    used sets once they hold more than max_ids ids in total.
+    """
+
+    def __init__(self, max_ids):
+        self.max_ids = max_ids
+        self.size = 0
+        # key: (version, ids)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        """
+        Return the set of the key if it is cached with the version.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, version, ids):
+        with self.lock:
+            self._set(key, version, ids)
+
+    def update(self, key, previous, version, added=(), removed=()):
+        """
+        Add and remove ids to the set of the key, if it is cached with the
+        previous version, and tag it with the version.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == previous:
+                self._set(key, version,
+                          entry[1].union(added).difference(removed))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _set(self, key, version, ids):
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous[1])
+        self.entries[key] = (version, ids)
+        self.size += len(ids)
+        while self.size > self.max_ids and len(self.entries) > 1:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+_following = LRUCache(settings.FOLLOW_GRAPH_CACHE_SIZE)
+_followers = LRUCache(settings.FOLLOW_GRAPH_CACHE_SIZE)
+_high_follower = LRUCache(settings.FOLLOW_GRAPH_CACHE_SIZE)
+
+
+def _get(lru, key_format, key, queryset):
+    # the version is read before the query, and only invalidated once a
+    # change is committed (see _change): a set loaded before the commit is
+    # cached under the outdated version, and loaded again by the next call
+    version, = versions.get(key_format, [key])
+    ids = lru.get(key, version)
+    if ids is None:
+        # the set is cached until it changes: it is not loaded from a
+        # replica lagging behind
+        with database.primary_reads():
+            ids = frozenset(queryset)
+        lru.set(key, version, ids)
+    return ids
+
+
+def following(user_id):
+    """
+    Return the ids of the users followed by the user.
+    """
+    return _get(_following, FOLLOWING_KEY, user_id,
+                models.UserFollows.objects.filter(user=user_id)
+                .values_list('followed_user', flat=True))
+
+
+def followers(user_id):
+    """
+    Return the ids of the users following the user.
+    """
+    return _get(_followers, FOLLOWERS_KEY, user_id,
+                models.UserFollows.objects.filter(followed_user=user_id)
+                .values_list('user', flat=True))
+
+
+def following_version(user_id):
+    """
+    Return the version of the set of users followed by the user.
+    """
+    return versions.get(FOLLOWING_KEY, [user_id])[0]
+
+
+def high_follower_queryset():
+    return models.HighFollowerAuthor.objects.values_list('user', flat=True)
+
+
+def high_follower_authors():
+    """
+    Return the ids of the users followed by at least
+    settings.TIMELINE_FANOUT_LIMIT users.
+    """
+    return _get(_high_follower, HIGH_FOLLOWER_KEY, 'all',
+                high_follower_queryset())
+
+
+def refresh_high_follower_authors():
+    """
+    Recount the followers of every user to record the high-follower
+    authors, e.g. once follows were inserted without the signal receivers
+    or TIMELINE_FANOUT_LIMIT changed. Return their number.
+    """
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    author_ids = models.UserFollows.objects.values('followed_user')\
+        .annotate(count=Count('id')).filter(count__gte=limit)\
+        .values_list('followed_user', flat=True)
+    with transaction.atomic():
+        models.HighFollowerAuthor.objects.all().delete()
+        authors = models.HighFollowerAuthor.objects.bulk_create(
+            [models.HighFollowerAuthor(user_id=author_id)
+             for author_id in author_ids])
+        transaction.on_commit(
+            lambda: versions.invalidate(HIGH_FOLLOWER_KEY, ['all']))
+    return len(authors)
+
+
+def bounded_follower_count(user_id, limit):
+    """
+    Return the number of followers of the user, up to limit, at a cost
+    bounded by limit.
+    """
+    return models.UserFollows.objects.filter(followed_user=user_id)\
+        .order_by()[:limit].count()
+
+
+def _change(user_id, followed_id, added):
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    count = bounded_follower_count(followed_id, limit)
+    crossed = count == limit if added else count == limit - 1
+    if crossed and added:
+        models.HighFollowerAuthor.objects.bulk_create(
+            [models.HighFollowerAuthor(user_id=followed_id)],
+            ignore_conflicts=True)
+    elif crossed:
+        models.HighFollowerAuthor.objects.filter(user=followed_id).delete()
+
+    def committed():
+        # a set cached with an older version misses other changes
+        for lru, key_format, key, changed_id in (
+                (_following, FOLLOWING_KEY, user_id, followed_id),
+                (_followers, FOLLOWERS_KEY, followed_id, user_id)):
+            previous, = versions.get(key_format, [key])
+            versions.invalidate(key_format, [key])
+            version, = versions.get(key_format, [key])
+            change = {'added' if added else 'removed': (changed_id,)}
+            lru.update(key, previous, version, **change)
+        if crossed:
+            versions.invalidate(HIGH_FOLLOWER_KEY, ['all'])
+
+    # a set read before the commit would otherwise be cached under the
+    # new version, until the next change
+    transaction.on_commit(committed)
+    return crossed
+
+
+def add_edge(user_id, followed_id):
+    """
+    Record that the user follows followed_id, once the transaction is
+    committed. Return True if followed_id has just reached
+    TIMELINE_FANOUT_LIMIT followers.
+    """
+    return _change(user_id, followed_id, added=True)
+
+
+def remove_edge(user_id, followed_id):
+    """
+    Record that the user no longer follows followed_id, once the
+    transaction is committed. Return True if followed_id has just fallen
+    below TIMELINE_FANOUT_LIMIT followers.
+    """
+    return _change(user_id, followed_id, added=False)
+
+
+def clear():
+    """
+    Empty the in-process caches.
+    """
+    for lru in (_following, _followers, _high_follower):
+        lru.clear()
@@ -0,0 +1,119 @@
+"""
+Resized JPEG and WebP variants of :model:`app.Ticket` images, displayed by
+the feed instead of the original uploads.
+
+The variants of a ticket are recorded in its image_variants field as
+``{format: {width: name}}``, names being relative to the media storage.
+"""
+import io
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from . import jobs, media, models
+
+# the feed cards display the images 240px wide, at most
+VARIANT_WIDTHS = (240, 480)
+FORMATS = {
+    # format: (Pillow format, extension, save options)
+    'jpeg': ('JPEG', 'jpg', {'quality': 80, 'optimize': True}),
+    'webp': ('WEBP', 'webp', {'quality': 75, 'method': 4}),
+}
+VARIANTS_DIRECTORY = 'variants'
+
+
+def available_formats():
+    """
+    Return the formats of FORMATS supported by the installed Pillow, which
+    may be built without WebP.
+    """
+    return {name: options for name, options in FORMATS.items()
+            if name != 'webp' or features.check('webp')}
+
+
+def render_variants(image_file):
+    """
+    Return the encoded variants of an image file, as
+    ``{format: {width: bytes}}``.
+    """
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        formats = available_formats()
+        rendered = {name: {} for name in formats}
+        for width in VARIANT_WIDTHS:
+            resized = image.copy()
+            # keeps the aspect ratio and never enlarges the image
+            resized.thumbnail((width, width * 2), Image.LANCZOS)
+            for name, (pillow_format, _, options) in formats.items():
+                output = io.BytesIO()
+                resized.save(output, pillow_format, **options)
+                rendered[name][str(width)] = output.getvalue()
+    return rendered
+
+
+def build_variants(image_name, storage=default_storage):
+    """
+    Render and store the variants of a stored image. Return the variants
+    to record in :model:`app.Ticket` image_variants.
+    """
+    with storage.open(image_name) as image_file:
+        rendered = render_variants(image_file)
+    stem = PurePosixPath(image_name).stem
+    variants = {}
+    for name, widths in rendered.items():
+        extension = FORMATS[name][1]
+        variants[name] = {
+            width: storage.save(
+                f'{VARIANTS_DIRECTORY}/{stem}-{width}.{extension}',
+                ContentFile(content))
+            for width, content in widths.items()
+        }
+    return variants
+
+
+def variant_names(variants):
+    """
+    Return the names of the files of recorded variants.
+    """
+    return [name for widths in variants.values() for name in widths.values()]
+
+
+def delete_variants(variants, storage=default_storage):
+    for name in variant_names(variants):
+        storage.delete(name)
+
+
+def image_changed(ticket, previous_image='', previous_variants=None):
+    """
+    Queue the building of the variants of the new image of a saved ticket,
+    after an upload, replacement or removal, and record the files of the
+    previous one to delete, see :mod:`app.media`.
+    """
+    if previous_variants:
+        # the template falls back to the image until its variants are built
+        models.Ticket.objects.using(ticket._state.db).filter(id=ticket.id)\
+            .update(image_variants={})
+        ticket.image_variants = {}
+    files = [previous_image] if previous_image else []
+    files += variant_names(previous_variants or {})
+    if files:
+        media.forget(files, using=ticket._state.db)
+    if ticket.image:
+        jobs.enqueue('images.build_ticket_variants',
+                     {'ticket_id': ticket.id, 'image_name': ticket.image.name},
+                     key=f'images:variants:{ticket.id}:{ticket.image.name}')
+
+
+def ticket_deleted(ticket):
+    """
+    Record the image files of a deleted ticket to delete, see
+    :mod:`app.media`.
+    """
+    files = [ticket.image.name] if ticket.image else []
+    files += variant_names(ticket.image_variants)
+    if files:
+        media.forget(files, using=ticket._state.db)
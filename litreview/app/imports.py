@@ -0,0 +1,359 @@
+"""
+Bulk import of tickets and reviews in the NDJSON or CSV format of
+:mod:`app.export`, for the import_posts command.
+
+The records are read as a stream and imported in batches, each in one
+transaction: they are validated with the validators of the models, then
+inserted with ``bulk_create`` along with their timeline entries and their
+rows of the search index, and the review aggregates of their tickets are
+recomputed, since bulk_create bypasses the signal receivers. The images
+of the tickets are copied from local files to the media storage by a pool
+of threads and their variants are built by background jobs.
+
+The source ids of the imported posts are recorded in
+:model:`app.ImportedPost`: the reviews find their ticket through them,
+and the posts already imported are skipped, so that a batch interrupted
+by a crash can be imported again when resuming from a checkpoint.
+"""
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import models as db_models, transaction
+from django.utils import timezone
+from PIL import Image
+
+from . import aggregates, export, feed, feed_cache, jobs, models, search, \
+    seeding, timeline, usernames
+
+BATCH_SIZE = 1000
+IMAGE_WORKERS = 4
+FORMATS = ('ndjson', 'csv')
+
+
+class RecordError(Exception):
+    """
+    A record which cannot be imported.
+    """
+
+
+def read_records(file, file_format):
+    """
+    Generate the records of a file, as dicts for CSV and as lines, parsed
+    by :func:`parse`, for NDJSON.
+    """
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield line
+
+
+def parse(raw):
+    """
+    Return a record of :func:`read_records` as a dict of export.FIELDS,
+    the empty values being None.
+    """
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError as error:
+            raise RecordError(f'Invalid JSON: {error}.')
+        if not isinstance(raw, dict):
+            raise RecordError('Invalid JSON: not an object.')
+    record = {field: None if raw.get(field) in ('', None) else raw[field]
+              for field in export.FIELDS}
+    if record['type'] not in (feed.TICKET, feed.REVIEW):
+        raise RecordError(f"Invalid type: {record['type']!r}.")
+    for field in ('id', 'user'):
+        if record[field] is None:
+            raise RecordError(f'Missing {field}.')
+    for field in ('id', 'ticket', 'rating'):
+        if record[field] is not None:
+            try:
+                record[field] = int(record[field])
+            except (TypeError, ValueError):
+                raise RecordError(f'Invalid {field}: {record[field]!r}.')
+    if record['time_created'] is None:
+        record['time_created'] = timezone.now()
+    else:
+        try:
+            record['time_created'] = export.parse_since(
+                str(record['time_created']))
+        except ValueError as error:
+            raise RecordError(error)
+    return record
+
+
+def validate(instance, exclude):
+    """
+    Run the validators of the fields of a model instance, except the
+    excluded ones. Raise RecordError if a value is invalid.
+    """
+    try:
+        instance.clean_fields(exclude=exclude)
+    except ValidationError as error:
+        raise RecordError(' '.join(
+            f'{field}: {" ".join(messages)}'
+            for field, messages in error.message_dict.items()))
+    # the max_length of a TextField is only enforced by the forms
+    for field in instance._meta.fields:
+        value = getattr(instance, field.attname)
+        if isinstance(field, db_models.TextField) and field.max_length \
+                and value and len(value) > field.max_length:
+            raise RecordError(
+                f'{field.name}: Ensure this value has at most '
+                f'{field.max_length} characters (it has {len(value)}).')
+
+
+def store_image(path):
+    """
+    Copy a local image file to the media storage. Return its name in the
+    storage.
+    """
+    try:
+        with Image.open(path) as image:
+            image.verify()
+        with open(path, 'rb') as file:
+            return default_storage.save(Path(path).name, File(file))
+    except (OSError, SyntaxError, ValueError) as error:
+        raise RecordError(f'Invalid image {path}: {error}.')
+
+
+class Importer:
+    """
+    Import batches of records from a source, see :func:`read_records`.
+    :arg: source: Name of the source, the ids of the records being unique
+    in their source.
+    :arg: images_dir: Directory of the image files, whose names are
+    relative to it in the records.
+    :arg: create_users: Create the users missing, without password,
+    instead of rejecting their records.
+    """
+
+    def __init__(self, source, images_dir='.', create_users=False,
+                 image_workers=IMAGE_WORKERS):
+        self.source = source
+        self.images_dir = Path(images_dir)
+        self.create_users = create_users
+        self.image_workers = image_workers
+        # username: id
+        self.user_ids = {}
+
+    def resolve_users(self, names):
+        """
+        Load the ids of the usernames not resolved yet, creating the
+        missing users if create_users is set.
+        """
+        names = set(names) - self.user_ids.keys()
+        if not names:
+            return
+        self.user_ids.update(User.objects.filter(username__in=names)
+                             .values_list('username', 'id'))
+        missing = names - self.user_ids.keys()
+        if missing and self.create_users:
+            password = make_password(None)
+            with transaction.atomic():
+                User.objects.bulk_create(
+                    [User(username=name, password=password)
+                     for name in sorted(missing)], ignore_conflicts=True)
+            self.user_ids.update(User.objects.filter(username__in=missing)
+                                 .values_list('username', 'id'))
+            usernames.refresh()
+
+    def imported(self, content_type, source_ids):
+        """
+        Return the post ids of the source ids already imported, as
+        ``{source_id: post_id}``.
+        """
+        return dict(models.ImportedPost.objects.filter(
+            source=self.source, content_type=content_type,
+            source_id__in=source_ids).values_list('source_id', 'post_id'))
+
+    def build(self, content_type, record, ticket_ids=None):
+        """
+        Return the validated, unsaved post of a record.
+        :arg: ticket_ids: Ids of the imported tickets, by source id.
+        """
+        user_id = self.user_ids.get(record['user'])
+        if user_id is None:
+            raise RecordError(f"Unknown user: {record['user']!r}.")
+        if content_type == feed.TICKET:
+            post = models.Ticket(title=record['title'] or '',
+                                 description=record['description'] or '',
+                                 user_id=user_id,
+                                 time_created=record['time_created'],
+                                 time_updated=record['time_created'])
+            validate(post, exclude=['user', 'image'])
+        else:
+            ticket_id = ticket_ids.get(record['ticket'])
+            if ticket_id is None:
+                raise RecordError(f"Unknown ticket: {record['ticket']!r}.")
+            post = models.Review(ticket_id=ticket_id, rating=record['rating'],
+                                 headline=record['headline'] or '',
+                                 body=record['body'] or '', user_id=user_id,
+                                 time_created=record['time_created'],
+                                 time_updated=record['time_created'])
+            validate(post, exclude=['user', 'ticket'])
+        return post
+
+    def import_batch(self, raws):
+        """
+        Import a batch of records in one transaction, the tickets before
+        the reviews. Return the counts of posts imported as
+        ``{content_type: count}`` and the errors as (index in the batch,
+        message).
+        """
+        errors = []
+        records = {feed.TICKET: [], feed.REVIEW: []}
+        for index, raw in enumerate(raws):
+            try:
+                record = parse(raw)
+            except RecordError as error:
+                errors.append((index, str(error)))
+            else:
+                records[record['type']].append((index, record))
+        self.resolve_users(record['user'] for batch in records.values()
+                           for _, record in batch)
+
+        tickets = self.build_posts(feed.TICKET, records[feed.TICKET],
+                                   errors)
+        self.store_images(tickets, errors)
+        reviews = []
+        with transaction.atomic(), seeding.explicit_times():
+            self.insert(feed.TICKET, tickets)
+            ticket_ids = self.ticket_ids(
+                [record['ticket'] for _, record in records[feed.REVIEW]])
+            reviews = self.build_posts(feed.REVIEW, records[feed.REVIEW],
+                                       errors, ticket_ids)
+            self.insert(feed.REVIEW, reviews)
+            owner_ids = set()
+            for content_type, posts in ((feed.TICKET, tickets),
+                                        (feed.REVIEW, reviews)):
+                owner_ids |= timeline.add_posts(
+                    content_type, [post for _, post in posts])
+                search.index(content_type, [post for _, post in posts])
+            reviewed_ids = {post.ticket_id for _, post in reviews}
+            aggregates.refresh(
+                models.Ticket.objects.filter(id__in=reviewed_ids))
+            ticket_authors = set(models.Ticket.objects
+                                 .filter(id__in=reviewed_ids)
+                                 .values_list('user', flat=True))
+
+        feed_cache.invalidate(owner_ids)
+        # the flux of the followers of the ticket authors flags the tickets
+        # reviewed
+        for author_id in ticket_authors - owner_ids:
+            feed_cache.invalidate_author(author_id)
+        for _, ticket in tickets:
+            if ticket.image:
+                jobs.enqueue('images.build_ticket_variants',
+                             {'ticket_id': ticket.id,
+                              'image_name': ticket.image.name},
+                             key=f'images:variants:{ticket.id}:'
+                                 f'{ticket.image.name}')
+        errors.sort()
+        return {feed.TICKET: len(tickets), feed.REVIEW: len(reviews)}, errors
+
+    def build_posts(self, content_type, records, errors, ticket_ids=None):
+        """
+        Return the validated posts of the records not imported yet, as
+        (record, post), adding the invalid records to the errors.
+        """
+        imported = self.imported(content_type,
+                                 [record['id'] for _, record in records])
+        posts = []
+        for index, record in records:
+            if record['id'] in imported:
+                continue
+            try:
+                post = self.build(content_type, record, ticket_ids)
+            except RecordError as error:
+                errors.append((index, str(error)))
+            else:
+                imported[record['id']] = None
+                posts.append(((index, record), post))
+        return posts
+
+    def store_images(self, tickets, errors):
+        """
+        Copy the images of the tickets to the media storage in parallel,
+        removing the tickets whose image is invalid.
+        """
+        with_image = [(index, record, ticket)
+                      for (index, record), ticket in tickets
+                      if record['image']]
+        if not with_image:
+            return
+
+        def store(item):
+            index, record, ticket = item
+            try:
+                ticket.image.name = store_image(
+                    self.images_dir / record['image'])
+            except RecordError as error:
+                return index, str(error)
+
+        with ThreadPoolExecutor(self.image_workers) as executor:
+            failed = dict(error for error in executor.map(store, with_image)
+                          if error is not None)
+        errors.extend(failed.items())
+        tickets[:] = [((index, record), ticket)
+                      for (index, record), ticket in tickets
+                      if index not in failed]
+
+    def insert(self, content_type, posts):
+        """
+        Insert the posts and record their source ids.
+        """
+        if not posts:
+            return
+        model = {feed.TICKET: models.Ticket, feed.REVIEW: models.Review}
+        model[content_type].objects.bulk_create(
+            [post for _, post in posts])
+        models.ImportedPost.objects.bulk_create([
+            models.ImportedPost(source=self.source, content_type=content_type,
+                                source_id=record['id'], post_id=post.id)
+            for (_, record), post in posts])
+
+    def ticket_ids(self, source_ids):
+        """
+        Return the ids of the existing tickets imported with the source
+        ids, as ``{source_id: ticket_id}``.
+        """
+        imported = self.imported(feed.TICKET, set(source_ids) - {None})
+        existing = set(models.Ticket.objects.filter(id__in=imported.values())
+                       .values_list('id', flat=True))
+        return {source_id: ticket_id for source_id, ticket_id
+                in imported.items() if ticket_id in existing}
+
+
+def read_checkpoint(path):
+    """
+    Return the checkpoint saved at path, or None if there is none.
+    """
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, checkpoint):
+    """
+    Replace the checkpoint saved at path atomically.
+    """
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
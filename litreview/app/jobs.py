@@ -0,0 +1,153 @@
+"""
+Queue of background jobs stored in :model:`app.Job`, run by
+``manage.py runworker``.
+
+A job is a registered function called with the keyword arguments stored
+as the JSON payload of its row. A failing job is retried with an
+exponential backoff until it reaches its max_attempts. A job enqueued
+with an idempotency key is enqueued once, as long as a job with the same
+key is kept (see ``settings.JOBS_RETENTION_DAYS``).
+
+If ``settings.JOBS_EAGER`` is set (the tests), the jobs run at once in
+the code enqueueing them.
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# name: function
+registry = {}
+
+
+def register(name):
+    """
+    Decorator registering a function as the job called name.
+    """
+    def decorator(function):
+        registry[name] = function
+        return function
+    return decorator
+
+
+def enqueue(name, payload=None, key=None, delay=0, max_attempts=None):
+    """
+    Queue a call of the job with the payload as keyword arguments. Return
+    the :model:`app.Job`, or None if the job ran eagerly or a job with the
+    same idempotency key exists.
+
+    The job row is written in the current transaction, if any: the worker
+    only sees the job once it is committed, which is also when an eager job
+    runs.
+    """
+    if name not in registry:
+        raise ValueError(f'Unknown job {name!r}.')
+    payload = payload or {}
+    if settings.JOBS_EAGER:
+        transaction.on_commit(lambda: registry[name](**payload))
+        return None
+    job = models.Job(
+        name=name, payload=payload, idempotency_key=key,
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+        run_after=timezone.now() + timedelta(seconds=delay))
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        if key is None:
+            raise
+        return None
+    return job
+
+
+def retry_delay(attempts):
+    """
+    Return the delay in seconds before the next attempt of a job which
+    failed attempts times, with some jitter spreading the retries of jobs
+    which failed together.
+    """
+    delay = min(settings.JOBS_RETRY_DELAY * 2 ** (attempts - 1),
+                settings.JOBS_MAX_RETRY_DELAY)
+    return delay * random.uniform(0.5, 1)
+
+
+def claim():
+    """
+    Mark the next due job as running and return its id, or None if no job
+    is due. Jobs left running by a dead worker are claimed again after
+    ``settings.JOBS_TIMEOUT``.
+    """
+    now = timezone.now()
+    timed_out = now - timedelta(seconds=settings.JOBS_TIMEOUT)
+    claimable = models.Job.objects.filter(
+        Q(status=models.Job.QUEUED, run_after__lte=now)
+        | Q(status=models.Job.RUNNING, time_started__lt=timed_out))
+    candidates = claimable.order_by('run_after')\
+        .values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        # the update only succeeds in the worker claiming the job first
+        if claimable.filter(id=job_id).update(
+                status=models.Job.RUNNING, attempts=F('attempts') + 1,
+                time_started=now, time_updated=now):
+            return job_id
+    return None
+
+
+def execute(job_id):
+    """
+    Run a claimed job and record its outcome. Return its new status.
+    """
+    job = models.Job.objects.get(id=job_id)
+    changes = {'status': models.Job.DONE, 'last_error': ''}
+    try:
+        if job.attempts > job.max_attempts:
+            raise RuntimeError(f'Timed out after {settings.JOBS_TIMEOUT}s.')
+        registry[job.name](**job.payload)
+    except Exception:
+        changes['last_error'] = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            changes['status'] = models.Job.FAILED
+            logger.error('Job %s failed:\n%s', job, changes['last_error'])
+        else:
+            changes['status'] = models.Job.QUEUED
+            changes['run_after'] = timezone.now() + timedelta(
+                seconds=retry_delay(job.attempts))
+            logger.warning('Job %s failed, attempt %s/%s:\n%s', job,
+                           job.attempts, job.max_attempts,
+                           changes['last_error'])
+    changes['time_updated'] = timezone.now()
+    models.Job.objects.filter(id=job.id).update(**changes)
+    return changes['status']
+
+
+def run(job_id):
+    """
+    Execute a claimed job in a worker thread or process.
+    """
+    try:
+        return execute(job_id)
+    finally:
+        # the connections are per thread: close the one of this thread
+        connection.close()
+
+
+def purge():
+    """
+    Delete the jobs finished for more than ``settings.JOBS_RETENTION_DAYS``.
+    Return the number of jobs deleted.
+    """
+    finished_before = timezone.now() - timedelta(
+        days=settings.JOBS_RETENTION_DAYS)
+    deleted, _ = models.Job.objects.filter(
+        status__in=[models.Job.DONE, models.Job.FAILED],
+        time_updated__lt=finished_before).delete()
+    return deleted
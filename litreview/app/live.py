@@ -0,0 +1,262 @@
+"""
+Live notifications of the new posts, pushed to the flux pages of the
+followers of their author as server-sent events.
+
+The events are served under ASGI by :func:`events_app`, routed by
+:mod:`litreview.asgi`: each connection is a coroutine waiting on its own
+bounded asyncio queue, so that an idle connection holds no thread. The
+:class:`Hub` of each process delivers the events to the queues of the
+connected followers of their author.
+
+The creation of a ticket or a review publishes a compact event, once
+committed, through the backend of ``settings.LIVE_EVENTS_BACKEND``:
+:class:`LocalBackend` hands it to the hub of the current process, which
+is enough when one ASGI process serves the pages and the events, and
+:class:`DatabaseBackend` stores it in :model:`app.LiveEvent`, polled by
+the hub of every process.
+"""
+import asyncio
+import functools
+import json
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.db import DatabaseError, transaction
+from django.http import HttpRequest, parse_cookie
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import follow_graph, models
+
+logger = logging.getLogger(__name__)
+
+# seconds before the browsers reconnect a closed connection
+RETRY_MS = 10000
+
+
+class Hub:
+    """
+    Connections of the current process to the events, by user id, bound
+    to the event loop of the ASGI server.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        # user id: queues of the connections of the user
+        self.connections = defaultdict(set)
+        # dispatches running, referenced until they finish
+        self.tasks = set()
+        get_backend().start(self)
+
+    def connect(self, user_id):
+        queue = asyncio.Queue(settings.LIVE_QUEUE_SIZE)
+        self.connections[user_id].add(queue)
+        return queue
+
+    def disconnect(self, user_id, queue):
+        self.connections[user_id].discard(queue)
+        if not self.connections[user_id]:
+            del self.connections[user_id]
+
+    async def dispatch(self, event):
+        """
+        Queue an event for the connections of the followers of its author.
+        """
+        if not self.connections:
+            return
+        followers = await sync_to_async(follow_graph.followers)(
+            event['author'])
+        for user_id in followers & self.connections.keys():
+            for queue in self.connections[user_id]:
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # a slow client: its page is outdated anyway
+                    pass
+
+    def publish_threadsafe(self, event):
+        """
+        Dispatch an event published by another thread, e.g. a view.
+        """
+        def schedule():
+            task = self.loop.create_task(self.dispatch(event))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        self.loop.call_soon_threadsafe(schedule)
+
+
+_hub = None
+
+
+def get_hub():
+    """
+    Return the hub of the running event loop, created on first use.
+    """
+    global _hub
+    loop = asyncio.get_running_loop()
+    if _hub is None or _hub.loop is not loop:
+        _hub = Hub(loop)
+    return _hub
+
+
+class LocalBackend:
+    """
+    Deliver the events to the connections of the current process.
+    """
+
+    def start(self, hub):
+        pass
+
+    def publish(self, event):
+        if _hub is not None and not _hub.loop.is_closed():
+            _hub.publish_threadsafe(event)
+
+
+class DatabaseBackend:
+    """
+    Deliver the events to the connections of every process, through
+    :model:`app.LiveEvent` polled every ``settings.LIVE_POLL_INTERVAL``
+    seconds by each hub. Each hub also deletes the expired events, once
+    every ``settings.LIVE_EVENTS_RETENTION`` seconds.
+    """
+
+    def start(self, hub):
+        task = hub.loop.create_task(self.poll(hub))
+        hub.tasks.add(task)
+
+    def publish(self, event):
+        models.LiveEvent.objects.create(payload=event)
+
+    @staticmethod
+    def last_event_id():
+        return models.LiveEvent.objects.order_by('-id')\
+            .values_list('id', flat=True).first() or 0
+
+    @staticmethod
+    def events_after(last_id):
+        """
+        Return the events published after last_id as (id, payload).
+        """
+        return list(models.LiveEvent.objects.filter(id__gt=last_id)
+                    .order_by('id').values_list('id', 'payload'))
+
+    @staticmethod
+    def expire_events():
+        expired = timezone.now() \
+            - timedelta(seconds=settings.LIVE_EVENTS_RETENTION)
+        models.LiveEvent.objects.filter(time_created__lt=expired).delete()
+
+    async def poll(self, hub):
+        last_id = None
+        expire_at = hub.loop.time()
+        while True:
+            # a failing query, e.g. a locked database, is retried by the
+            # next poll
+            try:
+                if last_id is None:
+                    # the events published before the start are not sent
+                    last_id = await sync_to_async(self.last_event_id)()
+                else:
+                    for last_id, event in await sync_to_async(
+                            self.events_after)(last_id):
+                        await hub.dispatch(event)
+                if hub.loop.time() >= expire_at:
+                    await sync_to_async(self.expire_events)()
+                    expire_at = hub.loop.time() \
+                        + settings.LIVE_EVENTS_RETENTION
+            except DatabaseError:
+                logger.exception('Polling of the live events failed.')
+            await asyncio.sleep(settings.LIVE_POLL_INTERVAL)
+
+
+@functools.lru_cache(maxsize=None)
+def get_backend():
+    return import_string(settings.LIVE_EVENTS_BACKEND)()
+
+
+def publish_post(content_type, post):
+    """
+    Publish the creation of a post once the transaction creating it, in its
+    database, is committed.
+    """
+    event = {'type': content_type, 'id': post.id, 'author': post.user_id}
+    transaction.on_commit(lambda: get_backend().publish(event),
+                          using=post._state.db)
+
+
+def session_user_id(scope):
+    """
+    Return the id of the user logged in by the session cookie of an ASGI
+    HTTP scope, or None.
+    """
+    cookies = {}
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies = parse_cookie(value.decode('latin-1'))
+    request = HttpRequest()
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(
+        cookies.get(settings.SESSION_COOKIE_NAME))
+    user = auth.get_user(request)
+    return user.id if user.is_authenticated else None
+
+
+def format_event(event):
+    return f'event: post\ndata: {json.dumps(event)}\n\n'.encode()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def events_app(scope, receive, send):
+    """
+    ASGI application streaming the events of the followed authors to the
+    user logged in, with a comment every
+    ``settings.LIVE_HEARTBEAT_INTERVAL`` seconds keeping the connection
+    open through the proxies.
+    """
+    user_id = await sync_to_async(session_user_id)(scope)
+    if user_id is None:
+        await send({'type': 'http.response.start', 'status': 403,
+                    'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.body', 'body': b'Forbidden'})
+        return
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        # disables the buffering of nginx
+        (b'x-accel-buffering', b'no'),
+    ]})
+    hub = get_hub()
+    queue = hub.connect(user_id)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.body',
+                    'body': f'retry: {RETRY_MS}\n\n'.encode(),
+                    'more_body': True})
+        while True:
+            event = asyncio.ensure_future(queue.get())
+            await asyncio.wait({event, disconnected},
+                               timeout=settings.LIVE_HEARTBEAT_INTERVAL,
+                               return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                event.cancel()
+                break
+            if event.done():
+                body = format_event(event.result())
+            else:
+                event.cancel()
+                body = b': heartbeat\n\n'
+            await send({'type': 'http.response.body', 'body': body,
+                        'more_body': True})
+    finally:
+        hub.disconnect(user_id, queue)
+        disconnected.cancel()
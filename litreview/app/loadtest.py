@@ -0,0 +1,312 @@
+"""
+End-to-end load test: virtual users logged in with their own cookies
+request the pages of a running server over HTTP, like browsers, each in
+its own thread, picking their actions at random from a weighted mix.
+
+The server is either the WSGI application of the project, served by
+:func:`start_server` in the current process, or any server given by its
+URL, e.g. the ASGI application under uvicorn. The latencies are measured
+by the client, and summarized per URL name and method by
+:func:`summarize`.
+"""
+import http.client
+import http.cookies
+import io
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+
+from django.conf import settings
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler,
+                                          get_internal_wsgi_application)
+from django.urls import resolve, reverse
+from PIL import Image
+
+from . import benchmark
+
+USERNAME_PREFIX = 'loadtest'
+PASSWORD = 'litreview'
+# seconds before a request is abandoned
+TIMEOUT = 30
+IMAGE_SIZE = (600, 900)
+# weight of the actions of the virtual users, see VirtualUser
+DEFAULT_MIX = {
+    'flux': 50,
+    'posts': 15,
+    'create_ticket': 8,
+    'create_review': 10,
+    'follow': 6,
+    'unfollow': 6,
+    'login': 5,
+}
+
+
+def parse_mix(text):
+    """
+    Return the weights of the actions of text, such as 'flux=3,posts=1';
+    the actions left out are not run. Raise ValueError if text is invalid.
+    """
+    mix = {}
+    for item in text.split(','):
+        action, _, weight = item.partition('=')
+        action = action.strip()
+        if action not in DEFAULT_MIX:
+            raise ValueError(f'unknown action {action!r}, not one of '
+                             f"{', '.join(DEFAULT_MIX)}")
+        mix[action] = float(weight)
+        if mix[action] < 0:
+            raise ValueError(f'negative weight of {action}')
+    if not sum(mix.values()):
+        raise ValueError('every weight is zero')
+    return mix
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    """
+    Serve the WSGI application on a free port of localhost from a
+    background thread, one thread per connection like runserver. Return
+    the server, stopped by its shutdown() method.
+    """
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietRequestHandler)
+    server.set_app(get_internal_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def png_image(size=IMAGE_SIZE):
+    image = Image.new('RGB', size, (120, 90, 60))
+    content = io.BytesIO()
+    image.save(content, format='PNG')
+    return content.getvalue()
+
+
+def encode_multipart(fields, files):
+    """
+    Return the multipart/form-data body of the fields ({name: value}) and
+    files ({name: (filename, content)}), and its content type.
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; '
+                     f'name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; '
+                     f'name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'
+                     .encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class HttpClient:
+    """
+    Client of a virtual user: keeps its connection open and its cookies,
+    and sends the CSRF token of its cookie with its POST requests.
+    """
+
+    def __init__(self, base_url):
+        url = urllib.parse.urlsplit(base_url)
+        self.connection = http.client.HTTPConnection(
+            url.hostname, url.port, timeout=TIMEOUT)
+        self.cookies = http.cookies.SimpleCookie()
+
+    def request(self, method, path, fields=None, files=None):
+        """
+        Send the request and read the response. Return its status.
+        """
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                f'{name}={morsel.value}'
+                for name, morsel in self.cookies.items())
+        body = None
+        if method == 'POST':
+            if settings.CSRF_COOKIE_NAME in self.cookies:
+                headers['X-CSRFToken'] = \
+                    self.cookies[settings.CSRF_COOKIE_NAME].value
+            body, headers['Content-Type'] = encode_multipart(fields or {},
+                                                             files or {})
+        try:
+            self.connection.request(method, path, body=body,
+                                    headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            # reconnects on the next request
+            self.connection.close()
+            raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(header)
+            for name, morsel in list(self.cookies.items()):
+                # e.g. the session cookie after a logout
+                if morsel['max-age'] == '0':
+                    del self.cookies[name]
+        return response.status
+
+    def close(self):
+        self.connection.close()
+
+
+class VirtualUser:
+    """
+    A user logged in through the login page, then running actions picked
+    at random from the mix until stopped: reading the flux and posts
+    pages, posting tickets with an image and reviews of the tickets of
+    ticket_ids, following and unfollowing the authors ({username: id}),
+    and logging out then in again. followed holds the authors followed by
+    the user ({username: id}), kept up to date.
+
+    Each request is recorded in results as (name, latency in ms, success),
+    the name being the method and URL name of the request, e.g.
+    'POST create_ticket'.
+    """
+
+    def __init__(self, base_url, username, followed, authors, ticket_ids,
+                 image, rng):
+        self.client = HttpClient(base_url)
+        self.username = username
+        self.authors = authors
+        self.author_names = list(authors)
+        self.ticket_ids = ticket_ids
+        self.image = image
+        self.rng = rng
+        self.followed = dict(followed)
+        self.results = []
+
+    def run(self, mix, stop, think_time=0.0):
+        actions, weights = list(mix), list(mix.values())
+        try:
+            self.login()
+            while not stop.is_set():
+                action = self.rng.choices(actions, weights)[0]
+                getattr(self, action)()
+                if think_time:
+                    stop.wait(self.rng.uniform(0, 2 * think_time))
+        finally:
+            self.client.close()
+
+    def measure(self, method, url, expected=200, **data):
+        """
+        Request the url and record its latency. Return True if it answered
+        the expected status.
+        """
+        start = time.perf_counter()
+        try:
+            success = self.client.request(method, url, **data) == expected
+        except (OSError, http.client.HTTPException):
+            success = False
+        latency = (time.perf_counter() - start) * 1000
+        name = resolve(urllib.parse.urlsplit(url).path).url_name
+        self.results.append((f'{method} {name}', latency, success))
+        return success
+
+    def login(self):
+        if settings.SESSION_COOKIE_NAME in self.client.cookies:
+            self.measure('GET', reverse('logout'), expected=302)
+        self.measure('GET', reverse('login'))
+        self.measure('POST', reverse('login'), expected=302,
+                     fields={'username': self.username,
+                             'password': PASSWORD})
+
+    def flux(self):
+        self.measure('GET', reverse('flux'))
+
+    def posts(self):
+        self.measure('GET', reverse('posts'))
+
+    def create_ticket(self):
+        url = reverse('create_ticket')
+        if self.measure('GET', url):
+            self.measure('POST', url, expected=302, fields={
+                'title': 'Test de charge',
+                'description': 'Billet du test de charge.',
+            }, files={'image': ('couverture.png', self.image)})
+
+    def create_review(self):
+        url = reverse('create_review', args=[self.rng.choice(self.ticket_ids)])
+        if self.measure('GET', url):
+            self.measure('POST', url, expected=302, fields={
+                'headline': 'Test de charge',
+                'rating': self.rng.randint(0, 5),
+                'body': 'Critique du test de charge.',
+            })
+
+    def follow(self):
+        username = self.rng.choice(self.author_names)
+        if username in self.followed:
+            return self.unfollow()
+        url = reverse('subscriptions')
+        if self.measure('GET', url) \
+                and self.measure('POST', url, expected=302,
+                                 fields={'username': username}):
+            self.followed[username] = self.authors[username]
+
+    def unfollow(self):
+        if not self.followed:
+            return self.follow()
+        username = self.rng.choice(list(self.followed))
+        if self.measure('POST', reverse('unfollow_user',
+                                        args=[self.followed[username]]),
+                        expected=302):
+            del self.followed[username]
+
+
+def run(base_url, users, authors, ticket_ids, mix, duration,
+        think_time=0.0, seed=None):
+    """
+    Run a virtual user per user ({username: {followed username: id}}) for
+    duration seconds, see :class:`VirtualUser`. Return the results of every
+    request and the elapsed time.
+    """
+    image = png_image()
+    stop = threading.Event()
+    users = [VirtualUser(base_url, username, followed, authors, ticket_ids,
+                         image, random.Random(None if seed is None
+                                              else seed + index))
+             for index, (username, followed) in enumerate(users.items())]
+    threads = [threading.Thread(target=user.run,
+                                args=(mix, stop, think_time))
+               for user in users]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return [result for user in users for result in user.results], elapsed
+
+
+def summarize(results, elapsed):
+    """
+    Return the throughput, error rate and latency percentiles of the
+    results of :func:`run`, for all the requests ('total') and per name.
+    """
+    groups = {'total': results}
+    for result in results:
+        groups.setdefault(result[0], []).append(result)
+    summary = {}
+    for name, group in sorted(groups.items()):
+        latencies = [latency for _, latency, _ in group]
+        errors = sum(not success for _, _, success in group)
+        summary[name] = {
+            'requests': len(group),
+            'per_second': round(len(group) / elapsed, 2),
+            'errors': errors,
+            'error_rate': round(errors / len(group), 4),
+            'p50_ms': round(benchmark.percentile(latencies, 50), 2),
+            'p95_ms': round(benchmark.percentile(latencies, 95), 2),
+            'p99_ms': round(benchmark.percentile(latencies, 99), 2),
+        }
+    return summary
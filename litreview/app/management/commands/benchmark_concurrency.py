@@ -0,0 +1,165 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from app import benchmark, database, models, sharding
+
+
+class Command(BaseCommand):
+    help = ('Measure the throughput and latency of threads reading the flux '
+            'pages, alone then while other threads create tickets and '
+            'reviews. The posts created are deleted at the end.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8,
+                            help='Threads requesting the flux pages '
+                                 '(default: 8).')
+        parser.add_argument('--writers', type=int, default=2,
+                            help='Threads creating posts (default: 2).')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds of each phase (default: 10).')
+        parser.add_argument('--viewers', type=int, default=50,
+                            help='Number of users, among those following '
+                                 'the most users, whose flux is requested '
+                                 '(default: 50).')
+
+    def handle(self, *args, **options):
+        if options['readers'] < 1 or options['writers'] < 1:
+            raise CommandError('At least one reader and one writer are '
+                               'needed.')
+        viewers = list(User.objects.annotate(follows=Count('following'))
+                       .filter(follows__gt=0).order_by('-follows')
+                       [:options['viewers']])
+        if not viewers:
+            raise CommandError('There is no follow: run seed_litreview.')
+        # the writers post as users followed by the viewers, whose pages
+        # they change
+        authors = list(models.UserFollows.objects.filter(user__in=viewers)
+                       .values_list('followed_user', flat=True)
+                       .distinct()[:1000])
+        with connections[database.PRIMARY].cursor() as cursor:
+            journal_mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+        self.stdout.write(
+            f"{options['readers']} reader(s) of the flux of "
+            f"{len(viewers)} user(s), {options['writers']} writer(s), "
+            f"journal mode {journal_mode}, "
+            f"{'with' if database.replica_configured() else 'without'} "
+            f'replica.')
+        self.stdout.write(f"{'phase':<10}{'reads/s':>10}{'p50 ms':>10}"
+                          f"{'p95 ms':>10}{'errors':>8}{'writes/s':>10}")
+
+        self.created = []
+        # the writers run the fan-out of their posts, like runworker
+        with override_settings(JOBS_EAGER=True):
+            try:
+                self.report('reads', self.run_phase(
+                    viewers, authors, 0, options))
+                self.report('+ writes', self.run_phase(
+                    viewers, authors, options['writers'], options))
+            finally:
+                for manager in sharding.managers(models.Ticket):
+                    manager.filter(id__in=self.created).delete()
+        self.stdout.write(f'{len(self.created)} ticket(s) created, and '
+                          f'their reviews, deleted.')
+
+    def run_phase(self, viewers, authors, writers, options):
+        """
+        Run the readers and writers threads for the duration of a phase.
+        Return the read latencies in ms, the number of failed reads, the
+        number of writes and the elapsed time.
+        """
+        clients = []
+        host = benchmark.client_host()
+        for index in range(options['readers']):
+            client = Client(SERVER_NAME=host)
+            client.force_login(viewers[index % len(viewers)])
+            clients.append(client)
+        url = reverse('flux')
+        stop = threading.Event()
+        results = {'latencies': [], 'errors': 0, 'writes': 0}
+        lock = threading.Lock()
+
+        def read(client):
+            latencies, errors = [], 0
+            try:
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        response = client.get(url)
+                    except Exception:
+                        errors += 1
+                        continue
+                    if response.status_code == 200:
+                        latencies.append((time.perf_counter() - start) * 1000)
+                    else:
+                        errors += 1
+            finally:
+                connections.close_all()
+            with lock:
+                results['latencies'] += latencies
+                results['errors'] += errors
+
+        def write():
+            writes = 0
+            try:
+                while not stop.is_set():
+                    writes += self.write_post(random.choice(authors))
+            finally:
+                connections.close_all()
+            with lock:
+                results['writes'] += writes
+
+        threads = [threading.Thread(target=read, args=(client,))
+                   for client in clients]
+        threads += [threading.Thread(target=write) for _ in range(writers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+        results['elapsed'] = time.perf_counter() - start
+        return results
+
+    def write_post(self, author_id):
+        """
+        Create a ticket, or a review of a ticket created earlier, like the
+        views. Return 1, or 0 if the database was busy.
+        """
+        try:
+            with transaction.atomic():
+                if self.created and random.random() < 0.5:
+                    models.Review.objects.create(
+                        ticket_id=random.choice(self.created),
+                        user_id=author_id, rating=random.randint(0, 5),
+                        headline='Benchmark', body='Critique de test.')
+                    return 1
+                ticket = models.Ticket.objects.create(
+                    user_id=author_id, title='Benchmark',
+                    description='Billet de test.')
+        except Exception as error:
+            # e.g. database is locked
+            self.stderr.write(f'Write error: {error}')
+            return 0
+        self.created.append(ticket.id)
+        return 1
+
+    def report(self, phase, results):
+        latencies, elapsed = results['latencies'], results['elapsed']
+        if not latencies:
+            raise CommandError(f'Every read failed ({phase}).')
+        self.stdout.write(
+            f"{phase:<10}{len(latencies) / elapsed:>10.1f}"
+            f"{benchmark.percentile(latencies, 50):>10.2f}"
+            f"{benchmark.percentile(latencies, 95):>10.2f}"
+            f"{results['errors']:>8}"
+            f"{results['writes'] / elapsed:>10.1f}")
@@ -0,0 +1,131 @@
+import json
+import platform
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from app import benchmark, follow_graph
+
+VIEWS = {
+    'flux': ('flux', {}),
+    'posts': ('posts', {}),
+    'subscriptions': ('subscriptions', {}),
+    'autocomplete': ('autocomplete_usernames', {'q': 'se'}),
+}
+
+
+class Command(BaseCommand):
+    help = ('Measure the latency percentiles, number of queries and peak '
+            'memory of the views, requested with the test client, and '
+            'compare them with a saved baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('views', nargs='*',
+                            help=f"Views to measure among "
+                                 f"{', '.join(VIEWS)} (default: all).")
+        parser.add_argument('--user',
+                            help='Username of the viewer (default: the user '
+                                 'following the most users).')
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Number of measured requests per view '
+                                 '(default: 50).')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Number of requests per view before the '
+                                 'measures (default: 5).')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the caches before each request.')
+        parser.add_argument('--save', type=Path,
+                            help='Save the measures as a JSON baseline.')
+        parser.add_argument('--compare', type=Path,
+                            help='Compare the measures with a JSON '
+                                 'baseline.')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='Change in percent above which a measure '
+                                 'is reported as a regression '
+                                 '(default: 10).')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1:
+            raise CommandError('At least one request is needed.')
+        unknown = set(options['views']).difference(VIEWS)
+        if unknown:
+            raise CommandError(f"Unknown view(s): {', '.join(unknown)}.")
+        viewer = self.viewer(options['user'])
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(options['compare'].read_text())
+            except (OSError, ValueError) as error:
+                raise CommandError(f'Invalid baseline: {error}')
+
+        client = Client(SERVER_NAME=benchmark.client_host())
+        client.force_login(viewer)
+        before_request = clear_caches if options['cold'] else None
+        self.stdout.write(
+            f"Viewer {viewer.username}, {options['requests']} requests per "
+            f"view{', cold caches' if options['cold'] else ''}.")
+        self.stdout.write(f"{'view':<14}{'p50 ms':>10}{'p95 ms':>10}"
+                          f"{'queries':>9}{'peak KiB':>10}")
+        measures = {}
+        for name in options['views'] or VIEWS:
+            url_name, params = VIEWS[name]
+            url = reverse(url_name)
+            if params:
+                url += '?' + '&'.join(f'{key}={value}'
+                                      for key, value in params.items())
+            measure = benchmark.measure_view(
+                client, url, options['requests'], options['warmup'],
+                before_request)
+            measures[name] = measure
+            self.stdout.write(
+                f"{name:<14}{measure['p50_ms']:>10.2f}"
+                f"{measure['p95_ms']:>10.2f}{measure['queries']:>9}"
+                f"{measure['peak_kib']:>10.1f}")
+
+        if baseline is not None:
+            self.compare(measures, baseline['views'], options['threshold'])
+        if options['save']:
+            options['save'].write_text(json.dumps({
+                'time': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'viewer': viewer.username,
+                'cold': options['cold'],
+                'views': measures,
+            }, indent=2) + '\n')
+            self.stdout.write(f"Baseline saved to {options['save']}.")
+
+    def viewer(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'Unknown user {username}.')
+        viewer = User.objects.annotate(follows=Count('following'))\
+            .order_by('-follows').first()
+        if viewer is None:
+            raise CommandError('There is no user: run seed_litreview.')
+        return viewer
+
+    def compare(self, measures, baseline, threshold):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            'Changes since the baseline'))
+        for name, key, before, after, change in benchmark.compare(
+                measures, baseline):
+            line = f'{name:<14}{key:<10}{before:>10} -> {after:<10}' \
+                   f'{change:+.1f}%'
+            if change > threshold:
+                line = self.style.ERROR(line + ' regression')
+            elif change < -threshold:
+                line = self.style.SUCCESS(line)
+            self.stdout.write(line)
+
+
+def clear_caches():
+    cache.clear()
+    follow_graph.clear()
@@ -0,0 +1,92 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from app import cards, feed, feed_cache, images, models, sharding
+
+BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = ('Generate the resized variants of the ticket images, in '
+            'parallel across processes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Number of worker processes '
+                                 '(default: number of cores).')
+        parser.add_argument('--all', action='store_true',
+                            help='Regenerate the variants of the tickets '
+                                 'that already have some.')
+
+    def handle(self, *args, **options):
+        tickets = []
+        # database holding each ticket
+        self.databases = {}
+        for manager in sharding.managers(models.Ticket):
+            queryset = manager.exclude(image='').exclude(image=None)
+            if not options['all']:
+                queryset = queryset.filter(image_variants={})
+            rows = list(queryset.values_list('id', 'image', 'image_variants'))
+            self.databases.update((row[0], manager.db) for row in rows)
+            tickets += rows
+        previous_variants = {ticket_id: variants
+                             for ticket_id, _, variants in tickets}
+        self.stdout.write(f'{len(tickets)} image(s) to process '
+                          f"with {options['workers']} worker(s).")
+
+        start = time.perf_counter()
+        failed, updated, replaced = 0, [], []
+        # the worker processes must not inherit the open connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {pool.submit(images.build_variants, image): ticket_id
+                       for ticket_id, image, _ in tickets}
+            for future in as_completed(futures):
+                try:
+                    variants = future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(
+                        f'Ticket {futures[future]}: {error}')
+                    continue
+                updated.append(models.Ticket(id=futures[future],
+                                             image_variants=variants))
+                replaced.append(previous_variants[futures[future]])
+                if len(updated) >= BATCH_SIZE:
+                    self.save(updated, replaced)
+                    updated, replaced = [], []
+        self.save(updated, replaced)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(tickets) - failed} image(s) processed, {failed} failed, '
+            f'in {elapsed:.1f}s.'))
+
+    def save(self, tickets, replaced_variants):
+        now = timezone.now()
+        by_database = {}
+        for ticket in tickets:
+            ticket.time_updated = now
+            by_database.setdefault(self.databases[ticket.id], []).append(
+                ticket)
+        for alias, tickets in by_database.items():
+            ticket_ids = [ticket.id for ticket in tickets]
+            previous = list(models.Ticket.objects.using(alias)
+                            .filter(id__in=ticket_ids)
+                            .values_list('id', 'time_updated', 'user'))
+            cards.invalidate(feed.TICKET,
+                             [(ticket_id, time_updated) for ticket_id,
+                              time_updated, _ in previous])
+            models.Ticket.objects.using(alias).bulk_update(
+                tickets, ['image_variants', 'time_updated'])
+            feed_cache.invalidate_authors(
+                {author_id for *_, author_id in previous})
+            # the reviews display the images of the tickets
+            cards.touch_reviews(ticket_ids, now, alias)
+        for variants in replaced_variants:
+            images.delete_variants(variants)
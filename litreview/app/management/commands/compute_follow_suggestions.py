@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import suggestions
+
+
+class Command(BaseCommand):
+    help = ('Compute the users suggested to each user on the subscriptions '
+            'page: the users followed by the users they follow (needs NumPy '
+            'and SciPy).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only recompute the suggestions of the '
+                                 'users who followed or unfollowed someone '
+                                 'since the last run, and of their '
+                                 'followers.')
+        parser.add_argument('--chunk-size', type=int,
+                            default=suggestions.CHUNK_ROWS,
+                            help='Users whose scores are computed at once, '
+                                 'bounding the memory used (default: '
+                                 f'{suggestions.CHUNK_ROWS}).')
+
+    def handle(self, *args, **options):
+        if not suggestions.available():
+            raise CommandError('NumPy and SciPy are needed: pip install '
+                               'numpy scipy.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1.')
+        start = time.perf_counter()
+        users, stored = suggestions.compute(options['incremental'],
+                                            options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{stored} suggestion(s) computed for {users} user(s) in '
+            f'{time.perf_counter() - start:.2f}s.'))
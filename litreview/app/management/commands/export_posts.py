@@ -0,0 +1,53 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import export
+
+
+class Command(BaseCommand):
+    help = ('Export the tickets and reviews as NDJSON or CSV, streamed '
+            'with a constant memory use.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Authors of the posts to export (default: '
+                                 'every user).')
+        parser.add_argument('--format', choices=export.FORMATS,
+                            default='ndjson',
+                            help='Output format (default: ndjson).')
+        parser.add_argument('--since',
+                            help='Only export the posts created after this '
+                                 'ISO 8601 date or date and time, e.g. the '
+                                 'latest time_created of the previous '
+                                 'export.')
+        parser.add_argument('--output',
+                            help='File written (default: standard '
+                                 'output).')
+
+    def handle(self, *args, **options):
+        users = None
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+        since = None
+        if options['since']:
+            try:
+                since = export.parse_since(options['since'])
+            except ValueError as error:
+                raise CommandError(error)
+
+        lines = export.FORMATS[options['format']][2]
+        exported = 0
+
+        def records():
+            nonlocal exported
+            for record in export.records(users, since):
+                exported += 1
+                yield record
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines(records()))
+        else:
+            for line in lines(records()):
+                self.stdout.write(line, ending='')
+        self.stderr.write(f'{exported} post(s) exported.')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app import feed_cache
+
+
+class Command(BaseCommand):
+    help = 'Display the hits and misses counters of the feed cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Reset the counters after displaying them.')
+
+    def handle(self, *args, **options):
+        stats = feed_cache.stats()
+        requests = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / requests if requests else 0
+        self.stdout.write(f"hits: {stats['hits']}")
+        self.stdout.write(f"misses: {stats['misses']}")
+        self.stdout.write(f'hit ratio: {ratio:.1%}')
+        if options['reset']:
+            feed_cache.reset_stats()
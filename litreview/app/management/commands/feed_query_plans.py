@@ -0,0 +1,98 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from app import feed, follow_graph, models, seeding, timeline
+
+INDEXED_MODELS = (models.Ticket, models.Review, models.UserFollows)
+
+
+class Command(BaseCommand):
+    help = ('Display the SQLite query plans (EXPLAIN QUERY PLAN) of the '
+            'feed and follow graph queries, without then with the feed '
+            'indexes. Run it on a copy of the database: --seed-posts '
+            'inserts synthetic data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-posts', type=int, default=0,
+                            help='Number of synthetic posts to insert first '
+                                 '(e.g. 1000000).')
+        parser.add_argument('--seed-users', type=int, default=1000,
+                            help='Number of synthetic users writing the '
+                                 'posts.')
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Number of users followed by each '
+                                 'synthetic user.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN requires SQLite.')
+        if options['seed_posts']:
+            self.seed(options)
+
+        viewer = User.objects.annotate(follows=Count('following'))\
+            .order_by('-follows').first()
+        if viewer is None:
+            raise CommandError('There is no user: use --seed-posts.')
+        queries = self.queries(viewer)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            'Before (without the feed indexes)'))
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for model in INDEXED_MODELS:
+                    for index in model._meta.indexes:
+                        name = connection.ops.quote_name(index.name)
+                        cursor.execute(f'DROP INDEX {name}')
+            self.explain(queries)
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            'After (with the feed indexes)'))
+        self.explain(queries)
+
+    def seed(self, options):
+        self.stdout.write(f"Seeding {options['seed_posts']} posts...")
+        user_ids = seeding.create_users(options['seed_users'])
+        seeding.create_follows(user_ids, options['follows'])
+        seeding.create_posts(user_ids, options['seed_posts'])
+        with connection.cursor() as cursor:
+            # gives the query planner the statistics of the new indexes
+            cursor.execute('ANALYZE')
+
+    def queries(self, viewer):
+        followed = list(models.UserFollows.objects.filter(user=viewer)
+                        .values_list('followed_user', flat=True))
+        deep_cursor = (timezone.now() - timedelta(days=365),
+                       feed.TICKET, 0)
+        return {
+            'posts page': feed.page_queryset(
+                feed.post_sources([viewer])),
+            'posts page, one year deep': feed.page_queryset(
+                feed.post_sources([viewer]), deep_cursor),
+            'flux merged from the post tables': feed.page_queryset(
+                feed.post_sources([viewer.id, *followed])),
+            'flux read from the timeline': feed.page_queryset(
+                timeline.sources(viewer.id)),
+            'followers': models.UserFollows.objects.filter(
+                followed_user=viewer).values_list('user'),
+            'followed users': models.UserFollows.objects.filter(
+                user=viewer).values_list('followed_user'),
+            'high-follower authors': follow_graph.high_follower_queryset(),
+        }
+
+    def explain(self, queries):
+        with connection.cursor() as cursor:
+            for name, queryset in queries.items():
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                self.stdout.write(f'  {name}')
+                depths = {0: 0}
+                for node_id, parent_id, _, detail in cursor.fetchall():
+                    depths[node_id] = depths.get(parent_id, 0) + 1
+                    self.stdout.write(
+                        '    ' + '  ' * depths[node_id] + detail)
@@ -0,0 +1,132 @@
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import feed, imports, sharding
+
+# seconds between two progress reports
+PROGRESS_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = ('Import tickets and reviews from an NDJSON or CSV file in the '
+            'format of export_posts, in batches, resuming from a checkpoint '
+            'after a crash.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File imported.')
+        parser.add_argument('--format', choices=imports.FORMATS,
+                            help='Format of the file (default: csv for a '
+                                 '.csv file, ndjson otherwise).')
+        parser.add_argument('--source',
+                            help='Name of the source of the file, the '
+                                 'posts of a source being imported once '
+                                 '(default: the file name).')
+        parser.add_argument('--batch-size', type=int,
+                            default=imports.BATCH_SIZE,
+                            help='Records imported per transaction '
+                                 f'(default: {imports.BATCH_SIZE}).')
+        parser.add_argument('--image-workers', type=int,
+                            default=imports.IMAGE_WORKERS,
+                            help='Threads copying the images '
+                                 f'(default: {imports.IMAGE_WORKERS}).')
+        parser.add_argument('--images-dir',
+                            help='Directory of the image files named by the '
+                                 'records (default: the directory of the '
+                                 'file).')
+        parser.add_argument('--create-users', action='store_true',
+                            help='Create the missing users, without '
+                                 'password, instead of rejecting their '
+                                 'posts.')
+        parser.add_argument('--errors',
+                            help='NDJSON file receiving the rejected records '
+                                 '(default: standard error).')
+        parser.add_argument('--checkpoint',
+                            help='Checkpoint file (default: the file path '
+                                 'followed by .checkpoint).')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint and import the file '
+                                 'from the start.')
+
+    def handle(self, *args, **options):
+        path = Path(options['path']).resolve()
+        if not path.is_file():
+            raise CommandError(f'No file {path}.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+        file_format = options['format'] \
+            or ('csv' if path.suffix.lower() == '.csv' else 'ndjson')
+        source = options['source'] or path.name
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+
+        checkpoint = {'input': str(path), 'source': source, 'position': 0,
+                      feed.TICKET: 0, feed.REVIEW: 0, 'rejected': 0}
+        saved = None if options['restart'] \
+            else imports.read_checkpoint(checkpoint_path)
+        if saved is not None:
+            if (saved['input'], saved['source']) != (str(path), source):
+                raise CommandError(
+                    f'The checkpoint {checkpoint_path} is not one of this '
+                    f'file and source: pass --restart to ignore it.')
+            checkpoint = saved
+            self.stdout.write(f"Resuming after record {saved['position']}.")
+
+        importer = imports.Importer(
+            source, images_dir=options['images_dir'] or path.parent,
+            create_users=options['create_users'],
+            image_workers=options['image_workers'])
+        errors = open(options['errors'], 'a') if options['errors'] else None
+        start = last_report = time.perf_counter()
+        imported = 0
+        try:
+            with open(path, newline='') as file:
+                records = islice(imports.read_records(file, file_format),
+                                 checkpoint['position'], None)
+                while batch := list(islice(records, options['batch_size'])):
+                    counts, batch_errors = importer.import_batch(batch)
+                    for index, message in batch_errors:
+                        self.report_error(
+                            errors, checkpoint['position'] + index + 1,
+                            message)
+                    checkpoint['position'] += len(batch)
+                    checkpoint['rejected'] += len(batch_errors)
+                    for content_type, count in counts.items():
+                        checkpoint[content_type] += count
+                        imported += count
+                    imports.write_checkpoint(checkpoint_path, checkpoint)
+
+                    now = time.perf_counter()
+                    if options['verbosity'] > 1 \
+                            or now - last_report >= PROGRESS_INTERVAL:
+                        last_report = now
+                        self.stdout.write(
+                            f"{checkpoint['position']} record(s) read, "
+                            f'{imported / (now - start):.0f} posts/s.')
+        finally:
+            if errors is not None:
+                errors.close()
+
+        Path(checkpoint_path).unlink(missing_ok=True)
+        if sharding.enabled():
+            # the posts were inserted in the default database, the reviews
+            # with their tickets
+            users, _, _ = sharding.rebalance()
+            self.stdout.write(f'Posts of {users} user(s) moved to their '
+                              f'shard.')
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{checkpoint[feed.TICKET]} ticket(s) and '
+            f'{checkpoint[feed.REVIEW]} review(s) imported, '
+            f"{checkpoint['rejected']} record(s) rejected; "
+            f'{imported} post(s) in {elapsed:.1f}s, '
+            f'{imported / elapsed if elapsed else 0:.0f} posts/s.'))
+
+    def report_error(self, errors, position, message):
+        if errors is None:
+            self.stderr.write(f'Record {position}: {message}')
+        else:
+            errors.write(json.dumps({'record': position, 'error': message})
+                         + '\n')
@@ -0,0 +1,142 @@
+import json
+import platform
+import random
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.utils import timezone
+
+from app import loadtest, models, sharding
+
+# tickets reviewed by the virtual users, among the latest ones
+TICKETS = 1000
+
+
+class Command(BaseCommand):
+    help = ('Load test the whole stack: virtual users log in, read the '
+            'flux and posts pages, post tickets with an image and reviews, '
+            'follow and unfollow users, over HTTP. Report the throughput, '
+            'error rate and latency percentiles per URL name. The virtual '
+            'users and their posts are deleted at the end: run it on a '
+            'copy of the database, with runworker running like in '
+            'production.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url',
+                            help='URL of a running server, e.g. the ASGI '
+                                 'application under uvicorn (default: the '
+                                 'WSGI application, served by a threaded '
+                                 'server of this process).')
+        parser.add_argument('--users', type=int, default=10,
+                            help='Number of virtual users (default: 10).')
+        parser.add_argument('--duration', type=float, default=30.0,
+                            help='Seconds of the test (default: 30).')
+        parser.add_argument('--mix',
+                            default=','.join(
+                                f'{action}={weight}' for action, weight
+                                in loadtest.DEFAULT_MIX.items()),
+                            help='Weights of the actions of the virtual '
+                                 'users (default: %(default)s).')
+        parser.add_argument('--think-time', type=float, default=0.0,
+                            help='Mean pause in seconds between the actions '
+                                 'of a virtual user (default: 0).')
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Number of the most followed users each '
+                                 'virtual user follows at the start '
+                                 '(default: 20).')
+        parser.add_argument('--seed', type=int,
+                            help='Seed of the random choices of the virtual '
+                                 'users.')
+        parser.add_argument('--output', type=Path,
+                            help='Save the results as JSON, e.g. to track '
+                                 'the regressions.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('At least one virtual user is needed.')
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as error:
+            raise CommandError(f'Invalid mix: {error}.')
+        ticket_ids = sorted(
+            ticket_id for manager in sharding.managers(models.Ticket)
+            for ticket_id in manager.order_by('-id')
+            .values_list('id', flat=True)[:TICKETS])[-TICKETS:]
+        if not ticket_ids:
+            raise CommandError('There is no ticket: run seed_litreview.')
+        authors = dict(User.objects.annotate(followers=Count('followed_by'))
+                       .order_by('-followers')
+                       .values_list('username', 'id')[:1000])
+
+        users = self.create_users(options['users'], authors,
+                                  options['follows'])
+        server = None
+        url = options['url']
+        try:
+            if url is None:
+                server = loadtest.start_server()
+                url = f'http://127.0.0.1:{server.server_port}'
+            self.stdout.write(
+                f"{len(users)} virtual user(s) on {url} for "
+                f"{options['duration']:g}s.")
+            results, elapsed = loadtest.run(
+                url, users, authors, ticket_ids, mix, options['duration'],
+                options['think_time'], options['seed'])
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            # the images of their tickets are deleted by sweep_media
+            User.objects.filter(username__in=users).delete()
+
+        if not results:
+            raise CommandError('No request was sent.')
+        summary = loadtest.summarize(results, elapsed)
+        self.report(summary)
+        if options['output']:
+            options['output'].write_text(json.dumps({
+                'time': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                # the threaded WSGI server of the command, or the URL
+                'server': options['url'] or 'wsgi',
+                'users': len(users),
+                'duration': round(elapsed, 2),
+                'mix': mix,
+                'requests': summary,
+            }, indent=2) + '\n')
+            self.stdout.write(f"Results saved to {options['output']}.")
+
+    def create_users(self, count, authors, follows):
+        """
+        Create the virtual users, following the first follows authors.
+        Return {username: {followed username: id}}.
+        """
+        password = make_password(loadtest.PASSWORD)
+        prefix = f'{loadtest.USERNAME_PREFIX}-{random.getrandbits(32):08x}'
+        followed = dict(list(authors.items())[:follows])
+        users = {}
+        for number in range(count):
+            user = User.objects.create(username=f'{prefix}-{number}',
+                                       password=password)
+            for followed_id in followed.values():
+                models.UserFollows.objects.create(
+                    user=user, followed_user_id=followed_id)
+            users[user.username] = followed
+        return users
+
+    def report(self, summary):
+        self.stdout.write(f"{'request':<34}{'count':>7}{'req/s':>9}"
+                          f"{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}"
+                          f"{'p99 ms':>9}")
+        for name, measure in summary.items():
+            line = (f"{name:<34}{measure['requests']:>7}"
+                    f"{measure['per_second']:>9.1f}"
+                    f"{measure['error_rate']:>8.1%}"
+                    f"{measure['p50_ms']:>9.1f}{measure['p95_ms']:>9.1f}"
+                    f"{measure['p99_ms']:>9.1f}")
+            if measure['errors']:
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
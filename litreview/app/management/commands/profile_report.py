@@ -0,0 +1,69 @@
+import io
+import pstats
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app.middleware import parse_profile_name
+
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+class Command(BaseCommand):
+    help = ('Aggregate the request profiles saved by the profiling '
+            'middleware into a report of the hottest functions.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', type=Path,
+                            default=settings.PROFILE_DIR,
+                            help='Directory of the profiles (default: '
+                                 'settings.PROFILE_DIR).')
+        parser.add_argument('--url-name', action='append',
+                            help='Only aggregate the profiles of this URL '
+                                 'name (repeatable).')
+        parser.add_argument('--top', type=int, default=25,
+                            help='Number of functions reported '
+                                 '(default: 25).')
+        parser.add_argument('--sort', choices=SORT_KEYS, default='tottime',
+                            help='Order of the functions (default: '
+                                 'tottime, the time spent in the function '
+                                 'itself).')
+        parser.add_argument('--full-paths', action='store_true',
+                            help='Do not strip the directories of the '
+                                 'file names.')
+
+    def handle(self, *args, **options):
+        profiles = defaultdict(list)
+        for path in sorted(Path(options['directory']).glob('*.prof')):
+            try:
+                name, elapsed_ms = parse_profile_name(path.name)
+            except ValueError:
+                continue
+            if options['url_name'] and name not in options['url_name']:
+                continue
+            profiles[name].append((path, elapsed_ms))
+        if not profiles:
+            raise CommandError(
+                f"No profile in {options['directory']}: profile requests "
+                f'with ?profile=1 as a staff user.')
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Profiled requests'))
+        for name, entries in sorted(profiles.items()):
+            durations = [elapsed_ms for _, elapsed_ms in entries]
+            self.stdout.write(
+                f'{name:<30}{len(entries):>6} profile(s), mean '
+                f'{sum(durations) / len(durations):.0f}ms, max '
+                f'{max(durations)}ms')
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"Top {options['top']} functions by {options['sort']}"))
+        paths = [str(path) for entries in profiles.values()
+                 for path, _ in entries]
+        report = io.StringIO()
+        stats = pstats.Stats(*paths, stream=report)
+        if not options['full_paths']:
+            stats.strip_dirs()
+        stats.sort_stats(options['sort']).print_stats(options['top'])
+        self.stdout.write(report.getvalue())
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import sharding
+
+
+class Command(BaseCommand):
+    help = ('Move the tickets and reviews of the users to their shard '
+            '(settings.POST_SHARDS), or to another shard, and display the '
+            'number of posts of each database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Users whose posts are moved (default: every user).')
+        parser.add_argument('--to', metavar='SHARD',
+                            help='Shard receiving the posts of the users '
+                                 'from now on.')
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('The posts are not sharded: set POST_SHARDS '
+                               'in the settings.')
+        target = options['to']
+        if target is not None and target not in settings.POST_SHARDS:
+            raise CommandError(f'Unknown shard {target!r}, not one of '
+                               f"{', '.join(settings.POST_SHARDS)}.")
+        user_ids = None
+        if options['usernames']:
+            user_ids = set(User.objects
+                           .filter(username__in=options['usernames'])
+                           .values_list('id', flat=True))
+            if len(user_ids) < len(set(options['usernames'])):
+                raise CommandError('Unknown username(s).')
+        elif target is not None:
+            raise CommandError('--to needs the usernames of the users to '
+                               'move.')
+        if target is not None:
+            for user_id in user_ids:
+                sharding.assign(user_id, target)
+
+        users, tickets, reviews = sharding.rebalance(user_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'{tickets} ticket(s) and {reviews} review(s) of {users} '
+            f'user(s) moved.'))
+        for alias, (tickets, reviews) in sharding.post_counts().items():
+            self.stdout.write(f'{alias}: {tickets} ticket(s), '
+                              f'{reviews} review(s)')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from app import search
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the full-text search index from the tickets and '
+            'reviews.')
+
+    def handle(self, *args, **options):
+        indexed = search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'{indexed} post(s) indexed.'))
@@ -0,0 +1,26 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from app import feed_cache, follow_graph, timeline
+
+
+class Command(BaseCommand):
+    help = ('Backfill or rebuild the materialized timelines from the '
+            'tickets, reviews and follow graph, after recording the '
+            'high-follower authors.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Owners of the timelines to rebuild (default: every user).')
+
+    def handle(self, *args, **options):
+        owners = User.objects.all()
+        if options['usernames']:
+            owners = owners.filter(username__in=options['usernames'])
+        # e.g. after a change of TIMELINE_FANOUT_LIMIT
+        follow_graph.refresh_high_follower_authors()
+        rebuilt = timeline.rebuild(owners)
+        feed_cache.invalidate(owners.values_list('id', flat=True))
+        self.stdout.write(self.style.SUCCESS(
+            f'{rebuilt} timeline(s) rebuilt.'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from app import aggregates, models, sharding
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Detect the tickets whose review count, rating sum or last '
+            'review time drifted from their reviews, and repair them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report the drifted tickets.')
+
+    def handle(self, *args, **options):
+        # the tickets of each database holding posts, with their reviews
+        by_database = [(manager, list(aggregates.drifted(manager.all())
+                                      .values_list('id', flat=True)))
+                       for manager in sharding.managers(models.Ticket)]
+        drifted = [ticket_id for _, ids in by_database for ticket_id in ids]
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('No drift.'))
+            return
+        sample = ', '.join(map(str, drifted[:10]))
+        self.stdout.write(f'{len(drifted)} drifted ticket(s): {sample}'
+                          f'{", ..." if len(drifted) > 10 else ""}')
+        if options['dry_run']:
+            return
+        for manager, ids in by_database:
+            for start in range(0, len(ids), BATCH_SIZE):
+                aggregates.refresh(manager.filter(
+                    id__in=ids[start:start + BATCH_SIZE]))
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(drifted)} ticket(s) repaired.'))
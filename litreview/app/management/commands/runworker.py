@@ -0,0 +1,75 @@
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from app import jobs, models
+
+STATUS_LABELS = {models.Job.QUEUED: 'to retry'}
+
+
+class Command(BaseCommand):
+    help = 'Run the queued background jobs on a pool of threads or processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of jobs run at the same time '
+                                 '(default: 4).')
+        parser.add_argument('--processes', action='store_true',
+                            help='Run the jobs in worker processes rather '
+                                 'than threads, for CPU-bound jobs.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds between two checks for due jobs '
+                                 'when the queue is empty (default: 1).')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once no job is due nor running.')
+
+    def handle(self, *args, **options):
+        purged = jobs.purge()
+        if purged:
+            self.stdout.write(f'{purged} finished job(s) purged.')
+        workers = options['workers']
+        if options['processes']:
+            # the worker processes must not inherit the open connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers,
+                                       initializer=django.setup)
+        else:
+            pool = ThreadPoolExecutor(max_workers=workers)
+        kind = 'processes' if options['processes'] else 'threads'
+        self.stdout.write(f'Running the jobs with {workers} {kind}. '
+                          'Quit with CONTROL-C.')
+
+        counts = {}
+        running = set()
+        try:
+            while True:
+                while len(running) < workers and (job_id := jobs.claim()):
+                    running.add(pool.submit(jobs.run, job_id))
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, running = wait(running,
+                                     timeout=options['poll_interval'],
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        status = future.result()
+                    except Exception as error:
+                        # the job is claimed again after JOBS_TIMEOUT
+                        self.stderr.write(f'Worker error: {error}')
+                        status = 'interrupted'
+                    status = STATUS_LABELS.get(status, status)
+                    counts[status] = counts.get(status, 0) + 1
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping once the running jobs are done.')
+        finally:
+            pool.shutdown(wait=True)
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f'{count} {status}' for status, count
+                      in sorted(counts.items())) or 'No job run.'))
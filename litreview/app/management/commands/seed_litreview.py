@@ -0,0 +1,82 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import (aggregates, follow_graph, models, search, seeding,
+                 sharding, timeline, usernames)
+
+
+class Command(BaseCommand):
+    help = ('Generate synthetic users, tickets, reviews and a power-law '
+            'follow graph, for benchmarks. Run it on a copy of the '
+            'database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Number of users (default: 1000).')
+        parser.add_argument('--tickets', type=int, default=10000,
+                            help='Number of tickets (default: 10000).')
+        parser.add_argument('--reviews', type=int, default=10000,
+                            help='Number of reviews (default: 10000).')
+        parser.add_argument('--follows', type=int, default=20,
+                            help='Average number of users followed by '
+                                 'each user (default: 20).')
+        parser.add_argument('--exponent', type=float, default=1.0,
+                            help='Exponent of the power law of the '
+                                 'popularity of the users: the higher, the '
+                                 'more the follows go to a few users '
+                                 '(default: 1).')
+        parser.add_argument('--images', type=int, default=0,
+                            help='Number of tickets with a generated image '
+                                 '(default: 0).')
+        parser.add_argument('--seed', type=int,
+                            help='Seed of the random generator, to generate '
+                                 'the same dataset again.')
+        parser.add_argument('--no-timeline', action='store_true',
+                            help='Do not build the timelines of the new '
+                                 'users.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('At least 2 users are needed.')
+        if options['reviews'] and not options['tickets']:
+            raise CommandError('Reviews need tickets to review.')
+        rng = random.Random(options['seed'])
+
+        user_ids = self.step('users', seeding.create_users,
+                             options['users'])
+        self.step('follows', seeding.create_power_law_follows, user_ids,
+                  options['follows'], options['exponent'], rng)
+        ticket_ids = self.step('tickets', seeding.create_tickets, user_ids,
+                               options['tickets'], options['images'], rng)
+        if options['reviews']:
+            self.step('reviews', seeding.create_reviews, user_ids,
+                      ticket_ids, options['reviews'], rng)
+            self.step('review aggregates', aggregates.refresh,
+                      models.Ticket.objects.filter(id__gte=min(ticket_ids)))
+        if sharding.enabled():
+            # the posts were inserted in the default database
+            self.step('moves to the shards', sharding.rebalance)
+
+        # the rows were inserted without the signal receivers
+        usernames.refresh()
+        follow_graph.refresh_high_follower_authors()
+        if not options['no_timeline']:
+            # the new users only follow each other
+            self.step('timelines', timeline.rebuild,
+                      User.objects.filter(id__gte=min(user_ids)))
+        self.step('search index', search.rebuild)
+        if options['images']:
+            self.stdout.write('Run build_image_variants to resize the '
+                              'generated images.')
+
+    def step(self, name, function, *args):
+        self.stdout.write(f'Creating the {name}...', ending=' ')
+        self.stdout.flush()
+        start = time.perf_counter()
+        result = function(*args)
+        self.stdout.write(self.style.SUCCESS(
+            f'done in {time.perf_counter() - start:.1f}s.'))
+        return result
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import media
+
+
+class Command(BaseCommand):
+    help = ('Delete the media files of the deleted tickets and replaced '
+            'images, recorded by the requests, a batch at a time. With '
+            '--orphans, also delete the files of MEDIA_ROOT which no '
+            'ticket refers to.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=media.BATCH_SIZE,
+                            help='Files deleted at a time (default: '
+                                 f'{media.BATCH_SIZE}).')
+        parser.add_argument('--orphans', action='store_true',
+                            help='Look for the files of MEDIA_ROOT which no '
+                                 'ticket refers to, and delete them.')
+        parser.add_argument('--min-age', type=float,
+                            default=media.ORPHAN_MIN_AGE,
+                            help='Age in seconds below which a file is not '
+                                 'an orphan, its ticket being possibly '
+                                 'uncommitted (default: '
+                                 f'{media.ORPHAN_MIN_AGE}).')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only list the orphans, deleting nothing.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        if options['dry_run'] and not options['orphans']:
+            raise CommandError('--dry-run lists the orphans: add '
+                               '--orphans.')
+        if options['orphans']:
+            found, batch = 0, []
+            for name in media.orphans(options['min_age']):
+                found += 1
+                if options['dry_run'] or options['verbosity'] > 1:
+                    self.stdout.write(name)
+                if options['dry_run']:
+                    continue
+                # recorded in the ledger, then swept like the other files
+                batch.append(name)
+                if len(batch) == options['batch_size']:
+                    media.forget(batch)
+                    batch = []
+            if batch:
+                media.forget(batch)
+            self.stdout.write(f'{found} orphan file(s) found.')
+            if options['dry_run']:
+                return
+
+        deleted = media.sweep(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} file(s) deleted.'))
@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from app import database
+
+
+class Command(BaseCommand):
+    help = ('Copy the database to the replica read by the feed pages '
+            '(settings.REPLICA_DATABASE), once or at an interval.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Copy the database every this many seconds '
+                                 'until interrupted, e.g. '
+                                 f'{settings.REPLICA_MAX_LAG} '
+                                 '(settings.REPLICA_MAX_LAG) or less.')
+
+    def handle(self, *args, **options):
+        if not database.replica_configured():
+            raise CommandError('There is no replica: set REPLICA_DATABASE '
+                               'in the settings.')
+        interval = options['interval']
+        if interval is not None and interval > settings.REPLICA_MAX_LAG:
+            self.stderr.write(self.style.WARNING(
+                f'The replica will lag behind by more than REPLICA_MAX_LAG '
+                f'({settings.REPLICA_MAX_LAG}s).'))
+        try:
+            while True:
+                start = time.perf_counter()
+                database.sync_replica()
+                elapsed = time.perf_counter() - start
+                if interval is None or options['verbosity'] > 1:
+                    self.stdout.write(f'Replica copied in {elapsed:.2f}s.')
+                if interval is None:
+                    break
+                time.sleep(max(interval - elapsed, 0))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,123 @@
+"""
+Deferred deletion of the media files: the image of a deleted ticket or
+the replaced image of a ticket, and their variants (see
+:mod:`app.images`).
+
+The requests only record the names of the files in the
+:model:`app.DeletedFile` ledger of the database of the ticket, in the
+transaction deleting or replacing the image: the names are committed with
+the change, and forgotten if it is rolled back. The sweep_media command
+later deletes the files of the ledgers from the storage, a batch at a
+time, out of the requests and transactions, so that deleting a user with
+thousands of tickets does no file system operation inline.
+
+The command also finds the orphans, files of ``MEDIA_ROOT`` which no
+ticket refers to, e.g. uploads of a request which failed, by walking the
+directory tree against the names of the images and variants of every
+ticket.
+"""
+import os
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from . import database, images, models, sharding
+
+BATCH_SIZE = 1000
+# files younger than this many seconds are never orphans: their ticket may
+# not be committed yet
+ORPHAN_MIN_AGE = 60 * 60
+
+
+def forget(names, using=None):
+    """
+    Record the files to delete in the ledger of the database using, in its
+    current transaction if any.
+    """
+    models.DeletedFile.objects.using(using or database.PRIMARY).bulk_create(
+        [models.DeletedFile(name=name) for name in names])
+
+
+def ledger_databases():
+    return [database.PRIMARY] + list(settings.POST_SHARDS)
+
+
+def referenced_images(names):
+    """
+    Return the names, among names, of the images of existing tickets.
+    """
+    return {name for manager in sharding.managers(models.Ticket)
+            for name in manager.filter(image__in=names)
+            .values_list('image', flat=True)}
+
+
+def sweep(batch_size=BATCH_SIZE, storage=default_storage):
+    """
+    Delete the files of the ledgers batch_size at a time, then their rows.
+    Return the number of files deleted.
+    """
+    deleted = 0
+    for alias in ledger_databases():
+        ledger = models.DeletedFile.objects.using(alias)
+        while batch := list(ledger.order_by('id')
+                            .values_list('id', 'name')[:batch_size]):
+            names = {name for _, name in batch}
+            # e.g. an image deleted then restored from a backup
+            names -= referenced_images(names)
+            for name in names:
+                storage.delete(name)
+            ledger.filter(id__in=[row_id for row_id, _ in batch]).delete()
+            deleted += len(names)
+    return deleted
+
+
+def walk(directory):
+    """
+    Generate the paths of the files of the directory tree, with their
+    modification time, skipping the hidden ones.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path, entry.stat().st_mtime
+
+
+def referenced_names():
+    """
+    Return the names of the images and variants of every ticket, and of the
+    files already in the ledgers.
+    """
+    names = set()
+    for manager in sharding.managers(models.Ticket):
+        for image, variants in manager.exclude(image='')\
+                .values_list('image', 'image_variants')\
+                .iterator(chunk_size=BATCH_SIZE):
+            names.add(image)
+            names.update(images.variant_names(variants))
+    for alias in ledger_databases():
+        names.update(models.DeletedFile.objects.using(alias)
+                     .values_list('name', flat=True)
+                     .iterator(chunk_size=BATCH_SIZE))
+    return names
+
+
+def orphans(min_age=ORPHAN_MIN_AGE):
+    """
+    Generate the names of the files of MEDIA_ROOT older than min_age
+    seconds which are not referenced, see :func:`referenced_names`.
+    """
+    root = Path(settings.MEDIA_ROOT)
+    if not root.is_dir():
+        return
+    referenced = referenced_names()
+    oldest = time.time() - min_age
+    for path, modified in walk(root):
+        name = Path(path).relative_to(root).as_posix()
+        if modified < oldest and name not in referenced:
+            yield name
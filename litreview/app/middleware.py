@@ -0,0 +1,289 @@
+"""
+Opt-in instrumentation of the requests.
+
+For each request, :class:`RequestMetricsMiddleware`, enabled by
+``settings.REQUEST_METRICS``, records the SQL queries with their duration
+and call site, the template rendering time, the view time and the
+response size. It sends them in a Server-Timing header, readable in the
+network panel of the browsers, and logs the slow requests and the
+requests repeating a query with their worst queries.
+
+:class:`ProfilingMiddleware` saves the cProfile profiles of the requests
+made by staff users with the ``profile`` parameter, and of a sample of
+the requests (``settings.PROFILING_SAMPLE_RATE``).
+
+:class:`ReplicaPinMiddleware` makes the users who have just written read
+from the primary database rather than from the replica, if there is one
+(see :mod:`app.database`).
+"""
+import contextvars
+import cProfile
+import json
+import logging
+import random
+import sys
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+from django.urls import resolve, Resolver404
+
+from . import database
+
+logger = logging.getLogger(__name__)
+
+# metrics of the current request
+_metrics = contextvars.ContextVar('request_metrics', default=None)
+SQL_LENGTH = 500
+WORST_QUERIES = 5
+PROJECT_DIR = str(settings.BASE_DIR)
+_original_render = Template.render
+
+
+class RequestMetrics:
+    """
+    Measures of one request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view_start = None
+        self.view_ms = 0.0
+        # (sql, duration in ms, call site)
+        self.queries = []
+        self.template_ms = 0.0
+        # depth of the templates being rendered, the included ones being
+        # measured with the template including them
+        self.template_depth = 0
+
+    def record_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                (sql, (time.perf_counter() - start) * 1000, call_site()))
+
+    @property
+    def db_ms(self):
+        return sum(duration for _, duration, _ in self.queries)
+
+    def duplicates(self):
+        """
+        Return the queries run at least ``settings.DUPLICATE_QUERY_COUNT``
+        times with different parameters or the same, e.g. in a loop,
+        as ``{sql: (count, call sites)}``.
+        """
+        call_sites = defaultdict(list)
+        for sql, _, site in self.queries:
+            call_sites[sql].append(site)
+        return {sql: (len(sites), sorted(set(sites)))
+                for sql, sites in call_sites.items()
+                if len(sites) >= settings.DUPLICATE_QUERY_COUNT}
+
+
+def call_site():
+    """
+    Return the innermost frame of the project code running a query, as
+    'path:line in function'.
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_DIR) and filename != __file__ \
+                and 'site-packages' not in filename:
+            path = Path(filename).relative_to(settings.BASE_DIR)
+            return f'{path}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+def render(self, context):
+    """
+    Template.render measuring the rendering time of the templates.
+    """
+    metrics = _metrics.get()
+    if metrics is None:
+        return _original_render(self, context)
+    metrics.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        metrics.template_depth -= 1
+        if not metrics.template_depth:
+            metrics.template_ms += (time.perf_counter() - start) * 1000
+
+
+def url_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+    return match.url_name
+
+
+class RequestMetricsMiddleware:
+    """
+    Measure the requests and report the measures in a Server-Timing header
+    and in the log of the app.middleware logger.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        # measures the templates rendered while a request is measured
+        Template.render = render
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(metrics.record_query))
+                response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        total_ms = (time.perf_counter() - metrics.start) * 1000
+        if metrics.view_start is not None:
+            metrics.view_ms = (time.perf_counter() - metrics.view_start) \
+                * 1000
+        size = None if response.streaming else len(response.content)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db_ms:.1f};desc="{len(metrics.queries)} '
+            f'queries"',
+            f'tpl;dur={metrics.template_ms:.1f};desc="templates"',
+            f'view;dur={metrics.view_ms:.1f};desc="view"',
+            f'total;dur={total_ms:.1f};desc="total"',
+            *([f'size;desc="{size} bytes"'] if size is not None else []),
+        ])
+        duplicates = metrics.duplicates()
+        if total_ms >= settings.SLOW_REQUEST_MS or duplicates:
+            self.log(request, response, metrics, total_ms, size, duplicates)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        _metrics.get().view_start = time.perf_counter()
+
+    def log(self, request, response, metrics, total_ms, size, duplicates):
+        worst = sorted(metrics.queries, key=lambda query: query[1],
+                       reverse=True)[:WORST_QUERIES]
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'url_name': url_name(request),
+            'status': response.status_code,
+            'total_ms': round(total_ms, 1),
+            'view_ms': round(metrics.view_ms, 1),
+            'db_ms': round(metrics.db_ms, 1),
+            'template_ms': round(metrics.template_ms, 1),
+            'queries': len(metrics.queries),
+            'size': size,
+            'worst_queries': [
+                {'sql': sql[:SQL_LENGTH], 'ms': round(duration, 2),
+                 'call_site': site}
+                for sql, duration, site in worst],
+            'duplicate_queries': [
+                {'sql': sql[:SQL_LENGTH], 'count': count,
+                 'call_sites': sites}
+                for sql, (count, sites) in duplicates.items()],
+        }
+        message = 'Slow request' if total_ms >= settings.SLOW_REQUEST_MS \
+            else 'Duplicate queries'
+        logger.warning('%s: %s', message, json.dumps(record),
+                       extra={'request_metrics': record})
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests made by staff users with the ``profile``
+    parameter, and a random sample of the other requests, and save the
+    profiles in ``settings.PROFILE_DIR``, keeping the latest
+    ``settings.PROFILE_MAX_FILES`` ones. See the profile_report command.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.profiled(request):
+            return self.get_response(request)
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active in this thread
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.disable()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        name = save_profile(profile, url_name(request), elapsed_ms)
+        if request.user.is_staff:
+            response['X-Profile'] = name
+        return response
+
+    def profiled(self, request):
+        if 'profile' in request.GET and request.user.is_staff:
+            return True
+        rate = settings.PROFILING_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+
+def save_profile(profile, name, elapsed_ms):
+    """
+    Save a profile as <time>-<url name>-<ms>ms.prof and delete the oldest
+    profiles. Return the name of the file.
+    """
+    directory = Path(settings.PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    filename = f'{time.time_ns()}-{name or "unknown"}-{elapsed_ms:.0f}ms.prof'
+    profile.dump_stats(directory / filename)
+    # the names start with the time: the oldest come first
+    profiles = sorted(directory.glob('*.prof'))
+    for path in profiles[:-settings.PROFILE_MAX_FILES]:
+        path.unlink(missing_ok=True)
+    return filename
+
+
+def parse_profile_name(filename):
+    """
+    Return the url name and milliseconds of a profile file name.
+    """
+    _, name = Path(filename).stem.split('-', 1)
+    name, elapsed = name.rsplit('-', 1)
+    return name, int(elapsed.removesuffix('ms'))
+
+
+class ReplicaPinMiddleware:
+    """
+    Pin the user to the primary database for ``settings.REPLICA_MAX_LAG``
+    seconds after each unsafe request, with a cookie read by
+    :func:`database.read_from_replica`.
+    """
+
+    def __init__(self, get_response):
+        if not database.replica_configured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            response.set_cookie(database.PIN_COOKIE, '1',
+                                max_age=settings.REPLICA_MAX_LAG,
+                                httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', 'time_created'],
+                               name='app_review_user_time'),
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['user', 'time_created'],
+                               name='app_ticket_user_time'),
+        ),
+        migrations.AddIndex(
+            model_name='userfollows',
+            index=models.Index(fields=['followed_user', 'user'],
+                               name='app_follows_followed_user'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
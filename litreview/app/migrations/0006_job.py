@@ -0,0 +1,48 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_ticket_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True,
+                                           primary_key=True,
+                                           serialize=False,
+                                           verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('payload', models.JSONField(default=dict)),
+                ('idempotency_key', models.CharField(blank=True,
+                                                     max_length=255,
+                                                     null=True,
+                                                     unique=True)),
+                ('status', models.CharField(
+                    choices=[('queued', 'Queued'),
+                             ('running', 'Running'),
+                             ('done', 'Done'),
+                             ('failed', 'Failed')],
+                    default='queued',
+                    max_length=7)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('max_attempts', models.PositiveSmallIntegerField()),
+                ('run_after', models.DateTimeField()),
+                ('time_started', models.DateTimeField(blank=True,
+                                                      null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('time_created', models.DateTimeField(auto_now_add=True)),
+                ('time_updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='job',
+            index=models.Index(fields=['status', 'run_after'],
+                               name='app_job_status_run_after'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:19
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_time_updated(apps, schema_editor):
+    # the existing posts have not been modified since they were created
+    for model_name in ('Ticket', 'Review'):
+        apps.get_model('app', model_name).objects\
+            .update(time_updated=F('time_created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='time_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='time_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(set_time_updated,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_post_time_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportedPost',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True,
+                                           primary_key=True,
+                                           serialize=False,
+                                           verbose_name='ID')),
+                ('source', models.CharField(max_length=128)),
+                ('content_type', models.CharField(max_length=6)),
+                ('source_id', models.BigIntegerField()),
+                ('post_id', models.BigIntegerField()),
+            ],
+            options={
+                'unique_together': {('source', 'content_type',
+                                     'source_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:50
+
+from django.db import migrations
+
+# see app.search: the rowid of a post is its id * 2, plus 1 for the
+# reviews, and its author is the token u<user id>
+CREATE_SEARCH_TABLE = """
+CREATE VIRTUAL TABLE app_post_search USING fts5(
+    title,
+    body,
+    author,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+INDEX_POSTS = """
+INSERT INTO app_post_search (rowid, title, body, author)
+SELECT id * 2, title, description, 'u' || user_id FROM app_ticket
+UNION ALL
+SELECT id * 2 + 1, headline, body, 'u' || user_id FROM app_review
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_importedpost'),
+    ]
+
+    operations = [
+        migrations.RunSQL([CREATE_SEARCH_TABLE, INDEX_POSTS],
+                          'DROP TABLE app_post_search'),
+    ]
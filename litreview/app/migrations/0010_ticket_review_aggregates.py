@@ -0,0 +1,51 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:45
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def compute_aggregates(apps, schema_editor):
+    # the same expressions as app.aggregates.computed
+    Ticket = apps.get_model('app', 'Ticket')
+    Review = apps.get_model('app', 'Review')
+
+    def reviews(aggregate):
+        return Subquery(Review.objects.filter(ticket=OuterRef('pk'))
+                        .order_by().values('ticket')
+                        .annotate(value=aggregate).values('value'))
+
+    Ticket.objects.update(
+        review_count=Coalesce(reviews(Count('id')), 0,
+                              output_field=IntegerField()),
+        rating_sum=Coalesce(reviews(Sum('rating')), 0,
+                            output_field=IntegerField()),
+        last_review_time=reviews(Max('time_created')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='last_review_time',
+            field=models.DateTimeField(blank=True, editable=False,
+                                       null=True),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(compute_aggregates,
+                             migrations.RunPython.noop),
+    ]
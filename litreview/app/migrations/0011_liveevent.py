@@ -0,0 +1,25 @@
+# Generated by Django 4.0.4 on 2026-10-18 14:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_ticket_review_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True,
+                                           primary_key=True,
+                                           serialize=False,
+                                           verbose_name='ID')),
+                ('payload', models.JSONField()),
+                ('time_created', models.DateTimeField(auto_now_add=True,
+                                                      db_index=True)),
+            ],
+        ),
+    ]
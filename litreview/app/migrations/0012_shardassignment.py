@@ -0,0 +1,28 @@
+# Generated by Django 4.0.4 on 2026-10-18 15:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('app', '0011_liveevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardAssignment',
+            fields=[
+                ('user', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    primary_key=True,
+                    related_name='+',
+                    serialize=False,
+                    to=settings.AUTH_USER_MODEL)),
+                ('shard', models.CharField(max_length=64)),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.0.4 on 2026-10-18 15:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('app', '0012_shardassignment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleFollowSuggestions',
+            fields=[
+                ('user_id', models.BigIntegerField(primary_key=True,
+                                                   serialize=False)),
+                ('time_changed', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FollowSuggestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True,
+                                           primary_key=True,
+                                           serialize=False,
+                                           verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('time_computed', models.DateTimeField()),
+                ('suggested_user', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='+',
+                    to=settings.AUTH_USER_MODEL)),
+                ('user', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='follow_suggestions',
+                    to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='followsuggestion',
+            index=models.Index(fields=['user', '-score'],
+                               name='app_suggestion_user_score'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='followsuggestion',
+            unique_together={('user', 'suggested_user')},
+        ),
+    ]
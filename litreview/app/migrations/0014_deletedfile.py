@@ -0,0 +1,24 @@
+# Generated by Django 4.0.4 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0013_followsuggestion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True,
+                                           primary_key=True,
+                                           serialize=False,
+                                           verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('time_deleted', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.4 on 2026-10-18 18:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def add_high_follower_authors(apps, schema_editor):
+    limit = settings.TIMELINE_FANOUT_LIMIT
+    author_ids = apps.get_model('app', 'UserFollows').objects\
+        .values('followed_user').annotate(count=Count('id'))\
+        .filter(count__gte=limit).values_list('followed_user', flat=True)
+    HighFollowerAuthor = apps.get_model('app', 'HighFollowerAuthor')
+    HighFollowerAuthor.objects.bulk_create(
+        [HighFollowerAuthor(user_id=author_id) for author_id in author_ids])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0014_deletedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HighFollowerAuthor',
+            fields=[
+                ('user', models.OneToOneField(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    primary_key=True,
+                    related_name='+',
+                    serialize=False,
+                    to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(add_high_follower_authors,
+                             migrations.RunPython.noop),
+    ]
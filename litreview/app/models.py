@@ -1,15 +1,96 @@
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.conf import settings
 from django.db import models
 
 
+# fields of Ticket maintained by app.aggregates
+AGGREGATE_FIELDS = ('review_count', 'rating_sum', 'last_review_time')
+
+
+class PostQuerySet(models.QuerySet):
+
+    def create(self, **kwargs):
+        # routes the new post by its author or ticket, see app.sharding,
+        # unless the database was chosen with using()
+        post = self.model(**kwargs)
+        post.save(force_insert=True, using=self._db)
+        return post
+
+
+# the image files are deleted by the sweep_media command, see app.media
 class Ticket(models.Model):
     title = models.CharField(max_length=128)
     description = models.TextField(max_length=2048, blank=True)
     user = models.ForeignKey(to=settings.AUTH_USER_MODEL,
                              on_delete=models.CASCADE)
     image = models.ImageField(null=True, blank=True)
+    # resized copies of the image: {format: {width: name}}, see app.images
+    image_variants = models.JSONField(default=dict, blank=True,
+                                      editable=False)
     time_created = models.DateTimeField(auto_now_add=True)
+    # also set when the image variants are built, see app.tasks
+    time_updated = models.DateTimeField(auto_now=True)
+    # aggregates of the reviews of the ticket, see app.aggregates
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    last_review_time = models.DateTimeField(null=True, blank=True,
+                                            editable=False)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # posts of a set of users ordered by date (flux and posts pages)
+            models.Index(fields=['user', 'time_created'],
+                         name='app_ticket_user_time'),
+        ]
+
+    def save(self, *args, update_fields=None, **kwargs):
+        # the review aggregates of a loaded ticket may be outdated: they
+        # are only written by app.aggregates
+        if not self._state.adding and update_fields is None:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in AGGREGATE_FIELDS]
+        super().save(*args, update_fields=update_fields, **kwargs)
+
+    def _srcset(self, variant_format):
+        widths = self.image_variants.get(variant_format, {})
+        return ', '.join(f'{default_storage.url(name)} {width}w'
+                         for width, name in widths.items())
+
+    @property
+    def image_srcset(self):
+        return self._srcset('jpeg')
+
+    @property
+    def image_webp_srcset(self):
+        return self._srcset('webp')
+
+    @property
+    def has_review(self):
+        return self.review_count > 0
+
+    @property
+    def average_rating(self):
+        """
+        Mean rating of the reviews of the ticket, None without review.
+        """
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
+
+    @property
+    def thumbnail_url(self):
+        """
+        URL of the smallest JPEG variant of the image, if any.
+        """
+        widths = self.image_variants.get('jpeg')
+        if not widths:
+            return ''
+        return default_storage.url(widths[min(widths, key=int)])
 
 
 class Review(models.Model):
@@ -22,6 +103,19 @@ class Review(models.Model):
     headline = models.CharField(max_length=128)
     body = models.TextField(max_length=8192, blank=True)
     time_created = models.DateTimeField(auto_now_add=True)
+    # also set when the reviewed ticket changes, the review displaying it
+    time_updated = models.DateTimeField(auto_now=True)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        # reviews of a ticket are looked up through the index
+        # of the ticket foreign key
+        indexes = [
+            # posts of a set of users ordered by date (flux and posts pages)
+            models.Index(fields=['user', 'time_created'],
+                         name='app_review_user_time'),
+        ]
 
 
 class UserFollows(models.Model):
@@ -36,3 +130,176 @@ class UserFollows(models.Model):
         # ensures we don't get multiple UserFollows instances
         # for unique user-user_followed pairs
         unique_together = ('user', 'followed_user', )
+        indexes = [
+            # followers of a user, the unique constraint above serving
+            # the users followed by a user
+            models.Index(fields=['followed_user', 'user'],
+                         name='app_follows_followed_user'),
+        ]
+
+
+class HighFollowerAuthor(models.Model):
+    """
+    A user followed by at least ``settings.TIMELINE_FANOUT_LIMIT`` users,
+    whose posts are not fanned out (see :mod:`app.timeline`): recorded by
+    the follow reaching the limit, and removed by the unfollow falling
+    below it, see :mod:`app.follow_graph`.
+    """
+    user = models.OneToOneField(to=settings.AUTH_USER_MODEL,
+                                on_delete=models.CASCADE,
+                                primary_key=True, related_name='+')
+
+
+class FollowSuggestion(models.Model):
+    """
+    A user suggested to another, who does not follow them, by the
+    compute_follow_suggestions command: the score is the number of users
+    followed by the user who follow the suggested user, see
+    :mod:`app.suggestions`.
+    """
+    user = models.ForeignKey(to=settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE,
+                             related_name='follow_suggestions')
+    suggested_user = models.ForeignKey(to=settings.AUTH_USER_MODEL,
+                                       on_delete=models.CASCADE,
+                                       related_name='+')
+    score = models.PositiveIntegerField()
+    time_computed = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'suggested_user', )
+        indexes = [
+            # the best suggestions of a user
+            models.Index(fields=['user', '-score'],
+                         name='app_suggestion_user_score'),
+        ]
+
+
+class StaleFollowSuggestions(models.Model):
+    """
+    A user who followed or unfollowed someone since the last run of
+    compute_follow_suggestions: their suggestions, and those of their
+    followers, are recomputed by its next incremental run.
+    """
+    # not a foreign key: the follows of a user being deleted are removed
+    # before the user
+    user_id = models.BigIntegerField(primary_key=True)
+    time_changed = models.DateTimeField()
+
+
+class TimelineEntry(models.Model):
+    """
+    A post displayed in the flux of its owner, written when the post is
+    created or when the owner follows its author.
+    """
+    owner = models.ForeignKey(to=settings.AUTH_USER_MODEL,
+                              on_delete=models.CASCADE,
+                              related_name='timeline')
+    author = models.ForeignKey(to=settings.AUTH_USER_MODEL,
+                               on_delete=models.CASCADE,
+                               related_name='+')
+    # 'TICKET' or 'REVIEW'
+    content_type = models.CharField(max_length=6)
+    post_id = models.BigIntegerField()
+    time_created = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # flux pages: one range of the owner's timeline
+            models.Index(fields=['owner', 'time_created'],
+                         name='app_timeline_owner_time'),
+            # removal of a deleted post from every timeline
+            models.Index(fields=['content_type', 'post_id'],
+                         name='app_timeline_post'),
+        ]
+
+
+class ImportedPost(models.Model):
+    """
+    A post imported by the import_posts command: the id of the post in its
+    source and the id of the :model:`app.Ticket` or :model:`app.Review`
+    created, see :mod:`app.imports`.
+    """
+    # name of the imported file, by default
+    source = models.CharField(max_length=128)
+    # 'TICKET' or 'REVIEW'
+    content_type = models.CharField(max_length=6)
+    source_id = models.BigIntegerField()
+    post_id = models.BigIntegerField()
+
+    class Meta:
+        # a post is imported once from each source
+        unique_together = ('source', 'content_type', 'source_id')
+
+
+class Job(models.Model):
+    """
+    A call of a background job, see :mod:`app.jobs`.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'),
+                (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=64)
+    # keyword arguments of the job function
+    payload = models.JSONField(default=dict)
+    # at most one job is enqueued per key
+    idempotency_key = models.CharField(max_length=255, null=True,
+                                       blank=True, unique=True)
+    status = models.CharField(max_length=7, choices=STATUSES,
+                              default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField()
+    run_after = models.DateTimeField()
+    time_started = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    time_created = models.DateTimeField(auto_now_add=True)
+    time_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # jobs to claim, by status and date
+            models.Index(fields=['status', 'run_after'],
+                         name='app_job_status_run_after'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.id} ({self.status})'
+
+
+class LiveEvent(models.Model):
+    """
+    An event of :mod:`app.live` published by the database backend, read by
+    the hub of every ASGI process.
+    """
+    payload = models.JSONField()
+    time_created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class ShardAssignment(models.Model):
+    """
+    The shard holding the tickets of a user moved by the rebalance_shards
+    command, instead of the shard chosen from the user id, see
+    :mod:`app.sharding`.
+    """
+    user = models.OneToOneField(to=settings.AUTH_USER_MODEL,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='+')
+    # alias of a database of settings.POST_SHARDS
+    shard = models.CharField(max_length=64)
+
+
+class DeletedFile(models.Model):
+    """
+    A media file of a deleted ticket or a replaced image, recorded in the
+    database of the ticket by the transaction deleting or replacing it, and
+    deleted from the storage by the sweep_media command, see
+    :mod:`app.media`.
+    """
+    # name in the media storage
+    name = models.CharField(max_length=255)
+    time_deleted = models.DateTimeField(auto_now_add=True)
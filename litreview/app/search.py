@@ -0,0 +1,177 @@
+"""
+Full-text search of :model:`app.Ticket` and :model:`app.Review`, backed by
+the SQLite FTS5 table app_post_search (see migration 0009).
+
+Each post is a row of the table whose rowid encodes its type and id, so
+that a post is updated or removed with a rowid lookup. The title column
+holds the title of the tickets and the headline of the reviews, the body
+column their description or body, and the author column the token
+u<user id> of their author: the posts of the follow set of the viewer are
+selected by the full-text query itself, which only ranks the matches
+visible to the viewer instead of every match of the corpus. The index is
+kept up to date by the
+signal receivers, and by the bulk inserts of :mod:`app.imports`; the
+rebuild_search_index command rebuilds it.
+
+Results are ranked by bm25, the title weighing more than the body, and
+addressed by an opaque keyset cursor holding the score and rowid of the
+last result displayed.
+"""
+import base64
+import binascii
+import re
+
+from django.db import connection, connections, transaction
+
+from . import database, feed, models, sharding
+
+TABLE = 'app_post_search'
+# content type of the posts, by rowid % 2
+CONTENT_TYPES = (feed.TICKET, feed.REVIEW)
+# bm25 weights of the title, body and author columns
+WEIGHTS = (5.0, 1.0, 0.0)
+PAGE_SIZE = feed.PAGE_SIZE
+BATCH_SIZE = 1000
+MAX_TERMS = 10
+RANK = f'bm25({TABLE}, {", ".join(map(str, WEIGHTS))})'
+
+
+def rowid(content_type, post_id):
+    return post_id * 2 + CONTENT_TYPES.index(content_type)
+
+
+def document(content_type, post):
+    """
+    Return the row of a post in the index: rowid, title, body and author.
+    """
+    if content_type == feed.TICKET:
+        title, body = post.title, post.description
+    else:
+        title, body = post.headline, post.body
+    return rowid(content_type, post.id), title, body, f'u{post.user_id}'
+
+
+def index(content_type, posts):
+    """
+    Add or replace the posts in the index.
+    """
+    rows = [document(content_type, post) for post in posts]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT OR REPLACE INTO {TABLE} (rowid, title, body, author) '
+            f'VALUES (%s, %s, %s, %s)', rows)
+
+
+def remove(content_type, post_ids):
+    """
+    Remove deleted posts from the index.
+    """
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {TABLE} WHERE rowid = %s',
+                           [(rowid(content_type, post_id),)
+                            for post_id in post_ids])
+
+
+def rebuild():
+    """
+    Rebuild the index from the tickets and reviews, then merge its
+    segments. Return the number of posts indexed.
+    """
+    indexed = 0
+    managers = [(feed.TICKET, manager)
+                for manager in sharding.managers(models.Ticket)]
+    managers += [(feed.REVIEW, manager)
+                 for manager in sharding.managers(models.Review)]
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {TABLE}')
+        for content_type, manager in managers:
+            batch = []
+            for post in manager.iterator(chunk_size=BATCH_SIZE):
+                batch.append(post)
+                if len(batch) == BATCH_SIZE:
+                    index(content_type, batch)
+                    indexed += len(batch)
+                    batch = []
+            index(content_type, batch)
+            indexed += len(batch)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    return indexed
+
+
+def match_expression(query, author_ids):
+    """
+    Return the FTS5 query matching the posts of the authors whose title or
+    body hold every word of a user query, the last one as a prefix, or ''
+    if the query has no word. The words are quoted, so that the FTS5
+    syntax is not interpreted.
+    """
+    words = re.findall(r'\w+', query)[:MAX_TERMS]
+    if not words or not author_ids:
+        return ''
+    terms = ' '.join(f'"{word}"' for word in words) + '*'
+    authors = ' OR '.join(f'u{author_id}' for author_id in author_ids)
+    return f'{{title body}}: ({terms}) AND author: ({authors})'
+
+
+def encode_cursor(score, row_id):
+    raw = f'{score!r}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Return the (score, rowid) held by a cursor, or None if the cursor is
+    missing or invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        score, row_id = raw.decode().split('|')
+        return float(score), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def get_rows(query, author_ids, cursor=None, page_size=PAGE_SIZE):
+    """
+    Return the rows, as expected by :func:`feed.hydrate`, of at most
+    page_size posts of the authors matching the query, best first,
+    following the cursor, and the cursor of the next page (None on the
+    last page).
+    """
+    expression = match_expression(query, author_ids)
+    if not expression:
+        return [], None
+    sql = f'SELECT rowid, {RANK} AS score FROM {TABLE} WHERE {TABLE} MATCH %s'
+    params = [expression]
+    if cursor is not None:
+        sql += ' AND (score > %s OR (score = %s AND rowid > %s))'
+        params += [cursor[0], cursor[0], cursor[1]]
+    sql += ' ORDER BY score, rowid LIMIT %s'
+    params.append(page_size + 1)
+    with connections[database.read_alias()].cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        results = db_cursor.fetchall()
+
+    next_cursor = None
+    if len(results) > page_size:
+        results = results[:page_size]
+        next_cursor = encode_cursor(results[-1][1], results[-1][0])
+    rows = [{'content_type': CONTENT_TYPES[row_id % 2],
+             'post_id': row_id // 2} for row_id, _ in results]
+    return rows, next_cursor
+
+
+def search(query, author_ids, cursor=None, page_size=PAGE_SIZE):
+    """
+    Return a :class:`feed.FeedPage` of the posts of the authors matching
+    the query, see :func:`get_rows`.
+    """
+    rows, next_cursor = get_rows(query, author_ids, decode_cursor(cursor),
+                                 page_size)
+    return feed.FeedPage(feed.hydrate(rows), next_cursor)
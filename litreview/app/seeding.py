@@ -0,0 +1,200 @@
+"""
+Generation of synthetic users, follows and posts, for benchmarks.
+
+Rows are inserted with chunked ``bulk_create`` and bypass the signal
+receivers: run ``rebuild_timeline``, ``rebuild_search_index`` and
+``reconcile_review_aggregates`` afterwards if the flux, the search and
+the review flags of the tickets are needed.
+"""
+import io
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from . import models
+
+BATCH_SIZE = 5000
+USERNAME_PREFIX = 'seed'
+PASSWORD = 'litreview'
+# posts are dated over this period, up to now
+PERIOD = timedelta(days=365 * 2)
+IMAGES_DIRECTORY = 'seed'
+IMAGE_SIZE = (600, 900)
+
+
+@contextmanager
+def explicit_times():
+    """
+    Let bulk_create store the time_created and time_updated of the posts,
+    which must both be set, instead of now.
+    """
+    fields = [model._meta.get_field(name)
+              for model in (models.Ticket, models.Review)
+              for name in ('time_created', 'time_updated')]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def bulk_create(model, objects, batch_size=BATCH_SIZE):
+    """
+    Insert the objects in batches, each in its own transaction.
+    Return the ids of the objects created.
+    """
+    objects = iter(objects)
+    ids = []
+    while batch := list(islice(objects, batch_size)):
+        with transaction.atomic():
+            ids += [obj.id for obj in model.objects.bulk_create(batch)]
+    return ids
+
+
+def create_users(count):
+    """
+    Create count users named seed<number>, whose password is PASSWORD.
+    Return their ids.
+    """
+    password = make_password(PASSWORD)
+    start = (User.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+    return bulk_create(User, (
+        User(username=f'{USERNAME_PREFIX}{start + number}',
+             password=password)
+        for number in range(count)))
+
+
+def create_follows(user_ids, per_user, rng=random):
+    """
+    Make each user follow per_user other users picked uniformly.
+    """
+    def follows():
+        for user_id in user_ids:
+            candidates = rng.sample(user_ids,
+                                    min(per_user + 1, len(user_ids)))
+            followed = [candidate for candidate in candidates
+                        if candidate != user_id][:per_user]
+            for followed_id in followed:
+                yield models.UserFollows(user_id=user_id,
+                                         followed_user_id=followed_id)
+    models.UserFollows.objects.bulk_create(follows(), batch_size=BATCH_SIZE,
+                                           ignore_conflicts=True)
+
+
+def create_power_law_follows(user_ids, per_user, exponent=1.0, rng=random):
+    """
+    Make each user follow per_user other users on average, picked with a
+    probability decreasing as a power of their popularity rank: a few users
+    are followed by most users, like on a real social network.
+    """
+    ranked = list(user_ids)
+    rng.shuffle(ranked)
+    weights = list(accumulate(1 / rank ** exponent
+                              for rank in range(1, len(ranked) + 1)))
+
+    def follows():
+        for user_id in user_ids:
+            count = min(rng.randint(0, 2 * per_user), len(ranked) - 1)
+            followed = set()
+            # the popular users are drawn many times: draw again until
+            # count distinct users are drawn, or give up
+            for _ in range(4):
+                if len(followed) >= count:
+                    break
+                followed.update(rng.choices(ranked, cum_weights=weights,
+                                            k=count))
+                followed.discard(user_id)
+            for followed_id in islice(followed, count):
+                yield models.UserFollows(user_id=user_id,
+                                         followed_user_id=followed_id)
+    models.UserFollows.objects.bulk_create(follows(), batch_size=BATCH_SIZE,
+                                           ignore_conflicts=True)
+
+
+def generate_image(rng=random, size=IMAGE_SIZE):
+    """
+    Return a JPEG book cover of random colors.
+    """
+    top, bottom = (tuple(rng.randrange(256) for _ in range(3))
+                   for _ in range(2))
+    image = Image.linear_gradient('L').resize(size)
+    image = Image.composite(Image.new('RGB', size, bottom),
+                            Image.new('RGB', size, top), image)
+    output = io.BytesIO()
+    image.save(output, 'JPEG', quality=85)
+    return ContentFile(output.getvalue())
+
+
+def time_created_generator(rng=random):
+    now = timezone.now()
+    return lambda: now - PERIOD * rng.random()
+
+
+def create_tickets(user_ids, count, images=0, rng=random):
+    """
+    Create count tickets written by the users, dated randomly over PERIOD,
+    the first images of them with a generated image. Return their ids.
+    """
+    time_created = time_created_generator(rng)
+
+    def image(number):
+        if number >= images:
+            return None
+        return default_storage.save(f'{IMAGES_DIRECTORY}/livre-{number}.jpg',
+                                    generate_image(rng))
+
+    def ticket(number):
+        time = time_created()
+        return models.Ticket(title=f'Livre {number}',
+                             description='Description du livre',
+                             user_id=rng.choice(user_ids),
+                             image=image(number),
+                             time_created=time, time_updated=time)
+
+    with explicit_times():
+        return bulk_create(models.Ticket,
+                           (ticket(number) for number in range(count)))
+
+
+def create_reviews(user_ids, ticket_ids, count, rng=random):
+    """
+    Create count reviews of the tickets written by the users, dated
+    randomly over PERIOD.
+    """
+    time_created = time_created_generator(rng)
+
+    def review(number):
+        time = time_created()
+        return models.Review(ticket_id=rng.choice(ticket_ids),
+                             rating=rng.randint(0, 5),
+                             headline=f'Critique {number}',
+                             body='Commentaire de la critique',
+                             user_id=rng.choice(user_ids),
+                             time_created=time, time_updated=time)
+
+    with explicit_times():
+        bulk_create(models.Review,
+                    (review(number) for number in range(count)))
+
+
+def create_posts(user_ids, count, rng=random):
+    """
+    Create count posts written by the users, half of them tickets and half
+    of them reviews of these tickets, dated randomly over PERIOD.
+    """
+    ticket_ids = create_tickets(user_ids, count - count // 2, rng=rng)
+    if ticket_ids:
+        create_reviews(user_ids, ticket_ids, count // 2, rng=rng)
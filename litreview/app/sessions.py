@@ -0,0 +1,60 @@
+"""
+Session engine keeping the sessions in the cache and writing them to the
+database behind the requests.
+
+The sessions are read from the cache, falling back to the database, like
+``django.contrib.sessions.backends.cached_db``, so that a request reads no
+session row. A saved session is written to the cache at once, and to the
+database by the sessions.persist job, enqueued with a delay of
+``settings.SESSION_PERSIST_DELAY`` seconds and at most once per session in
+that time: the job writes the latest version of the session, once for the
+changes of its whole delay. The database thus holds every session, as of
+its last persisted version, when the cache evicts it or is cleared.
+
+The cache must be shared by the processes serving the requests and running
+the jobs, e.g. the default file-based cache on a single machine.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.contrib.sessions.backends.base import CreateError
+from django.contrib.sessions.models import Session
+
+from . import database, jobs
+
+
+class SessionStore(cached_db.SessionStore):
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        if must_create:
+            # create() picked a key unused in the cache and the database
+            if not self._cache.add(self.cache_key, data,
+                                   self.get_expiry_age()):
+                raise CreateError
+        else:
+            self._cache.set(self.cache_key, data, self.get_expiry_age())
+        window = int(time.time() // settings.SESSION_PERSIST_DELAY)
+        jobs.enqueue('sessions.persist', {'session_key': self.session_key},
+                     key=f'sessions:persist:{self.session_key}:{window}',
+                     delay=settings.SESSION_PERSIST_DELAY)
+
+
+def persist(session_key):
+    """
+    Write the cached session to the database. Return False if it is no
+    longer cached: deleted by a logout, or expired.
+    """
+    store = SessionStore(session_key)
+    data = store._cache.get(store.cache_key)
+    if data is None:
+        return False
+    store._session_cache = data
+    database.upsert(Session.objects,
+                    {'session_data': store.encode(data),
+                     'expire_date': store.get_expiry_date()},
+                    session_key=session_key)
+    return True
@@ -0,0 +1,373 @@
+"""
+Horizontal sharding of :model:`app.Ticket` and :model:`app.Review` across
+the databases of ``settings.POST_SHARDS``.
+
+The tickets of each user are stored in one shard, chosen by
+:func:`shard_for`: ``POST_SHARDS[user_id % len(POST_SHARDS)]``, unless the
+rebalance_shards command moved the user to another shard, as recorded by
+:model:`app.ShardAssignment`. The reviews are stored with the ticket they
+review, so that a ticket, its reviews and their aggregates (see
+:mod:`app.aggregates`) stay in one database. The users, the follow graph,
+the timelines and the search index stay in the default database: the
+shards have the schema of every app but only hold posts, and do not check
+their foreign keys to the users, which are attached to the posts read by
+:func:`attach_users`.
+
+The ids of the posts are unique across the databases: each shard
+allocates them from its own range of ID_RANGE ids (see
+:func:`seed_sequences`), below which are the ids of the posts created in
+the default database before the sharding, and the posts keep their id
+when they are moved.
+
+:class:`ShardRouter` writes each post to its shard. The posts of a set of
+users are read by running the same query on every shard, in parallel on a
+thread pool (see :func:`scatter`), and merging the sorted results (see
+:func:`app.feed.get_rows`); a post is found by its id with
+:func:`manager_of`.
+"""
+import contextvars
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from . import database, models, seeding, versions
+
+# ids allocated by each shard
+ID_RANGE = 2 ** 40
+ASSIGNMENTS_KEY = 'sharding:assignments:{}'
+POST_MODELS = (models.Ticket, models.Review)
+
+_lock = threading.Lock()
+_assignments = {'version': None, 'shards': {}}
+_executor = None
+
+
+def enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def is_sharded(model):
+    return enabled() and model in POST_MODELS
+
+
+def databases():
+    """
+    Return the aliases of the databases holding the posts: the shards, or
+    [None] for the database chosen by the routers without sharding.
+    """
+    return settings.POST_SHARDS or [None]
+
+
+def managers(model):
+    """
+    Return the managers of a post model on each database holding posts.
+    """
+    return [model.objects.db_manager(alias) for alias in databases()]
+
+
+def assignments():
+    """
+    Return the shards of the users moved by rebalance_shards, as
+    ``{user_id: alias}``, reloaded when another process changes them.
+    """
+    version, = versions.get(ASSIGNMENTS_KEY, ['all'])
+    with _lock:
+        if _assignments['version'] != version:
+            with database.primary_reads():
+                _assignments['shards'] = dict(
+                    models.ShardAssignment.objects
+                    .values_list('user', 'shard'))
+            _assignments['version'] = version
+        return _assignments['shards']
+
+
+def default_shard(user_id):
+    shards = settings.POST_SHARDS
+    return shards[user_id % len(shards)]
+
+
+def shard_for(user_id):
+    """
+    Return the alias of the shard holding the tickets of the user.
+    """
+    alias = assignments().get(user_id)
+    if alias in settings.POST_SHARDS:
+        return alias
+    return default_shard(user_id)
+
+
+def assign(user_id, alias):
+    """
+    Store the tickets of the user created from now on in the shard.
+    """
+    if alias == default_shard(user_id):
+        models.ShardAssignment.objects.filter(user=user_id).delete()
+    else:
+        database.upsert(models.ShardAssignment.objects, {'shard': alias},
+                        user_id=user_id)
+    versions.invalidate(ASSIGNMENTS_KEY, ['all'])
+
+
+def first_id(alias):
+    return (settings.POST_SHARDS.index(alias) + 1) * ID_RANGE
+
+
+def seed_sequences(alias):
+    """
+    Make the shard allocate the ids of the posts from its range.
+    """
+    with connections[alias].cursor() as cursor:
+        for model in POST_MODELS:
+            table = model._meta.db_table
+            cursor.execute('UPDATE sqlite_sequence SET seq = MAX(seq, %s) '
+                           'WHERE name = %s', [first_id(alias) - 1, table])
+            cursor.execute('INSERT INTO sqlite_sequence (name, seq) '
+                           'SELECT %s, %s WHERE NOT EXISTS (SELECT * FROM '
+                           'sqlite_sequence WHERE name = %s)',
+                           [table, first_id(alias) - 1, table])
+
+
+@receiver(post_migrate)
+def shard_migrated(sender, using, **kwargs):
+    # the migrations remaking a table reset its sequence
+    if sender.label == 'app' and using in settings.POST_SHARDS:
+        seed_sequences(using)
+
+
+def home_shard(post_id):
+    """
+    Return the shard which allocated the id of a post, still holding the
+    post unless it was moved, or None for the posts created in the default
+    database.
+    """
+    index = post_id // ID_RANGE - 1
+    if 0 <= index < len(settings.POST_SHARDS):
+        return settings.POST_SHARDS[index]
+    return None
+
+
+def manager_of(model, post_id):
+    """
+    Return the manager of a post model on the database holding the post of
+    id post_id, or on any shard if there is no such post.
+    """
+    if not enabled():
+        return model.objects
+    home = home_shard(post_id)
+    shards = sorted(settings.POST_SHARDS, key=lambda alias: alias != home)
+    for alias in shards:
+        if model.objects.using(alias).filter(id=post_id).exists():
+            return model.objects.db_manager(alias)
+    return model.objects.db_manager(shards[0])
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.SHARD_QUERY_WORKERS,
+                                           thread_name_prefix='shard')
+        return _executor
+
+
+def scatter(function, aliases):
+    """
+    Return ``[function(alias) for alias in aliases]``, the calls running in
+    parallel on the thread pool. They run in the current thread if there is
+    one alias, or if a connection is in a transaction, whose uncommitted
+    writes the other threads would not see.
+    """
+    aliases = list(aliases)
+    if len(aliases) < 2 or any(connections[alias].in_atomic_block
+                               for alias in aliases):
+        return [function(alias) for alias in aliases]
+
+    def call(context, alias):
+        # the thread keeps its connection to the shard between calls
+        connections[alias].close_if_unusable_or_obsolete()
+        return context.run(function, alias)
+
+    futures = [executor().submit(call, contextvars.copy_context(), alias)
+               for alias in aliases]
+    return [future.result() for future in futures]
+
+
+def in_bulk(queryset, ids):
+    """
+    Return the objects of the queryset of a post model with the ids, as
+    ``{id: object}``, from the shards. The ids are looked up in their home
+    shard, then the missing ones, moved or created in the default
+    database, in every shard.
+    """
+    by_shard = defaultdict(set)
+    for post_id in ids:
+        by_shard[home_shard(post_id)].add(post_id)
+    unknown = by_shard.pop(None, set())
+    if unknown:
+        by_shard = {alias: by_shard.get(alias, set()) | unknown
+                    for alias in settings.POST_SHARDS}
+    instances = {}
+    for result in scatter(
+            lambda alias: queryset.using(alias).in_bulk(by_shard[alias]),
+            by_shard):
+        instances.update(result)
+    missing = set(ids) - instances.keys()
+    if missing and not unknown:
+        for result in scatter(
+                lambda alias: queryset.using(alias).in_bulk(missing),
+                settings.POST_SHARDS):
+            instances.update(result)
+    return instances
+
+
+def attach_users(posts):
+    """
+    Attach their users, read from the default database, to the posts read
+    from the shards and to the tickets of their reviews.
+    """
+    posts = [*posts, *(post.ticket for post in posts
+                       if isinstance(post, models.Review))]
+    users = User.objects.in_bulk({post.user_id for post in posts})
+    for post in posts:
+        if post.user_id in users:
+            post.user = users[post.user_id]
+
+
+def delete_user_posts(user_id):
+    """
+    Delete the posts of a deleted user from the shards, where the deletion
+    of the user does not cascade.
+    """
+    for alias in settings.POST_SHARDS:
+        for model in POST_MODELS:
+            model.objects.using(alias).filter(user=user_id).delete()
+
+
+def move(user_id, source, target):
+    """
+    Move the tickets of the user, with their reviews, from the source
+    database to the target shard. Return the numbers of tickets and
+    reviews moved.
+
+    The posts are copied to the target, then deleted from the source: a
+    move interrupted by a crash is completed by moving them again.
+    """
+    tickets_table = models.Ticket._meta.db_table
+    reviews_table = models.Review._meta.db_table
+    with transaction.atomic(using=source):
+        with connections[source].cursor() as cursor:
+            # takes the write lock of the source: no review of the tickets
+            # is added until they are deleted
+            cursor.execute(f'UPDATE {tickets_table} SET user_id = user_id '
+                           f'WHERE user_id = %s', [user_id])
+        tickets = list(models.Ticket.objects.using(source)
+                       .filter(user=user_id))
+        reviews = list(models.Review.objects.using(source)
+                       .filter(ticket__user=user_id))
+        with transaction.atomic(using=target), seeding.explicit_times(), \
+                connections[target].cursor() as cursor:
+            cursor.execute('SELECT name, seq FROM sqlite_sequence')
+            sequences = cursor.fetchall()
+            models.Ticket.objects.using(target).bulk_create(
+                tickets, ignore_conflicts=True)
+            models.Review.objects.using(target).bulk_create(
+                reviews, ignore_conflicts=True)
+            # the ids of the posts created in other shards must not move
+            # the sequences of the target to their ranges
+            cursor.executemany('UPDATE sqlite_sequence SET seq = %s '
+                               'WHERE name = %s',
+                               [(seq, name) for name, seq in sequences])
+        with connections[source].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {reviews_table} WHERE ticket_id IN '
+                           f'(SELECT id FROM {tickets_table} '
+                           f'WHERE user_id = %s)', [user_id])
+            cursor.execute(f'DELETE FROM {tickets_table} WHERE user_id = %s',
+                           [user_id])
+    return len(tickets), len(reviews)
+
+
+def misplaced_users(alias):
+    """
+    Return the ids of the users with tickets in a database which is not
+    their shard.
+    """
+    user_ids = models.Ticket.objects.using(alias).order_by()\
+        .values_list('user', flat=True).distinct()
+    return [user_id for user_id in user_ids if shard_for(user_id) != alias]
+
+
+def rebalance(user_ids=None):
+    """
+    Move the tickets of the users (every user by default), with their
+    reviews, to their shard, from the default database and from the other
+    shards. Return the numbers of users, tickets and reviews moved.
+    """
+    moved = [0, 0, 0]
+    for source in [database.PRIMARY, *settings.POST_SHARDS]:
+        for user_id in misplaced_users(source):
+            if user_ids is not None and user_id not in user_ids:
+                continue
+            tickets, reviews = move(user_id, source, shard_for(user_id))
+            moved[0] += 1
+            moved[1] += tickets
+            moved[2] += reviews
+    return tuple(moved)
+
+
+def post_counts():
+    """
+    Return the numbers of tickets and reviews of each database holding
+    posts, as ``{alias: (tickets, reviews)}``.
+    """
+    return {alias: (models.Ticket.objects.using(alias).count(),
+                    models.Review.objects.using(alias).count())
+            for alias in [database.PRIMARY, *settings.POST_SHARDS]}
+
+
+class ShardRouter:
+    """
+    Write each post to its shard, and read the relations of the posts read
+    from a shard: their reviews or tickets from the shard, their users from
+    the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get('instance')
+        if not enabled() or instance is None \
+                or instance._state.db not in settings.POST_SHARDS:
+            return None
+        if model in POST_MODELS:
+            return instance._state.db
+        return database.read_alias()
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if not is_sharded(model) or instance is None:
+            return None
+        if not isinstance(instance, model):
+            # a related object assigned to a new post: a review is stored
+            # with its ticket, the other relations do not tell
+            if isinstance(instance, POST_MODELS):
+                return instance._state.db
+            return None
+        if not instance._state.adding:
+            return instance._state.db
+        if model is models.Ticket:
+            return shard_for(instance.user_id)
+        # a review is stored with its ticket
+        if models.Review.ticket.is_cached(instance):
+            return instance.ticket._state.db
+        return manager_of(models.Ticket, instance.ticket_id).db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not enabled():
+            return None
+        aliases = {database.PRIMARY, database.REPLICA,
+                   *settings.POST_SHARDS}
+        return {obj1._state.db, obj2._state.db} <= aliases
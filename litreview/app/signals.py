@@ -0,0 +1,163 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import (aggregates, backends, cards, database, feed, feed_cache,
+               follow_graph, images, jobs, live, models, search, sharding,
+               timeline, usernames)
+
+
+def ticket_author(ticket_id, using=None):
+    return models.Ticket.objects.using(using).filter(id=ticket_id)\
+        .values_list('user', flat=True).first()
+
+
+def follows_changed(user_id):
+    # the suggestions of the user and of their followers are recomputed by
+    # the next incremental run of compute_follow_suggestions
+    database.upsert(models.StaleFollowSuggestions.objects,
+                    {'time_changed': timezone.now()}, user_id=user_id)
+
+
+def content_type(model):
+    return feed.TICKET if model is models.Ticket else feed.REVIEW
+
+
+@receiver(post_save, sender=models.Ticket)
+def ticket_saved(sender, instance, created, using, **kwargs):
+    search.index(feed.TICKET, [instance])
+    if created:
+        timeline.add_post(feed.TICKET, instance)
+        # the pages of the followers are invalidated by the fan-out job
+        feed_cache.invalidate([instance.user_id], using)
+        live.publish_post(feed.TICKET, instance)
+    else:
+        # the pages displaying the ticket change, see feed_cache
+        feed_cache.invalidate_author(instance.user_id, using)
+        # the reviews display the ticket: their cards and pages change too
+        cards.touch_reviews([instance.id], instance.time_updated, using)
+
+
+@receiver(pre_save, sender=models.Ticket)
+@receiver(pre_save, sender=models.Review)
+def post_saving(sender, instance, using, **kwargs):
+    # time_updated still holds the value of the cards to delete
+    if not instance._state.adding:
+        cards.invalidate(content_type(sender),
+                         [(instance.id, instance.time_updated)], using)
+
+
+@receiver(post_delete, sender=models.Ticket)
+def ticket_deleted(sender, instance, using, **kwargs):
+    cards.invalidate(feed.TICKET, [(instance.id, instance.time_updated)],
+                     using)
+    images.ticket_deleted(instance)
+    timeline.remove_post(feed.TICKET, instance.id)
+    search.remove(feed.TICKET, [instance.id])
+    feed_cache.invalidate_author(instance.user_id, using)
+
+
+@receiver(pre_save, sender=models.Review)
+def review_saving(sender, instance, using, **kwargs):
+    # the aggregates of the ticket are updated with the rating difference
+    if not instance._state.adding:
+        instance.previous_review = models.Review.objects.using(using)\
+            .filter(id=instance.id).values('ticket', 'rating').first()
+
+
+@receiver(post_save, sender=models.Review)
+def review_saved(sender, instance, created, using, **kwargs):
+    search.index(feed.REVIEW, [instance])
+    if created:
+        aggregates.review_added(instance.ticket_id, instance.rating,
+                                instance.time_created, using)
+        timeline.add_post(feed.REVIEW, instance)
+        # the has_review flag of the ticket changes
+        author_id = ticket_author(instance.ticket_id, using)
+        if author_id not in (None, instance.user_id):
+            feed_cache.invalidate_author(author_id, using)
+        feed_cache.invalidate([instance.user_id], using)
+        live.publish_post(feed.REVIEW, instance)
+    else:
+        previous = instance.previous_review
+        if previous is None:
+            # the row was deleted then written again meanwhile: the ticket
+            # aggregates are recomputed from its reviews
+            aggregates.refresh(models.Ticket.objects.using(using)
+                               .filter(id=instance.ticket_id))
+        elif previous['ticket'] != instance.ticket_id:
+            aggregates.review_removed(previous['ticket'], previous['rating'],
+                                      using)
+            aggregates.review_added(instance.ticket_id, instance.rating,
+                                    instance.time_created, using)
+        else:
+            aggregates.rating_changed(instance.ticket_id,
+                                      previous['rating'], instance.rating,
+                                      using)
+        # the rating may have changed
+        feed_cache.invalidate_author(instance.user_id, using)
+
+
+@receiver(post_delete, sender=models.Review)
+def review_deleted(sender, instance, using, **kwargs):
+    aggregates.review_removed(instance.ticket_id, instance.rating, using)
+    cards.invalidate(feed.REVIEW, [(instance.id, instance.time_updated)],
+                     using)
+    timeline.remove_post(feed.REVIEW, instance.id)
+    search.remove(feed.REVIEW, [instance.id])
+    author_id = ticket_author(instance.ticket_id, using)
+    if author_id not in (None, instance.user_id):
+        feed_cache.invalidate_author(author_id, using)
+    feed_cache.invalidate_author(instance.user_id, using)
+
+
+@receiver(post_save, sender=models.UserFollows)
+def user_followed(sender, instance, created, using, **kwargs):
+    if created:
+        timeline.follow(instance.user_id, instance.followed_user_id)
+        follows_changed(instance.user_id)
+        follow_graph.add_edge(instance.user_id, instance.followed_user_id)
+        feed_cache.invalidate([instance.user_id], using)
+
+
+@receiver(post_delete, sender=models.UserFollows)
+def user_unfollowed(sender, instance, using, **kwargs):
+    timeline.unfollow(instance.user_id, instance.followed_user_id)
+    crossed = follow_graph.remove_edge(instance.user_id,
+                                       instance.followed_user_id)
+    if crossed:
+        jobs.enqueue('timeline.refill_author',
+                     {'author_id': instance.followed_user_id})
+    follows_changed(instance.user_id)
+    feed_cache.invalidate([instance.user_id], using)
+
+
+@receiver(pre_save, sender=User)
+def user_saving(sender, instance, update_fields, **kwargs):
+    # the cards of a renamed user are deleted
+    if not instance._state.adding and \
+            (update_fields is None or 'username' in update_fields):
+        instance.previous_username = User.objects.filter(id=instance.id)\
+            .values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    # e.g. a new password, which logs out the other sessions
+    backends.forget_user(instance.id)
+    if created:
+        usernames.add(instance.username)
+    elif update_fields is None or 'username' in update_fields:
+        usernames.refresh()
+        previous = getattr(instance, 'previous_username', None)
+        if previous not in (None, instance.username):
+            jobs.enqueue('cards.invalidate_user', {'user_id': instance.id})
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    backends.forget_user(instance.id)
+    # the deletion of the user cascades to the default database only
+    sharding.delete_user_posts(instance.id)
+    usernames.refresh()
@@ -0,0 +1,167 @@
+"""
+"People you may know": the users followed by the users a user follows,
+whom the user does not follow yet, ranked by the number of such users.
+
+The compute_follow_suggestions command loads the follow edges into a
+sparse adjacency matrix ``A`` (``A[i, j]`` is 1 when the user ``i``
+follows the user ``j``): the two-hop scores of some users are their rows
+of ``A @ A``, computed for a chunk of rows at a time to bound the memory,
+without the users they follow and themselves. The best
+``settings.FOLLOW_SUGGESTIONS`` candidates of each user are stored in
+:model:`app.FollowSuggestion`, which the follow_users page reads with one
+query.
+
+A follow or an unfollow changes the scores of the follower and of the
+users following them: the follower is recorded in
+:model:`app.StaleFollowSuggestions` by :mod:`app.signals`, and an
+incremental run recomputes the suggestions of these users only.
+
+NumPy and SciPy are only needed by the command: the web processes do not
+import this module.
+"""
+import itertools
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import models
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+# users whose scores are computed at once
+CHUNK_ROWS = 1000
+# follow edges read at once
+BATCH_SIZE = 10000
+
+
+def available():
+    return sparse is not None
+
+
+def load_graph():
+    """
+    Return the sorted ids of the users who follow or are followed, and the
+    CSR adjacency matrix of the follows, indexed like the ids.
+    """
+    edges = np.fromiter(
+        itertools.chain.from_iterable(
+            models.UserFollows.objects.values_list('user', 'followed_user')
+            .iterator(chunk_size=BATCH_SIZE)),
+        dtype=np.int64).reshape(-1, 2)
+    ids, indices = np.unique(edges, return_inverse=True)
+    indices = indices.reshape(-1, 2)
+    adjacency = sparse.csr_matrix(
+        (np.ones(len(edges), dtype=np.int32),
+         (indices[:, 0], indices[:, 1])),
+        shape=(len(ids), len(ids)))
+    return ids, adjacency
+
+
+def affected_rows(ids, adjacency, user_ids):
+    """
+    Return the sorted indices of the users of user_ids and of their
+    followers, whose scores change when the users follow or unfollow
+    someone.
+    """
+    user_ids = np.fromiter(user_ids, dtype=np.int64)
+    positions = np.searchsorted(ids, user_ids)
+    known = positions < len(ids)
+    known[known] = ids[positions[known]] == user_ids[known]
+    rows = positions[known]
+    followers = adjacency.tocsc()[:, rows].nonzero()[0]
+    return np.union1d(rows, followers)
+
+
+def two_hop_scores(adjacency, rows):
+    """
+    Return the CSR matrix of the scores of the users of the rows: the
+    number of users they follow who follow each other user, except the
+    users they follow and themselves.
+    """
+    follows = adjacency[rows]
+    scores = (follows @ adjacency).tocsr()
+    themselves = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (np.arange(len(rows)), rows)),
+        shape=scores.shape)
+    scores = scores - scores.multiply(follows) - scores.multiply(themselves)
+    scores = sparse.csr_matrix(scores)
+    scores.eliminate_zeros()
+    return scores
+
+
+def best_candidates(scores, count):
+    """
+    Yield, for each row of the CSR scores, the row and the column indices
+    and scores of its count best candidates, by decreasing score then
+    increasing index.
+    """
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        columns = scores.indices[start:end]
+        values = scores.data[start:end]
+        if len(values) > count:
+            # the candidates scoring at least the count-th best score,
+            # before sorting these only
+            threshold = np.partition(values, len(values) - count)[
+                len(values) - count]
+            kept = values >= threshold
+            columns, values = columns[kept], values[kept]
+        order = np.lexsort((columns, -values))[:count]
+        yield row, columns[order], values[order]
+
+
+def store(user_ids, suggestions):
+    """
+    Replace the suggestions of the users by the new ones.
+    """
+    with transaction.atomic():
+        models.FollowSuggestion.objects.filter(user__in=user_ids).delete()
+        models.FollowSuggestion.objects.bulk_create(suggestions)
+
+
+def compute(incremental=False, chunk_rows=CHUNK_ROWS):
+    """
+    Compute the suggestions of every user or, incremental=True, of the
+    users marked stale and of their followers. Return the number of users
+    whose suggestions were computed and the number of suggestions stored.
+    """
+    time_computed = timezone.now()
+    stale = set(models.StaleFollowSuggestions.objects
+                .values_list('user_id', flat=True))
+    ids, adjacency = load_graph()
+    if incremental:
+        rows = affected_rows(ids, adjacency, stale)
+    else:
+        rows = np.arange(len(ids))
+
+    stored = 0
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        scores = two_hop_scores(adjacency, chunk)
+        suggestions = [
+            models.FollowSuggestion(
+                user_id=int(ids[chunk[row]]),
+                suggested_user_id=int(ids[column]), score=int(score),
+                time_computed=time_computed)
+            for row, columns, values in best_candidates(
+                scores, settings.FOLLOW_SUGGESTIONS)
+            for column, score in zip(columns, values)]
+        store(ids[chunk].tolist(), suggestions)
+        stored += len(suggestions)
+
+    # the users out of the graph, who follow no one and whom no one follows
+    if incremental:
+        models.FollowSuggestion.objects\
+            .filter(user__in=stale.difference(ids.tolist())).delete()
+    else:
+        models.FollowSuggestion.objects\
+            .filter(time_computed__lt=time_computed).delete()
+    # the users marked during the run are recomputed by the next one
+    models.StaleFollowSuggestions.objects\
+        .filter(time_changed__lte=time_computed).delete()
+    return len(rows), stored
@@ -0,0 +1,86 @@
+"""
+Background jobs of the app, enqueued with :func:`app.jobs.enqueue`.
+"""
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from . import (cards, feed, feed_cache, follow_graph, images, models,
+               sessions, sharding, timeline)
+from .jobs import register
+
+
+@register('images.build_ticket_variants')
+def build_ticket_variants(ticket_id, image_name):
+    """
+    Build the variants of the image of a ticket, unless the ticket or its
+    image were deleted or replaced meanwhile.
+    """
+    manager = sharding.manager_of(models.Ticket, ticket_id)
+    ticket = manager.filter(id=ticket_id, image=image_name)
+    previous = ticket.values_list('time_updated', 'user').first()
+    if previous is None:
+        return
+    previous_time_updated, author_id = previous
+    variants = images.build_variants(image_name)
+    now = timezone.now()
+    if not ticket.update(image_variants=variants, time_updated=now):
+        images.delete_variants(variants)
+        return
+    cards.invalidate(feed.TICKET, [(ticket_id, previous_time_updated)],
+                     manager.db)
+    feed_cache.invalidate_author(author_id, manager.db)
+    # the reviews display the image of the ticket
+    cards.touch_reviews([ticket_id], now, manager.db)
+
+
+@register('cards.invalidate_user')
+def invalidate_user_cards(user_id):
+    """
+    Delete the cards displaying the username of a renamed user, see
+    :func:`cards.invalidate_user`.
+    """
+    cards.invalidate_user(user_id)
+
+
+@register('files.delete')
+def delete_files(names):
+    # the jobs queued before the ledger of app.media, which records the
+    # files to delete since
+    for name in names:
+        default_storage.delete(name)
+
+
+@register('sessions.persist')
+def persist_session(session_key):
+    """
+    Write a session saved in the cache to the database, see
+    :mod:`app.sessions`.
+    """
+    sessions.persist(session_key)
+
+
+@register('timeline.fan_out')
+def fan_out(content_type, post_id):
+    """
+    Write a new post to the timelines of the followers of its author and
+    invalidate their cached pages.
+    """
+    model = {feed.TICKET: models.Ticket,
+             feed.REVIEW: models.Review}[content_type]
+    post = sharding.manager_of(model, post_id).filter(id=post_id).first()
+    # deleted meanwhile, or read on demand by the followers
+    if post is None or not timeline.is_fanned_out(post.user_id):
+        return
+    owner_ids = timeline.fan_out(content_type, post)
+    feed_cache.invalidate(owner_ids)
+
+
+@register('timeline.refill_author')
+def refill_author(author_id):
+    """
+    Rewrite the posts of an author fanned out again in the timelines of
+    their followers, see :func:`timeline.refill_author`.
+    """
+    if timeline.is_fanned_out(author_id):
+        timeline.refill_author(author_id)
+        feed_cache.invalidate(follow_graph.followers(author_id))
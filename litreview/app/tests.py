@@ -1,3 +1,1675 @@
-# from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import random
+import shutil
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import Count, F
+from django.http import HttpResponse
+from django.test import (LiveServerTestCase, RequestFactory,
+                         SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import (aggregates, benchmark, cards, database, export, feed,
+               feed_cache, follow_graph, images, imports, jobs, live,
+               loadtest, middleware, models, search, seeding, sessions,
+               sharding, signals, suggestions, timeline, usernames, views)
+
+
+class FeedTestCase(TransactionTestCase):
+    # the caches are invalidated on commit, which a TestCase never reaches
+
+    def setUp(self):
+        cache.clear()
+        follow_graph.clear()
+        self.user = User.objects.create_user('reader', password='litreview')
+        self.author = User.objects.create_user('author',
+                                               password='litreview')
+        models.UserFollows.objects.create(user=self.user,
+                                          followed_user=self.author)
+        self.client.force_login(self.user)
+
+    def create_posts(self, user, count):
+        """
+        Create count tickets, each with one review, one second apart.
+        """
+        start = timezone.now() - timedelta(days=1)
+        for number in range(count):
+            ticket = models.Ticket.objects.create(
+                title=f'Livre {number}', user=user)
+            review = models.Review.objects.create(
+                ticket=ticket, user=user, rating=number % 6,
+                headline=f'Critique {number}')
+            time_created = start + timedelta(seconds=number)
+            models.Ticket.objects.filter(id=ticket.id)\
+                .update(time_created=time_created)
+            models.Review.objects.filter(id=review.id)\
+                .update(time_created=time_created)
+            models.TimelineEntry.objects.filter(
+                content_type=feed.TICKET, post_id=ticket.id)\
+                .update(time_created=time_created)
+            models.TimelineEntry.objects.filter(
+                content_type=feed.REVIEW, post_id=review.id)\
+                .update(time_created=time_created)
+
+    def read_concurrently(self, function, *args):
+        """
+        Call the function in another thread, hence on other database
+        connections, and return its result.
+        """
+        def read():
+            try:
+                return function(*args)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(read).result()
+
+
+class QueryCountTestCase(FeedTestCase):
+
+    def assertMaxQueries(self, max_queries, url_name, **params):
+        """
+        Request the page and assert that it ran at most max_queries
+        SQL queries. Return the number of queries run.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries), max_queries,
+            '\n'.join(query['sql'] for query in queries))
+        return len(queries)
+
+
+class FeedPaginationTests(FeedTestCase):
+
+    def test_pages_cover_every_post_once_newest_first(self):
+        self.create_posts(self.author, 7)
+        sources = feed.post_sources([self.user, self.author])
+        seen = []
+        cursor = None
+        while True:
+            page = feed.get_page(sources, cursor, page_size=3)
+            seen.extend((post.content_type, post.id) for post in page.posts)
+            if page.next_cursor is None:
+                break
+            cursor = feed.decode_cursor(page.next_cursor)
+        self.assertEqual(len(seen), 14)
+        self.assertEqual(len(set(seen)), 14)
+        expected = sorted(
+            [(post.time_created, 'TICKET', post.id)
+             for post in models.Ticket.objects.all()]
+            + [(post.time_created, 'REVIEW', post.id)
+               for post in models.Review.objects.all()],
+            reverse=True)
+        self.assertEqual(seen, [(row[1], row[2]) for row in expected])
+
+    def test_invalid_cursor_shows_first_page(self):
+        self.assertIsNone(feed.decode_cursor('not-a-cursor'))
+        response = self.client.get(reverse('flux'), {'cursor': '%%%'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_views_link_to_next_page(self):
+        self.create_posts(self.user, feed.PAGE_SIZE)
+        for url_name in ('flux', 'posts'):
+            response = self.client.get(reverse(url_name))
+            next_cursor = response.context['next_cursor']
+            self.assertEqual(len(response.context['posts']), feed.PAGE_SIZE)
+            self.assertContains(response, f'?cursor={next_cursor}')
+            response = self.client.get(reverse(url_name),
+                                       {'cursor': next_cursor})
+            self.assertEqual(len(response.context['posts']), feed.PAGE_SIZE)
+            self.assertIsNone(response.context['next_cursor'])
+
+
+class FeedQueryCountTests(QueryCountTestCase):
+    # user, until cached, then the queries of the view itself: the session
+    # is read from the cache and the page validator from the versions
+    MAX_QUERIES = {'flux': 5, 'posts': 4, 'subscriptions': 3}
+
+    def follow_more_authors(self, count):
+        for number in range(count):
+            author = User.objects.create_user(f'author{number}')
+            models.UserFollows.objects.create(user=self.user,
+                                              followed_user=author)
+            self.create_posts(author, 2)
+            models.UserFollows.objects.create(user=author,
+                                              followed_user=self.user)
+
+    def test_query_count_does_not_grow_with_posts(self):
+        self.create_posts(self.user, 1)
+        self.create_posts(self.author, 2)
+        for url_name, max_queries in self.MAX_QUERIES.items():
+            self.assertMaxQueries(max_queries, url_name)
+        self.create_posts(self.user, 10)
+        self.follow_more_authors(5)
+        for url_name, max_queries in self.MAX_QUERIES.items():
+            self.assertMaxQueries(max_queries, url_name)
+
+    def test_has_review_counts_every_review(self):
+        self.create_posts(self.author, 1)
+        ticket = models.Ticket.objects.get()
+        models.Review.objects.create(ticket=ticket, user=self.user,
+                                     rating=3, headline='Seconde critique')
+        response = self.client.get(reverse('flux'))
+        flags = [post['has_review'] for post in response.context['posts']
+                 if 'ticket' in post]
+        self.assertEqual(flags, [True])
+
+
+class TimelineTests(FeedTestCase):
+
+    def flux_posts(self, user):
+        page = feed.get_page(timeline.sources(user.id), page_size=100)
+        return [(post.content_type, post.id) for post in page.posts]
+
+    def test_posts_are_fanned_out_to_followers(self):
+        self.create_posts(self.author, 2)
+        self.assertEqual(len(self.flux_posts(self.user)), 4)
+        models.Ticket.objects.filter(user=self.author).first().delete()
+        self.assertEqual(len(self.flux_posts(self.user)), 2)
+
+    def test_follow_and_unfollow_update_the_timeline(self):
+        other = User.objects.create_user('other')
+        self.create_posts(other, 2)
+        self.assertEqual(self.flux_posts(self.user), [])
+        subscription = models.UserFollows.objects.create(
+            user=self.user, followed_user=other)
+        self.assertEqual(len(self.flux_posts(self.user)), 4)
+        subscription.delete()
+        self.assertEqual(self.flux_posts(self.user), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2)
+    def test_high_follower_authors_are_read_on_demand(self):
+        fan = User.objects.create_user('fan')
+        models.UserFollows.objects.create(user=fan,
+                                          followed_user=self.author)
+        self.create_posts(self.author, 2)
+        self.assertFalse(models.TimelineEntry.objects
+                         .exclude(owner=self.author).exists())
+        self.assertEqual(len(self.flux_posts(self.user)), 4)
+        models.UserFollows.objects.filter(user=fan).delete()
+        self.assertEqual(models.TimelineEntry.objects
+                         .filter(owner=self.user).count(), 4)
+        self.assertEqual(len(self.flux_posts(self.user)), 4)
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=2)
+    def test_high_follower_authors_are_recorded_by_the_follows(self):
+        fan = User.objects.create_user('fan')
+        follow = models.UserFollows.objects.create(user=fan,
+                                                   followed_user=self.author)
+        follow_graph.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(follow_graph.high_follower_authors(),
+                             {self.author.id})
+        # the followers are not counted
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('GROUP BY', queries[0]['sql'])
+        follow.delete()
+        self.assertEqual(follow_graph.high_follower_authors(), set())
+
+    def test_rebuild_records_the_high_follower_authors(self):
+        with override_settings(TIMELINE_FANOUT_LIMIT=1):
+            call_command('rebuild_timeline', stdout=io.StringIO())
+            self.assertEqual(follow_graph.high_follower_authors(),
+                             {self.author.id})
+        call_command('rebuild_timeline', stdout=io.StringIO())
+        self.assertEqual(follow_graph.high_follower_authors(), set())
+
+    def test_rebuild_matches_incremental_timelines(self):
+        self.create_posts(self.author, 3)
+        self.create_posts(self.user, 1)
+        before = {user.id: self.flux_posts(user)
+                  for user in User.objects.all()}
+        models.TimelineEntry.objects.all().delete()
+        self.assertEqual(timeline.rebuild(), 2)
+        after = {user.id: self.flux_posts(user)
+                 for user in User.objects.all()}
+        self.assertEqual(before, after)
+
+
+class FeedCacheTests(FeedTestCase):
+
+    def flux(self):
+        response = self.client.get(reverse('flux'))
+        return [(post['ticket'].id, post['has_review']) if 'ticket' in post
+                else (post['review'].id, post['review'].rating)
+                for post in response.context['posts']]
+
+    def test_unchanged_feed_is_served_from_the_cache(self):
+        self.create_posts(self.author, 2)
+        feed_cache.reset_stats()
+        first = self.flux()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.flux(), first)
+        # no page query
+        self.assertFalse([query for query in queries
+                          if 'ORDER BY' in query['sql']])
+        self.assertEqual(feed_cache.stats(), {'hits': 1, 'misses': 1})
+
+        # the tickets, then the reviews with their tickets, and their users
+        sources = mock.Mock()
+        with self.assertNumQueries(2):
+            page = feed_cache.get_page('flux', self.user.id, None, sources)
+        sources.assert_not_called()
+        self.assertEqual(len(page.posts), 4)
+
+    def test_posts_of_followed_users_invalidate_the_feed(self):
+        self.flux()
+        self.create_posts(self.author, 1)
+        self.assertEqual(len(self.flux()), 2)
+        review = models.Review.objects.get()
+        review.rating = 4
+        review.save()
+        self.assertIn((review.id, 4), self.flux())
+        review.delete()
+        self.assertEqual(self.flux(), [(review.ticket_id, False)])
+
+    def test_reviews_of_strangers_update_has_review(self):
+        ticket = models.Ticket.objects.create(title='Livre', user=self.user)
+        self.assertEqual(self.flux(), [(ticket.id, False)])
+        stranger = User.objects.create_user('stranger')
+        models.Review.objects.create(ticket=ticket, user=stranger,
+                                     rating=2, headline='Critique')
+        self.assertEqual(self.flux(), [(ticket.id, True)])
+
+    def test_follow_and_unfollow_invalidate_the_feed(self):
+        other = User.objects.create_user('other')
+        self.create_posts(other, 1)
+        self.assertEqual(self.flux(), [])
+        self.client.post(reverse('subscriptions'), {'username': 'other'})
+        self.assertEqual(len(self.flux()), 2)
+        self.client.post(reverse('unfollow_user', args=[other.id]))
+        self.assertEqual(self.flux(), [])
+
+    def test_pages_read_before_a_post_commits_are_reloaded(self):
+        self.client.force_login(self.author)
+
+        def posts():
+            response = self.client.get(reverse('posts'))
+            return len(response.context['posts'])
+
+        self.assertEqual(posts(), 0)
+        with transaction.atomic():
+            models.Ticket.objects.create(title='Livre', user=self.author)
+            self.assertEqual(self.read_concurrently(posts), 0)
+        self.assertEqual(posts(), 1)
+
+
+class FollowGraphTests(FeedTestCase):
+
+    def test_sets_are_loaded_once_and_updated_in_place(self):
+        self.assertEqual(follow_graph.following(self.user.id),
+                         {self.author.id})
+        self.assertEqual(follow_graph.followers(self.author.id),
+                         {self.user.id})
+        other = User.objects.create_user('other')
+        models.UserFollows.objects.create(user=self.user,
+                                          followed_user=other)
+        with self.assertNumQueries(0):
+            self.assertEqual(follow_graph.following(self.user.id),
+                             {self.author.id, other.id})
+            self.assertEqual(follow_graph.followers(self.author.id),
+                             {self.user.id})
+        models.UserFollows.objects.filter(followed_user=other).delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(follow_graph.following(self.user.id),
+                             {self.author.id})
+
+    def test_changes_of_other_processes_reload_the_sets(self):
+        follow_graph.following(self.user.id)
+        follow_graph.versions.invalidate(follow_graph.FOLLOWING_KEY,
+                                         [self.user.id])
+        with self.assertNumQueries(1):
+            follow_graph.following(self.user.id)
+
+    def test_sets_read_before_a_follow_commits_are_reloaded(self):
+        other = User.objects.create_user('other')
+
+        def load():
+            # as another process would, without the set in its cache
+            follow_graph.clear()
+            return follow_graph.following(self.user.id)
+
+        with transaction.atomic():
+            models.UserFollows.objects.create(user=self.user,
+                                              followed_user=other)
+            self.assertEqual(self.read_concurrently(load), {self.author.id})
+        self.assertEqual(follow_graph.following(self.user.id),
+                         {self.author.id, other.id})
+
+    def test_following_a_followed_user_again_is_ignored(self):
+        with mock.patch.object(follow_graph, 'following',
+                               return_value=frozenset()):
+            response = self.client.post(reverse('subscriptions'),
+                                        {'username': 'author'})
+        self.assertRedirects(response, reverse('subscriptions'))
+        self.assertEqual(models.UserFollows.objects.count(), 1)
+
+    def test_least_recently_used_sets_are_evicted(self):
+        lru = follow_graph.LRUCache(max_ids=3)
+        lru.set('a', 1, frozenset({1, 2}))
+        lru.set('b', 1, frozenset({3}))
+        lru.get('a', 1)
+        lru.set('c', 1, frozenset({4}))
+        self.assertIsNone(lru.get('b', 1))
+        self.assertEqual(lru.get('a', 1), {1, 2})
+        self.assertIsNone(lru.get('a', 2))
+
+    def test_unfollow_only_accepts_followed_users(self):
+        other = User.objects.create_user('other')
+        response = self.client.post(reverse('unfollow_user',
+                                            args=[other.id]))
+        self.assertRedirects(response, reverse('subscriptions'))
+        self.client.post(reverse('unfollow_user', args=[self.author.id]))
+        self.assertFalse(models.UserFollows.objects.exists())
+
+    def test_failed_follow_commits_nothing(self):
+        other = User.objects.create_user('other')
+        self.create_posts(other, 1)
+        stale = list(models.StaleFollowSuggestions.objects.values_list())
+        with mock.patch.object(timeline, 'follow',
+                               side_effect=DatabaseError('locked')):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('subscriptions'),
+                                 {'username': 'other'})
+        self.assertFalse(models.UserFollows.objects
+                         .filter(user=self.user, followed_user=other)
+                         .exists())
+        self.assertEqual(
+            list(models.StaleFollowSuggestions.objects.values_list()),
+            stale)
+        self.assertFalse(models.TimelineEntry.objects
+                         .filter(owner=self.user, author=other).exists())
+        self.assertEqual(follow_graph.following(self.user.id),
+                         {self.author.id})
+
+
+class AutocompleteTests(FeedTestCase):
+
+    def test_usernames_are_completed_case_insensitively(self):
+        for username in ('Autrice', 'autre', 'lecteur'):
+            User.objects.create_user(username)
+        response = self.client.get(reverse('autocomplete_usernames'),
+                                   {'q': 'AUT'})
+        self.assertEqual(response.json(),
+                         {'usernames': ['author', 'autre', 'Autrice']})
+        self.assertEqual(usernames.complete('aut', limit=1), ['author'])
+        self.assertEqual(usernames.complete(''), [])
+
+    def test_signups_are_completed_without_reloading(self):
+        usernames.complete('a')
+        User.objects.create_user('alice')
+        with self.assertNumQueries(0):
+            self.assertEqual(usernames.complete('al'), ['alice'])
+
+    def test_page_lists_only_subscriptions_and_followers(self):
+        User.objects.create_user('stranger')
+        response = self.client.get(reverse('subscriptions'))
+        self.assertNotContains(response, 'stranger')
+        self.assertContains(
+            response, reverse('unfollow_user', args=[self.author.id]))
+
+
+@skipUnless(suggestions.available(), 'needs NumPy and SciPy')
+class FollowSuggestionTests(FeedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # reader follows author and friend, who both follow popular;
+        # author also follows reader and niche
+        self.friend = User.objects.create_user('friend')
+        self.popular = User.objects.create_user('popular')
+        self.niche = User.objects.create_user('niche')
+        for user, followed_user in [(self.user, self.friend),
+                                    (self.author, self.popular),
+                                    (self.friend, self.popular),
+                                    (self.author, self.user),
+                                    (self.author, self.niche)]:
+            models.UserFollows.objects.create(user=user,
+                                              followed_user=followed_user)
+
+    def compute(self, *args, **options):
+        call_command('compute_follow_suggestions', *args,
+                     stdout=io.StringIO(), **options)
+
+    def suggested(self, user):
+        return list(models.FollowSuggestion.objects.filter(user=user)
+                    .order_by('-score', 'suggested_user')
+                    .values_list('suggested_user__username', 'score'))
+
+    def test_users_followed_by_subscriptions_are_suggested(self):
+        self.compute(chunk_size=2)
+        # neither the users followed nor the user themself
+        self.assertEqual(self.suggested(self.user),
+                         [('popular', 2), ('niche', 1)])
+        self.assertEqual(self.suggested(self.author), [('friend', 1)])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('subscriptions'))
+        self.assertEqual(len([query for query in queries
+                              if 'app_followsuggestion' in query['sql']]), 1)
+        self.assertEqual([(suggestion['username'], suggestion['score'])
+                          for suggestion in response.context['suggestions']],
+                         [('popular', 2), ('niche', 1)])
+        self.client.post(reverse('subscriptions'), {'username': 'popular'})
+        response = self.client.get(reverse('subscriptions'))
+        self.assertEqual([suggestion['username']
+                          for suggestion in response.context['suggestions']],
+                         ['niche'])
+
+    @override_settings(FOLLOW_SUGGESTIONS=1)
+    def test_only_the_best_suggestions_are_stored(self):
+        self.compute()
+        self.assertEqual(self.suggested(self.user), [('popular', 2)])
+
+    def test_incremental_run_recomputes_changed_users_and_followers(self):
+        fan = User.objects.create_user('fan')
+        models.UserFollows.objects.create(user=fan,
+                                          followed_user=self.popular)
+        models.UserFollows.objects.create(user=self.popular,
+                                          followed_user=self.niche)
+        self.compute()
+        self.assertFalse(models.StaleFollowSuggestions.objects.exists())
+        models.UserFollows.objects.filter(user=self.author,
+                                          followed_user=self.niche).delete()
+        newcomer = User.objects.create_user('newcomer')
+        models.UserFollows.objects.create(user=self.friend,
+                                          followed_user=newcomer)
+        self.assertEqual(
+            set(models.StaleFollowSuggestions.objects
+                .values_list('user_id', flat=True)),
+            {self.author.id, self.friend.id})
+        untouched = models.FollowSuggestion.objects.get(user=fan)
+        self.compute('--incremental')
+        self.assertEqual(self.suggested(self.user),
+                         [('popular', 2), ('newcomer', 1)])
+        # niche is now followed by popular
+        self.assertEqual(self.suggested(self.author),
+                         [('friend', 1), ('niche', 1)])
+        self.assertEqual(
+            models.FollowSuggestion.objects.get(user=fan).time_computed,
+            untouched.time_computed)
+        self.assertFalse(models.StaleFollowSuggestions.objects.exists())
+        models.UserFollows.objects.filter(user=self.user).delete()
+        self.compute('--incremental')
+        self.assertEqual(self.suggested(self.user), [])
+
+
+class ImageVariantTests(FeedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def upload(self, name='couverture.png', size=(1200, 1800)):
+        content = io.BytesIO()
+        Image.new('RGBA', size, 'red').save(content, 'PNG')
+        return SimpleUploadedFile(name, content.getvalue(), 'image/png')
+
+    def test_uploads_get_resized_variants(self):
+        self.client.post(reverse('create_ticket'),
+                         {'title': 'Livre', 'image': self.upload()})
+        ticket = models.Ticket.objects.get()
+        self.assertEqual(set(ticket.image_variants),
+                         set(images.available_formats()))
+        for widths in ticket.image_variants.values():
+            self.assertEqual(set(widths), {'240', '480'})
+        with default_storage.open(ticket.image_variants['jpeg']['240']) \
+                as variant:
+            self.assertEqual(Image.open(variant).size, (240, 360))
+
+        response = self.client.get(reverse('flux'))
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, f'srcset="{ticket.image_srcset}"')
+        self.assertNotContains(response, ticket.image.url)
+
+    def test_replaced_and_deleted_images_lose_their_variants(self):
+        self.client.post(reverse('create_ticket'),
+                         {'title': 'Livre', 'image': self.upload()})
+        ticket = models.Ticket.objects.get()
+        first_variants = images.variant_names(ticket.image_variants)
+        self.client.post(reverse('edit_ticket', args=[ticket.id]),
+                         {'title': 'Livre', 'image': self.upload('autre.png')})
+        ticket.refresh_from_db()
+        # deleted by the sweeper only
+        self.assertTrue(all(default_storage.exists(name)
+                            for name in first_variants))
+        self.sweep()
+        for name in first_variants + ['couverture.png']:
+            self.assertFalse(default_storage.exists(name))
+        second_variants = images.variant_names(ticket.image_variants)
+        self.assertTrue(all(default_storage.exists(name)
+                            for name in second_variants))
+        self.client.post(reverse('delete_ticket', args=[ticket.id]))
+        self.sweep()
+        for name in second_variants + [ticket.image.name]:
+            self.assertFalse(default_storage.exists(name))
+        self.assertFalse(models.DeletedFile.objects.exists())
+
+    def sweep(self, *args):
+        output = io.StringIO()
+        call_command('sweep_media', *args, stdout=output)
+        return output.getvalue()
+
+    def test_files_are_recorded_when_the_deletion_commits(self):
+        self.client.post(reverse('create_ticket'),
+                         {'title': 'Livre', 'image': self.upload()})
+        ticket = models.Ticket.objects.get()
+        try:
+            with transaction.atomic():
+                ticket.delete()
+                raise ValueError('rolled back')
+        except ValueError:
+            pass
+        self.assertFalse(models.DeletedFile.objects.exists())
+        self.user.delete()
+        files = 1 + len(images.variant_names(ticket.image_variants))
+        self.assertEqual(models.DeletedFile.objects.count(), files)
+        self.assertTrue(default_storage.exists(ticket.image.name))
+        self.assertIn(f'{files} file(s) deleted', self.sweep())
+        self.assertFalse(default_storage.exists(ticket.image.name))
+
+    def test_image_is_replaced_with_the_record_of_its_files(self):
+        self.client.post(reverse('create_ticket'),
+                         {'title': 'Livre', 'image': self.upload()})
+        ticket = models.Ticket.objects.get()
+        with mock.patch('app.media.forget',
+                        side_effect=DatabaseError('locked')), \
+                self.assertRaises(DatabaseError):
+            self.client.post(reverse('edit_ticket', args=[ticket.id]),
+                             {'title': 'Autre',
+                              'image': self.upload('autre.png')})
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.title, ticket.image.name),
+                         ('Livre', 'couverture.png'))
+        self.assertTrue(ticket.image_variants)
+
+    def test_orphans_are_found_and_deleted(self):
+        self.client.post(reverse('create_ticket'),
+                         {'title': 'Livre', 'image': self.upload()})
+        ticket = models.Ticket.objects.get()
+        orphan = default_storage.save('variants/orphelin.jpg',
+                                      ContentFile(b'jpeg'))
+        output = self.sweep('--orphans', '--dry-run', '--min-age', '0')
+        self.assertEqual(output.splitlines(),
+                         [orphan, '1 orphan file(s) found.'])
+        self.assertTrue(default_storage.exists(orphan))
+        # too recent
+        self.sweep('--orphans')
+        self.assertTrue(default_storage.exists(orphan))
+        self.sweep('--orphans', '--min-age', '0')
+        self.assertFalse(default_storage.exists(orphan))
+        for name in [ticket.image.name,
+                     *images.variant_names(ticket.image_variants)]:
+            self.assertTrue(default_storage.exists(name))
+
+
+@jobs.register('tests.record')
+def record(value):
+    JobTests.recorded.append(value)
+
+
+@jobs.register('tests.fail')
+def fail():
+    raise ValueError('Failed on purpose')
+
+
+@override_settings(JOBS_EAGER=False)
+class JobTests(FeedTestCase):
+    recorded = []
+
+    def setUp(self):
+        super().setUp()
+        JobTests.recorded = []
+
+    def run_due_jobs(self):
+        while job_id := jobs.claim():
+            jobs.execute(job_id)
+
+    def test_idempotency_key_enqueues_once(self):
+        self.assertIsNotNone(jobs.enqueue('tests.record', {'value': 1},
+                                          key='record'))
+        self.assertIsNone(jobs.enqueue('tests.record', {'value': 2},
+                                       key='record'))
+        self.run_due_jobs()
+        self.assertEqual(self.recorded, [1])
+        self.assertEqual(models.Job.objects.get(idempotency_key='record')
+                         .status, models.Job.DONE)
+
+    def test_failed_jobs_are_retried_with_backoff(self):
+        job = jobs.enqueue('tests.fail', max_attempts=2)
+        with self.assertLogs('app.jobs', 'WARNING'):
+            self.run_due_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts),
+                         (models.Job.QUEUED, 1))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIsNone(jobs.claim())
+
+        models.Job.objects.update(run_after=timezone.now())
+        with self.assertLogs('app.jobs', 'ERROR'):
+            self.run_due_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts),
+                         (models.Job.FAILED, 2))
+        self.assertIn('Failed on purpose', job.last_error)
+
+    def test_timed_out_jobs_are_claimed_again(self):
+        job = jobs.enqueue('tests.record', {'value': 1})
+        self.assertEqual(jobs.claim(), job.id)
+        self.assertIsNone(jobs.claim())
+        models.Job.objects.update(
+            time_started=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.claim(), job.id)
+
+    def test_posts_are_fanned_out_by_a_job(self):
+        self.create_posts(self.author, 1)
+        self.assertFalse(models.TimelineEntry.objects
+                         .filter(owner=self.user).exists())
+        self.assertTrue(models.TimelineEntry.objects
+                        .filter(owner=self.author).exists())
+        self.run_due_jobs()
+        self.assertEqual(models.TimelineEntry.objects
+                         .filter(owner=self.user).count(), 2)
+
+
+class SeedingTests(TestCase):
+
+    def test_follow_graph_follows_a_power_law(self):
+        user_ids = seeding.create_users(200)
+        seeding.create_power_law_follows(user_ids, 10,
+                                         rng=random.Random(1))
+        counts = sorted(
+            models.UserFollows.objects.values('followed_user')
+            .annotate(count=Count('id')).values_list('count', flat=True),
+            reverse=True)
+        self.assertGreater(counts[0], 5 * sum(counts) / len(user_ids))
+        self.assertFalse(models.UserFollows.objects
+                         .filter(user=F('followed_user')).exists())
+
+    def test_seed_command_builds_the_timelines(self):
+        call_command('seed_litreview', users=20, tickets=30, reviews=30,
+                     follows=5, seed=1, stdout=io.StringIO())
+        self.assertEqual(models.Ticket.objects.count(), 30)
+        self.assertEqual(models.Review.objects.count(), 30)
+        self.assertTrue(models.TimelineEntry.objects
+                        .exclude(owner=F('author')).exists())
+        # the posts were never edited
+        for model in (models.Ticket, models.Review):
+            self.assertFalse(model.objects
+                             .exclude(time_updated=F('time_created'))
+                             .exists())
+            field = model._meta.get_field('time_updated')
+            self.assertEqual((field.auto_now, field.auto_now_add),
+                             (True, False))
+
+
+class FeedIndexTests(TestCase):
+
+    def test_query_plans_keep_the_indexes(self):
+        author = User.objects.create_user('author')
+        models.Ticket.objects.create(title='Livre', user=author)
+        output = io.StringIO()
+        call_command('feed_query_plans', stdout=output)
+        self.assertIn('app_ticket_user_time', output.getvalue())
+        # the indexes are dropped in a transaction rolled back
+        with connection.cursor() as cursor:
+            for model in (models.Ticket, models.Review, models.UserFollows):
+                constraints = connection.introspection.get_constraints(
+                    cursor, model._meta.db_table)
+                for index in model._meta.indexes:
+                    self.assertIn(index.name, constraints)
+
+
+class BenchmarkTests(FeedTestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 95), 95)
+        self.assertEqual(benchmark.percentile([3], 95), 3)
+
+    def test_benchmark_saves_and_compares_a_baseline(self):
+        self.create_posts(self.author, 2)
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/baseline.json'
+            call_command('benchmark_views', '--save', path, requests=2,
+                         warmup=0, user='reader', stdout=io.StringIO())
+            with open(path) as baseline:
+                measures = json.load(baseline)['views']
+            self.assertEqual(set(measures),
+                             {'flux', 'posts', 'subscriptions',
+                              'autocomplete'})
+            self.assertGreater(measures['flux']['queries'], 0)
+            output = io.StringIO()
+            call_command('benchmark_views', 'flux', '--compare', path,
+                         requests=2, warmup=0, user='reader', stdout=output)
+            self.assertIn('p95_ms', output.getvalue())
+
+
+class ConcurrencyBenchmarkTests(TransactionTestCase):
+    # the threads of the command have their own connections
+
+    def setUp(self):
+        cache.clear()
+        follow_graph.clear()
+
+    def test_benchmark_reads_alone_then_with_writes(self):
+        reader = User.objects.create_user('reader')
+        author = User.objects.create_user('author')
+        models.UserFollows.objects.create(user=reader, followed_user=author)
+        models.Ticket.objects.create(title='Livre', user=author)
+        output = io.StringIO()
+        call_command('benchmark_concurrency', '--readers', '2',
+                     '--writers', '1', '--duration', '0.2', '--viewers', '1',
+                     stdout=output, stderr=io.StringIO())
+        self.assertRegex(output.getvalue(), r'\nreads +\d')
+        self.assertRegex(output.getvalue(), r'\n\+ writes +\d')
+        self.assertEqual(models.Ticket.objects.count(), 1)
+
+
+class LoadTestTests(LiveServerTestCase):
+
+    def setUp(self):
+        cache.clear()
+        follow_graph.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = self.settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        author = User.objects.create_user('author')
+        models.Ticket.objects.create(title='Livre', user=author)
+
+    def test_mix_is_parsed(self):
+        self.assertEqual(loadtest.parse_mix('flux=3, posts=1'),
+                         {'flux': 3, 'posts': 1})
+        for text in ('flux=1,unknown=1', 'flux=-1', 'flux=0'):
+            with self.assertRaises(ValueError):
+                loadtest.parse_mix(text)
+
+    def test_virtual_users_run_every_action_and_are_deleted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory, 'results.json')
+            call_command('loadtest', '--url', self.live_server_url,
+                         '--users', '4', '--duration', '1', '--seed', '1',
+                         '--mix', 'flux=1,create_ticket=1,create_review=1,'
+                                  'follow=1,login=1',
+                         '--output', str(path), stdout=io.StringIO())
+            results = json.loads(path.read_text())
+        requests = results['requests']
+        self.assertEqual(requests['total']['errors'], 0)
+        self.assertGreaterEqual(requests['POST login']['requests'], 1)
+        self.assertIn('GET flux', requests)
+        self.assertIn('p99_ms', requests['total'])
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(models.Ticket.objects.count(), 1)
+
+
+@override_settings(REQUEST_METRICS=True)
+class RequestMetricsTests(FeedTestCase):
+
+    def test_server_timing_header(self):
+        self.create_posts(self.author, 2)
+        response = self.client.get(reverse('flux'))
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'view;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        self.assertIn(f'size;desc="{len(response.content)} bytes"', timing)
+
+    @override_settings(SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_their_worst_queries(self):
+        with self.assertLogs('app.middleware', 'WARNING') as logs:
+            self.client.get(reverse('flux'))
+        record = logs.records[0].request_metrics
+        self.assertEqual(record['url_name'], 'flux')
+        self.assertEqual(len(record['worst_queries']),
+                         min(record['queries'], middleware.WORST_QUERIES))
+        self.assertTrue(all(query['call_site'].startswith('app/')
+                            for query in record['worst_queries']))
+
+    def test_duplicate_queries_are_detected(self):
+        metrics = middleware.RequestMetrics()
+        with connection.execute_wrapper(metrics.record_query):
+            for user_id in range(3):
+                User.objects.filter(id=user_id).exists()
+            User.objects.count()
+        (count, call_sites), = metrics.duplicates().values()
+        self.assertEqual(count, 3)
+        self.assertIn('app/tests.py', call_sites[0])
+
+
+class ProfilingTests(FeedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = self.settings(PROFILE_DIR=directory, PROFILE_MAX_FILES=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.directory = Path(directory)
+
+    def test_staff_requests_are_profiled_on_demand(self):
+        self.client.get(reverse('flux'), {'profile': 1})
+        self.assertEqual(list(self.directory.iterdir()), [])
+        # the save forgets the cached user
+        self.user.is_staff = True
+        self.user.save(update_fields=['is_staff'])
+        response = self.client.get(reverse('flux'), {'profile': 1})
+        name, _ = middleware.parse_profile_name(response['X-Profile'])
+        self.assertEqual(name, 'flux')
+        self.assertTrue((self.directory / response['X-Profile']).exists())
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0)
+    def test_sampled_profiles_are_rotated_and_reported(self):
+        for url_name in ('flux', 'posts', 'subscriptions'):
+            self.client.get(reverse(url_name))
+        self.assertEqual(
+            sorted(middleware.parse_profile_name(path.name)[0]
+                   for path in self.directory.iterdir()),
+            ['posts', 'subscriptions'])
+        output = io.StringIO()
+        call_command('profile_report', '--url-name', 'posts',
+                     '--sort', 'cumulative', '--top', '100', stdout=output)
+        self.assertIn('display_posts', output.getvalue())
+        self.assertNotIn('follow_users', output.getvalue())
+
+
+class ConditionalFeedTests(FeedTestCase):
+
+    def get(self, url_name, etag):
+        return self.client.get(reverse(url_name), HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_pages_answer_not_modified(self):
+        self.create_posts(self.author, 2)
+        for url_name in ('flux', 'posts'):
+            etag = self.client.get(reverse(url_name))['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get(url_name, etag)
+            self.assertEqual(response.status_code, 304)
+            # the session, the user and the page versions are cached
+            self.assertEqual(len(queries), 0)
+
+    def test_changes_update_the_etag(self):
+        self.create_posts(self.author, 1)
+        etag = self.client.get(reverse('flux'))['ETag']
+        ticket = models.Ticket.objects.get()
+        ticket.title = 'Nouveau titre'
+        ticket.save()
+        response = self.get('flux', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Nouveau titre')
+
+        etag = response['ETag']
+        other = User.objects.create_user('other')
+        models.UserFollows.objects.create(user=self.user,
+                                          followed_user=other)
+        self.assertEqual(self.get('flux', etag).status_code, 200)
+
+        etag = self.client.get(reverse('flux'))['ETag']
+        models.Review.objects.get().delete()
+        self.assertEqual(self.get('flux', etag).status_code, 200)
+
+        # the review of a followed author displays the ticket of another
+        stranger = User.objects.create_user('stranger')
+        ticket = models.Ticket.objects.create(title='Livre',
+                                              user=stranger)
+        models.Review.objects.create(ticket=ticket, user=self.author,
+                                     rating=3, headline='Critique')
+        etag = self.client.get(reverse('flux'))['ETag']
+        self.assertEqual(self.get('flux', etag).status_code, 304)
+        ticket.title = 'Titre corrigé'
+        ticket.save()
+        response = self.get('flux', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Titre corrigé')
+
+    def test_etag_changes_once_the_change_commits(self):
+        self.create_posts(self.author, 1)
+        etag = self.client.get(reverse('flux'))['ETag']
+        ticket = models.Ticket.objects.get()
+        ticket.title = 'Nouveau titre'
+        with transaction.atomic():
+            ticket.save()
+            # the page served meanwhile is the previous one
+            response = self.read_concurrently(self.get, 'flux', etag)
+            self.assertEqual(response.status_code, 304)
+        response = self.get('flux', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Nouveau titre')
+
+    @mock.patch.object(database, 'replica_configured', return_value=True)
+    def test_pages_read_from_the_replica_have_no_etag(self, configured):
+        request = RequestFactory().get(reverse('flux'))
+        request.user = self.user
+        for kind in ('flux', 'posts'):
+            etag = views.feed_validator(kind)['etag_func']
+            self.assertIsNotNone(etag(request))
+            with database.replica_reads():
+                self.assertIsNone(etag(request))
+
+
+class CardCacheTests(FeedTestCase):
+
+    def cached_cards(self, content_type, post):
+        keys = cards.card_keys(content_type, post.id, post.time_updated)
+        return cache.get_many(keys)
+
+    def test_cards_are_rendered_once_until_edited(self):
+        self.create_posts(self.author, 1)
+        ticket = models.Ticket.objects.get()
+        self.client.get(reverse('flux'))
+        self.assertEqual(len(self.cached_cards(feed.TICKET, ticket)), 1)
+        # bypasses time_updated: the cached card is displayed
+        models.Ticket.objects.update(title='Titre en base')
+        self.assertNotContains(self.client.get(reverse('flux')),
+                               'Titre en base')
+
+        ticket.refresh_from_db()
+        review = models.Review.objects.get()
+        ticket.title = 'Nouveau titre'
+        ticket.save()
+        self.assertFalse(self.cached_cards(feed.REVIEW, review))
+        # the ticket card and the review card displaying the ticket
+        self.assertContains(self.client.get(reverse('flux')),
+                            'Nouveau titre', count=2)
+
+    def test_deleted_posts_lose_their_cards(self):
+        self.create_posts(self.author, 1)
+        review = models.Review.objects.get()
+        self.client.get(reverse('flux'))
+        self.assertTrue(self.cached_cards(feed.REVIEW, review))
+        review.delete()
+        self.assertFalse(self.cached_cards(feed.REVIEW, review))
+
+    def test_renamed_users_lose_their_cards(self):
+        self.create_posts(self.author, 1)
+        stranger = User.objects.create_user('stranger')
+        ticket = models.Ticket.objects.create(title='Livre', user=stranger)
+        models.Review.objects.create(ticket=ticket, user=self.author,
+                                     rating=3, headline='Critique')
+        self.client.get(reverse('flux'))
+        self.author.username = 'auteur'
+        self.author.save()
+        response = self.client.get(reverse('flux'))
+        self.assertNotContains(response, 'author')
+        self.assertContains(response, 'auteur')
+
+        stranger.username = 'inconnu'
+        stranger.save()
+        # the review of the ticket of the renamed user
+        self.assertContains(self.client.get(reverse('flux')), 'inconnu')
+
+    def test_stars_of_the_rating(self):
+        self.create_posts(self.author, 1)
+        models.Review.objects.update(rating=3)
+        response = self.client.get(reverse('flux'))
+        self.assertContains(response, cards.FULL_STAR, count=3)
+        self.assertContains(response, cards.EMPTY_STAR, count=2)
+
+
+@override_settings(LIVE_HEARTBEAT_INTERVAL=0.05)
+class LiveEventTests(FeedTestCase):
+
+    def scope(self, logged_in=True):
+        headers = []
+        if logged_in:
+            session_key = self.client.cookies[settings.SESSION_COOKIE_NAME]
+            headers.append((b'cookie', f'{settings.SESSION_COOKIE_NAME}='
+                                       f'{session_key.value}'.encode()))
+        return {'type': 'http', 'path': reverse('flux_events'),
+                'headers': headers}
+
+    async def stream(self, scope, until):
+        """
+        Run the events application until the body sent holds until, then
+        disconnect. Return the status and the body.
+        """
+        sent = []
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        def body():
+            return b''.join(message.get('body', b'') for message in sent)
+
+        task = asyncio.ensure_future(live.events_app(scope, receive, send))
+        for _ in range(200):
+            if until in body() or task.done():
+                break
+            await asyncio.sleep(0.01)
+        disconnected.set()
+        await asyncio.wait_for(task, 1)
+        return sent[0]['status'], body()
+
+    async def test_events_reach_the_connected_followers(self):
+        async def publish():
+            while not live.get_hub().connections:
+                await asyncio.sleep(0.01)
+            hub = live.get_hub()
+            await hub.dispatch({'type': feed.REVIEW, 'id': 2,
+                                'author': self.user.id})
+            await hub.dispatch({'type': feed.TICKET, 'id': 1,
+                                'author': self.author.id})
+
+        publisher = asyncio.ensure_future(publish())
+        status, body = await self.stream(self.scope(), b'heartbeat')
+        await publisher
+        self.assertEqual(status, 200)
+        # the followers of the user do not include the user
+        self.assertEqual(body.count(b'event: post'), 1)
+        self.assertIn(json.dumps({'type': feed.TICKET, 'id': 1,
+                                  'author': self.author.id}).encode(), body)
+        self.assertFalse(live.get_hub().connections)
+
+        status, _ = await self.stream(self.scope(logged_in=False), b'')
+        self.assertEqual(status, 403)
+
+    async def test_local_backend_publishes_from_other_threads(self):
+        queue = live.get_hub().connect(self.user.id)
+        await sync_to_async(live.LocalBackend().publish,
+                            thread_sensitive=False)(
+            {'type': feed.TICKET, 'id': 1, 'author': self.author.id})
+        event = await asyncio.wait_for(queue.get(), 1)
+        self.assertEqual(event['id'], 1)
+
+    @override_settings(LIVE_EVENTS_BACKEND='app.live.DatabaseBackend')
+    def test_database_backend_stores_the_committed_posts(self):
+        live.get_backend.cache_clear()
+        self.addCleanup(live.get_backend.cache_clear)
+        ticket = models.Ticket.objects.create(title='Livre', user=self.author)
+        self.assertEqual(live.DatabaseBackend.events_after(0)[0][1],
+                         {'type': feed.TICKET, 'id': ticket.id,
+                          'author': self.author.id})
+
+    @override_settings(LIVE_POLL_INTERVAL=0.01)
+    async def test_database_backend_polls_on_after_a_failure(self):
+        event = {'type': feed.TICKET, 'id': 1, 'author': self.author.id}
+        results = [DatabaseError('database is locked'), [(1, event)]]
+
+        def events_after(last_id):
+            result = results.pop(0) if results else []
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        hub = live.Hub(asyncio.get_running_loop())
+        dispatched = asyncio.Event()
+        backend = live.DatabaseBackend()
+        with mock.patch.object(live.DatabaseBackend, 'events_after',
+                               side_effect=events_after), \
+                mock.patch.object(live.DatabaseBackend, 'expire_events') \
+                as expire_events, \
+                mock.patch.object(hub, 'dispatch',
+                                  side_effect=lambda event: dispatched.set()) \
+                as dispatch, \
+                self.assertLogs('app.live', 'ERROR') as logs:
+            task = asyncio.ensure_future(backend.poll(hub))
+            await asyncio.wait_for(dispatched.wait(), 1)
+            # a few more polls
+            await asyncio.sleep(0.05)
+            task.cancel()
+        dispatch.assert_called_once_with(event)
+        self.assertIn('database is locked', logs.output[0])
+        # once per LIVE_EVENTS_RETENTION
+        expire_events.assert_called_once_with()
+
+    def test_flux_events_stop_the_event_source_under_wsgi(self):
+        response = self.client.get(reverse('flux_events'))
+        self.assertEqual(response.status_code, 204)
+        self.assertContains(self.client.get(reverse('flux')),
+                            reverse('flux_events'))
+
+
+class ExportTests(FeedTestCase):
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_posts'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_streams_the_posts_of_the_user(self):
+        self.create_posts(self.user, 2)
+        self.create_posts(self.author, 2)
+        records = [json.loads(line) for line in self.export().splitlines()]
+        self.assertEqual([record['type'] for record in records],
+                         [feed.TICKET, feed.TICKET, feed.REVIEW, feed.REVIEW])
+        self.assertEqual({record['user'] for record in records}, {'reader'})
+
+        rows = list(csv.DictReader(io.StringIO(self.export(format='csv'))))
+        self.assertEqual([row['id'] for row in rows],
+                         [str(record['id']) for record in records])
+
+    def test_since_exports_the_newer_posts(self):
+        self.create_posts(self.user, 3)
+        records = [json.loads(line) for line in self.export().splitlines()]
+        # the ticket and review of each pair are created at the same time
+        since = min(record['time_created'] for record in records)
+        newer = self.export(since=since).splitlines()
+        self.assertEqual(len(newer), 4)
+        response = self.client.get(reverse('export_posts'),
+                                   {'since': 'hier'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_command_exports_every_user(self):
+        self.create_posts(self.user, 1)
+        self.create_posts(self.author, 1)
+        output, errors = io.StringIO(), io.StringIO()
+        call_command('export_posts', format='csv', stdout=output,
+                     stderr=errors)
+        self.assertEqual(len(output.getvalue().splitlines()), 5)
+        self.assertIn('4 post(s) exported.', errors.getvalue())
+        self.assertEqual(export.parse_since('2022-05-01').isoformat(),
+                         '2022-05-01T00:00:00+00:00')
+
+
+class ReviewAggregateTests(FeedTestCase):
+
+    def aggregates(self, ticket):
+        ticket.refresh_from_db()
+        return ticket.review_count, ticket.rating_sum, ticket.last_review_time
+
+    def test_reviews_update_the_aggregates_of_their_ticket(self):
+        ticket = models.Ticket.objects.create(title='Livre', user=self.author)
+        self.assertEqual(self.aggregates(ticket), (0, 0, None))
+        self.client.post(reverse('create_review', args=[ticket.id]),
+                         {'rating': 4, 'headline': 'Bien'})
+        review = models.Review.objects.get()
+        self.assertEqual(self.aggregates(ticket),
+                         (1, 4, review.time_created))
+        self.client.post(reverse('edit_review', args=[review.id]),
+                         {'rating': 2, 'headline': 'Moyen'})
+        self.assertEqual(self.aggregates(ticket)[:2], (1, 2))
+        models.Review.objects.create(ticket=ticket, user=self.author,
+                                     rating=5, headline='Superbe')
+        self.assertEqual(self.aggregates(ticket)[:2], (2, 7))
+        self.assertEqual(ticket.average_rating, 3.5)
+
+        # saving a loaded ticket keeps the aggregates
+        stale = models.Ticket.objects.get(id=ticket.id)
+        self.client.post(reverse('delete_review', args=[review.id]))
+        self.assertFalse(models.Review.objects.filter(id=review.id).exists())
+        stale.title = 'Livre modifié'
+        stale.save()
+        latest = models.Review.objects.get().time_created
+        self.assertEqual(self.aggregates(ticket), (1, 5, latest))
+
+    def test_review_saved_without_its_previous_row(self):
+        ticket = models.Ticket.objects.create(title='Livre', user=self.author)
+        review = models.Review.objects.create(ticket=ticket, user=self.user,
+                                              rating=4, headline='Bien')
+        models.Ticket.objects.filter(id=ticket.id).update(review_count=0)
+        review.previous_review = None
+        signals.review_saved(models.Review, review, created=False,
+                             using='default')
+        self.assertEqual(self.aggregates(ticket),
+                         (1, 4, review.time_created))
+
+    def test_feed_reads_has_review_from_the_ticket(self):
+        self.create_posts(self.author, 2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('flux'))
+        self.assertEqual([post['has_review'] for post
+                          in response.context['posts'] if 'ticket' in post],
+                         [True, True])
+        self.assertFalse([query for query in queries
+                          if 'EXISTS' in query['sql']])
+
+    def test_reconcile_repairs_drift(self):
+        self.create_posts(self.author, 2)
+        # create_posts moves the reviews back in time
+        self.assertEqual(aggregates.drifted().count(), 2)
+        aggregates.refresh()
+        ticket = models.Ticket.objects.first()
+        models.Ticket.objects.filter(id=ticket.id).update(
+            review_count=3, last_review_time=None)
+        output = io.StringIO()
+        call_command('reconcile_review_aggregates', '--dry-run',
+                     stdout=output)
+        self.assertIn(f'1 drifted ticket(s): {ticket.id}', output.getvalue())
+        self.assertEqual(aggregates.drifted().count(), 1)
+        call_command('reconcile_review_aggregates', stdout=output)
+        self.assertIn('1 ticket(s) repaired.', output.getvalue())
+        self.assertFalse(aggregates.drifted().exists())
+        self.assertEqual(self.aggregates(ticket)[0], 1)
+
+
+class SearchTests(FeedTestCase):
+
+    def results(self, query, viewer=None, cursor=None):
+        viewer = viewer or self.user
+        authors = [viewer.id, *follow_graph.following(viewer.id)]
+        page = search.search(query, authors, cursor)
+        return [(post.content_type, post.id) for post in page.posts], \
+            page.next_cursor
+
+    def test_index_follows_the_posts(self):
+        ticket = models.Ticket.objects.create(
+            title='Un étrange voyage', description='Roman', user=self.author)
+        review = models.Review.objects.create(
+            ticket=ticket, user=self.user, rating=4, headline='Superbe',
+            body='Un voyage étrange et beau')
+        # diacritics are ignored, the last word is a prefix
+        self.assertEqual(self.results('ETRANGE voy')[0],
+                         [(feed.TICKET, ticket.id), (feed.REVIEW, review.id)])
+
+        ticket.title = 'Une odyssée'
+        ticket.save()
+        self.assertEqual(self.results('odyssee')[0],
+                         [(feed.TICKET, ticket.id)])
+        self.assertEqual(self.results('étrange')[0],
+                         [(feed.REVIEW, review.id)])
+        ticket.delete()
+        self.assertEqual(self.results('odyssee')[0], [])
+        self.assertEqual(self.results('étrange')[0], [])
+        self.assertEqual(self.results('" OR *')[0], [])
+
+    def test_results_are_limited_to_the_follow_set(self):
+        stranger = User.objects.create_user('stranger')
+        models.Ticket.objects.create(title='Dune', user=stranger)
+        ticket = models.Ticket.objects.create(title='Dune', user=self.author)
+        self.assertEqual(self.results('dune')[0], [(feed.TICKET, ticket.id)])
+        self.assertEqual(len(self.results('dune', viewer=stranger)[0]), 1)
+        # the author tokens are not searched
+        self.assertEqual(self.results(f'u{self.author.id}')[0], [])
+
+    def test_results_are_ranked_and_paginated(self):
+        best = models.Ticket.objects.create(title='Dune', user=self.author)
+        for number in range(feed.PAGE_SIZE + 4):
+            models.Ticket.objects.create(
+                title=f'Livre {number}', description='Après Dune.',
+                user=self.author)
+        first, cursor = self.results('dune')
+        self.assertEqual(first[0], (feed.TICKET, best.id))
+        self.assertEqual(len(first), feed.PAGE_SIZE)
+        second, cursor_after = self.results('dune', cursor=cursor)
+        self.assertEqual(len(second), 5)
+        self.assertIsNone(cursor_after)
+        self.assertFalse(set(first) & set(second))
+
+    def test_search_page_and_rebuild(self):
+        self.create_posts(self.author, 2)
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.TABLE}')
+        output = io.StringIO()
+        call_command('rebuild_search_index', stdout=output)
+        self.assertIn('4 post(s) indexed.', output.getvalue())
+
+        response = self.client.get(reverse('search'), {'q': 'critique 1'})
+        self.assertContains(response, 'Critique 1')
+        self.assertNotContains(response, 'Critique 0')
+        response = self.client.get(reverse('search'), {'q': 'absent'})
+        self.assertContains(response, 'Aucun résultat')
+
+
+class ImportTests(FeedTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = self.settings(MEDIA_ROOT=f'{self.directory}/media')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, name, records):
+        path = Path(self.directory, name)
+        if path.suffix == '.csv':
+            with open(path, 'w', newline='') as file:
+                file.writelines(export.csv_lines(records))
+        else:
+            path.write_text(''.join(export.ndjson_lines(records)))
+        return path
+
+    def import_posts(self, path, *args):
+        output, errors = io.StringIO(), io.StringIO()
+        call_command('import_posts', str(path), *args, stdout=output,
+                     stderr=errors)
+        return output.getvalue(), errors.getvalue()
+
+    def record(self, content_type, post_id, **fields):
+        record = dict.fromkeys(export.FIELDS)
+        record.update(type=content_type, id=post_id, user='author',
+                      time_created='2022-05-01T12:00:00+00:00')
+        record.update(fields)
+        return record
+
+    def test_import_of_an_export(self):
+        self.create_posts(self.author, 2)
+        path = self.write('posts.ndjson', export.records())
+        output, _ = self.import_posts(path, '--batch-size', '3')
+        self.assertIn('2 ticket(s) and 2 review(s) imported', output)
+        self.assertEqual(models.Ticket.objects.count(), 4)
+        imported = models.ImportedPost.objects.filter(
+            content_type=feed.REVIEW)
+        for review in models.Review.objects.filter(
+                id__in=imported.values('post_id')):
+            self.assertTrue(models.ImportedPost.objects.filter(
+                content_type=feed.TICKET, post_id=review.ticket_id).exists())
+        # bulk_create bypasses the signals: the timelines are written
+        self.assertEqual(models.TimelineEntry.objects.filter(
+            owner=self.user).count(), 8)
+        self.assertFalse(Path(f'{path}.checkpoint').exists())
+
+        # a source is imported once
+        output, _ = self.import_posts(path)
+        self.assertIn('0 ticket(s) and 0 review(s) imported', output)
+        self.assertEqual(models.Ticket.objects.count(), 4)
+
+    def test_invalid_records_are_rejected(self):
+        path = self.write('posts.csv', [
+            self.record(feed.TICKET, 1, title='Livre'),
+            self.record(feed.TICKET, 2, title='x' * 129),
+            self.record(feed.TICKET, 3, title='Livre',
+                        description='x' * 2049),
+            self.record(feed.TICKET, 4, title='Livre', user='inconnu'),
+            self.record(feed.REVIEW, 1, ticket=1, rating=9, headline='Bof'),
+            self.record(feed.REVIEW, 2, ticket=2, rating=3, headline='Bof'),
+            self.record(feed.REVIEW, 3, ticket=1, rating=3, headline='Bien'),
+        ])
+        errors = Path(self.directory, 'errors.ndjson')
+        output, _ = self.import_posts(path, '--errors', str(errors))
+        self.assertIn('1 ticket(s) and 1 review(s) imported, 5 record(s) '
+                      'rejected', output)
+        rejected = [json.loads(line) for line in errors.read_text()
+                    .splitlines()]
+        self.assertEqual([error['record'] for error in rejected],
+                         [2, 3, 4, 5, 6])
+        self.assertIn('Unknown user', rejected[2]['error'])
+        self.assertIn('rating', rejected[3]['error'])
+        self.assertIn('Unknown ticket', rejected[4]['error'])
+        self.assertEqual(models.Review.objects.get().headline, 'Bien')
+
+        self.import_posts(path, '--create-users', '--source', 'autre')
+        self.assertTrue(User.objects.filter(username='inconnu').exists())
+
+    def test_resume_from_checkpoint(self):
+        path = self.write('posts.ndjson', [
+            self.record(feed.TICKET, number, title=f'Livre {number}')
+            for number in range(4)])
+        imports.write_checkpoint(f'{path}.checkpoint', {
+            'input': str(path), 'source': path.name, 'position': 3,
+            feed.TICKET: 3, feed.REVIEW: 0, 'rejected': 0})
+        output, _ = self.import_posts(path)
+        self.assertIn('Resuming after record 3.', output)
+        self.assertEqual(list(models.Ticket.objects.values_list(
+            'title', flat=True)), ['Livre 3'])
+
+        self.import_posts(path, '--restart')
+        self.assertEqual(models.Ticket.objects.count(), 4)
+
+    def test_images_are_copied_with_their_variants(self):
+        Image.new('RGB', (600, 900), 'red').save(
+            Path(self.directory, 'couverture.jpg'))
+        path = self.write('posts.ndjson', [
+            self.record(feed.TICKET, 1, title='Livre',
+                        image='couverture.jpg'),
+            self.record(feed.TICKET, 2, title='Livre', image='absente.jpg'),
+        ])
+        _, errors = self.import_posts(path)
+        self.assertIn('Record 2: Invalid image', errors)
+        ticket = models.Ticket.objects.get()
+        self.assertTrue(default_storage.exists(ticket.image.name))
+        self.assertIn('jpeg', ticket.image_variants)
+
+
+class SessionCacheTests(FeedTestCase):
+
+    def test_pages_read_no_session_nor_user(self):
+        session_key = self.client.session.session_key
+        self.assertTrue(Session.objects.filter(session_key=session_key)
+                        .exists())
+        self.client.get(reverse('subscriptions'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('subscriptions'))
+        sql = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('django_session', sql)
+        self.assertNotIn(f'"auth_user"."id" = {self.user.id}', sql)
+
+    @override_settings(JOBS_EAGER=False)
+    def test_sessions_are_written_behind(self):
+        store = sessions.SessionStore()
+        store['value'] = 1
+        store.create()
+        store['value'] = 2
+        store.save()
+        self.assertFalse(Session.objects.filter(
+            session_key=store.session_key).exists())
+        job = models.Job.objects.get(name='sessions.persist')
+        self.assertGreater(job.run_after, timezone.now())
+        jobs.execute(job.id)
+        self.assertEqual(sessions.SessionStore(store.session_key).load(),
+                         {'value': 2})
+        self.assertEqual(Session.objects.get(
+            session_key=store.session_key).get_decoded(), {'value': 2})
+
+    def test_password_change_logs_the_sessions_out(self):
+        self.assertEqual(self.client.get(reverse('flux')).status_code, 200)
+        self.user.set_password('nouveau')
+        self.user.save()
+        response = self.client.get(reverse('flux'))
+        self.assertRedirects(response, f"{reverse('login')}?next=/flux/",
+                             fetch_redirect_response=False)
+
+    def test_sessions_of_the_default_backend_stay_logged_in(self):
+        self.client.force_login(
+            self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertEqual(self.client.get(reverse('flux')).status_code, 200)
+
+    def test_signup_logs_in_with_the_cached_backend(self):
+        self.client.logout()
+        self.client.post(reverse('signup'),
+                         {'username': 'nouveau', 'password1': 'Mot2Passe!',
+                          'password2': 'Mot2Passe!'})
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY],
+                         'app.backends.CachedModelBackend')
+
+
+class SQLiteTuningTests(TestCase):
+
+    def test_connections_run_the_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0],
+                             settings.SQLITE_PRAGMAS['cache_size'])
+
+    def test_sync_replica_needs_a_replica(self):
+        with self.assertRaises(CommandError):
+            call_command('sync_replica')
+
+
+class ReplicaSyncTests(TransactionTestCase):
+    # the backup only copies the committed transactions
+
+    def test_sync_replica_copies_the_database(self):
+        author = User.objects.create_user('author')
+        ticket = models.Ticket.objects.create(title='Livre', user=author)
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory, 'replica.sqlite3')
+            with mock.patch.dict(settings.DATABASES,
+                                 {database.REPLICA: {'NAME': path}}):
+                call_command('sync_replica', stdout=io.StringIO())
+            copy = sqlite3.connect(path)
+            try:
+                self.assertEqual(
+                    copy.execute('SELECT title FROM app_ticket WHERE id = ?',
+                                 [ticket.id]).fetchall(),
+                    [('Livre',)])
+                self.assertEqual(
+                    copy.execute('PRAGMA journal_mode').fetchone(), ('wal',))
+            finally:
+                copy.close()
+
+
+@mock.patch.object(database, 'replica_configured', return_value=True)
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = database.ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def test_only_the_replica_reads_go_to_the_replica(self, configured):
+        self.assertIsNone(self.router.db_for_read(models.Ticket))
+        with database.replica_reads():
+            self.assertEqual(self.router.db_for_read(models.Ticket),
+                             database.REPLICA)
+            self.assertEqual(self.router.db_for_write(models.Ticket),
+                             database.PRIMARY)
+            with database.primary_reads():
+                self.assertIsNone(self.router.db_for_read(models.Ticket))
+        self.assertFalse(self.router.allow_migrate(database.REPLICA, 'app'))
+
+    def test_no_replica(self, configured):
+        configured.return_value = False
+        with database.replica_reads():
+            self.assertIsNone(self.router.db_for_read(models.Ticket))
+        with self.assertRaises(MiddlewareNotUsed):
+            middleware.ReplicaPinMiddleware(HttpResponse)
+
+    def test_writers_are_pinned_to_the_primary_database(self, configured):
+        @database.read_from_replica
+        def view(request):
+            return HttpResponse(str(database.reading_replica()))
+
+        pin = middleware.ReplicaPinMiddleware(view)
+        response = pin(self.factory.get('/'))
+        self.assertEqual(response.content, b'True')
+        self.assertNotIn(database.PIN_COOKIE, response.cookies)
+
+        response = pin(self.factory.post('/'))
+        cookie = response.cookies[database.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_MAX_LAG)
+        request = self.factory.get('/')
+        request.COOKIES[database.PIN_COOKIE] = cookie.value
+        self.assertEqual(pin(request).content, b'False')
+
+
+@override_settings(POST_SHARDS=['shard0', 'shard1'], SHARD_QUERY_WORKERS=1)
+class ShardingTests(FeedTestCase):
+    databases = {'default', 'shard0', 'shard1'}
+
+    def setUp(self):
+        super().setUp()
+        for alias in settings.POST_SHARDS:
+            # connected before POST_SHARDS was overridden
+            database.apply_pragmas(None, connections[alias])
+            sharding.seed_sequences(alias)
+        sharding.assign(self.user.id, 'shard0')
+        sharding.assign(self.author.id, 'shard1')
+
+    def create_post(self, user, ticket=None):
+        """
+        Create a ticket, or a review of the ticket, in the shard of its
+        author.
+        """
+        if ticket is None:
+            return models.Ticket.objects.create(title='Livre', user=user)
+        return models.Review.objects.create(ticket=ticket, user=user,
+                                            rating=4, headline='Critique')
+
+    def test_posts_are_stored_with_the_tickets_of_their_author(self):
+        ticket = self.create_post(self.author)
+        review = self.create_post(self.user, ticket)
+        self.assertEqual((ticket._state.db, review._state.db),
+                         ('shard1', 'shard1'))
+        self.assertGreaterEqual(ticket.id, sharding.first_id('shard1'))
+        self.assertFalse(models.Ticket.objects.exists())
+        self.assertEqual(sharding.manager_of(models.Review, review.id).db,
+                         'shard1')
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.review_count, ticket.rating_sum), (1, 4))
+        self.assertEqual(self.create_post(self.user)._state.db, 'shard0')
+
+    def test_pages_merge_the_posts_of_every_shard(self):
+        posts = []
+        for number in range(3):
+            ticket = self.create_post(self.author)
+            posts += [ticket, self.create_post(self.user, ticket),
+                      self.create_post(self.user)]
+        sources = feed.post_sources([self.user, self.author])
+        seen, cursor = [], None
+        while True:
+            page = feed.get_page(sources, cursor, page_size=2)
+            seen.extend(page.posts)
+            if page.next_cursor is None:
+                break
+            cursor = feed.decode_cursor(page.next_cursor)
+        self.assertEqual([post.id for post in seen],
+                         [post.id for post in reversed(posts)])
+        self.assertEqual({post.user.username for post in seen},
+                         {'reader', 'author'})
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_flux_reads_the_shards_of_the_authors_read_on_demand(self):
+        ticket = self.create_post(self.author)
+        self.create_post(self.user, ticket)
+        self.create_post(self.user)
+        response = self.client.get(reverse('flux'))
+        self.assertEqual(len(response.context['posts']), 3)
+        self.assertContains(response, 'Critique')
+
+    def test_rebalance_moves_the_posts_to_another_shard(self):
+        ticket = self.create_post(self.author)
+        review = self.create_post(self.user, ticket)
+        output = io.StringIO()
+        call_command('rebalance_shards', 'author', to='shard0',
+                     stdout=output)
+        self.assertIn('1 ticket(s) and 1 review(s) of 1 user(s) moved.',
+                      output.getvalue())
+        self.assertFalse(models.Ticket.objects.using('shard1').exists())
+        moved = models.Ticket.objects.using('shard0').get(id=ticket.id)
+        self.assertEqual((moved.time_created, moved.review_count),
+                         (ticket.time_created, 1))
+        self.assertTrue(models.Review.objects.using('shard0')
+                        .filter(id=review.id).exists())
+        self.assertEqual(self.create_post(self.author)._state.db, 'shard0')
+        with self.assertRaises(CommandError):
+            call_command('rebalance_shards', to='shard0')
+
+    def test_deleting_a_user_deletes_their_posts(self):
+        ticket = self.create_post(self.author)
+        self.create_post(self.user, ticket)
+        self.author.delete()
+        for alias in settings.POST_SHARDS:
+            self.assertFalse(models.Ticket.objects.using(alias).exists())
+            self.assertFalse(models.Review.objects.using(alias).exists())
+        self.assertFalse(models.TimelineEntry.objects
+                         .filter(post_id=ticket.id).exists())
@@ -0,0 +1,208 @@
+"""
+Materialized flux of every user, stored in :model:`app.TimelineEntry`.
+
+Posts are copied into the timelines of their author when they are
+created, and into the timelines of the followers of their author by a
+background job (fan-out on write), so that a flux page is a single range
+of the owner's timeline.
+
+Authors followed by at least ``settings.TIMELINE_FANOUT_LIMIT`` users are
+not fanned out: their posts are merged in from :model:`app.Ticket` and
+:model:`app.Review` when their followers load the flux (fan-out on read).
+"""
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import database, feed, follow_graph, jobs, models, sharding
+
+BATCH_SIZE = 1000
+
+
+def is_fanned_out(author_id):
+    """
+    Return True if the posts of the author are written to the timelines
+    of their followers.
+    """
+    return author_id not in follow_graph.high_follower_authors()
+
+
+def followed_authors(owner_id, fanned_out):
+    """
+    Return the sorted ids of the users followed by the owner whose posts
+    are (fanned_out=True) or are not (fanned_out=False) fanned out.
+    """
+    following = follow_graph.following(owner_id)
+    high_follower = follow_graph.high_follower_authors()
+    if fanned_out:
+        return sorted(following - high_follower)
+    return sorted(following & high_follower)
+
+
+def sources(owner_id, read_authors=None):
+    """
+    Return the row sources of the flux of the owner, for
+    :func:`feed.get_page`.
+    :arg: read_authors: Ids of the authors followed by the owner that are
+    not fanned out, if already known.
+    """
+    if read_authors is None:
+        read_authors = followed_authors(owner_id, fanned_out=False)
+    entries = models.TimelineEntry.objects.filter(owner=owner_id)
+    if not read_authors:
+        return [entries.values('time_created', 'content_type', 'post_id')]
+    entries = entries.exclude(author__in=read_authors)
+    return [entries.values('time_created', 'content_type', 'post_id'),
+            *feed.post_sources(read_authors)]
+
+
+def author_entries(owner_ids, author_ids):
+    """
+    Generate the timeline entries of the posts of the authors for each
+    owner.
+    """
+    managers = [(feed.TICKET, manager)
+                for manager in sharding.managers(models.Ticket)]
+    managers += [(feed.REVIEW, manager)
+                 for manager in sharding.managers(models.Review)]
+    for content_type, manager in managers:
+        rows = manager.filter(user__in=author_ids)\
+            .values_list('id', 'user_id', 'time_created')\
+            .iterator(chunk_size=BATCH_SIZE)
+        for post_id, author_id, time_created in rows:
+            for owner_id in owner_ids:
+                yield models.TimelineEntry(owner_id=owner_id,
+                                           author_id=author_id,
+                                           content_type=content_type,
+                                           post_id=post_id,
+                                           time_created=time_created)
+
+
+def insert(entries):
+    """
+    Insert the timeline entries in batches of BATCH_SIZE.
+    """
+    entries = iter(entries)
+    with transaction.atomic():
+        while batch := list(islice(entries, BATCH_SIZE)):
+            models.TimelineEntry.objects.bulk_create(batch)
+
+
+def entry(owner_id, content_type, post):
+    return models.TimelineEntry(owner_id=owner_id,
+                                author_id=post.user_id,
+                                content_type=content_type,
+                                post_id=post.id,
+                                time_created=post.time_created)
+
+
+def add_post(content_type, post):
+    """
+    Write a new post to the timeline of its author and, unless the author
+    has too many followers, queue its fan-out to the timelines of the
+    followers of its author (see :func:`tasks.fan_out`).
+    """
+    insert([entry(post.user_id, content_type, post)])
+    if is_fanned_out(post.user_id):
+        def enqueue():
+            jobs.enqueue('timeline.fan_out',
+                         {'content_type': content_type, 'post_id': post.id},
+                         key=f'timeline:fan-out:{content_type}:{post.id}')
+
+        if post._state.db == database.PRIMARY:
+            # the job is committed with the post
+            enqueue()
+        else:
+            # the post is committed in its shard, by another transaction
+            transaction.on_commit(enqueue, using=post._state.db)
+
+
+def fan_out(content_type, post):
+    """
+    Write a post to the timelines of the followers of its author which do
+    not hold it yet. Return the ids of their owners.
+    """
+    written = set(models.TimelineEntry.objects
+                  .filter(content_type=content_type, post_id=post.id)
+                  .values_list('owner', flat=True))
+    owner_ids = follow_graph.followers(post.user_id) - written
+    insert(entry(owner_id, content_type, post) for owner_id in owner_ids)
+    return owner_ids
+
+
+def add_posts(content_type, posts):
+    """
+    Write posts created in bulk, bypassing the signal receivers, to the
+    timelines of their author and, unless the author has too many
+    followers, of the followers of their author. Return the ids of the
+    owners of the timelines written.
+    """
+    owner_ids = set()
+
+    def entries():
+        for post in posts:
+            post_owners = {post.user_id}
+            if is_fanned_out(post.user_id):
+                post_owners |= follow_graph.followers(post.user_id)
+            owner_ids.update(post_owners)
+            for owner_id in post_owners:
+                yield entry(owner_id, content_type, post)
+
+    insert(entries())
+    return owner_ids
+
+
+def remove_post(content_type, post_id):
+    """
+    Remove a deleted post from every timeline.
+    """
+    models.TimelineEntry.objects.filter(content_type=content_type,
+                                        post_id=post_id).delete()
+
+
+def follow(owner_id, author_id):
+    """
+    Copy the posts of a newly followed author to the owner's timeline.
+    """
+    if is_fanned_out(author_id):
+        insert(author_entries([owner_id], [author_id]))
+
+
+def unfollow(owner_id, author_id):
+    """
+    Remove the posts of an unfollowed author from the owner's timeline.
+    """
+    models.TimelineEntry.objects.filter(owner=owner_id,
+                                        author=author_id).delete()
+
+
+def refill_author(author_id):
+    """
+    Rewrite the posts of the author in the timelines of their followers,
+    once the author is fanned out again: their followers may be missing
+    the posts published while they were read on demand.
+    """
+    follower_ids = follow_graph.followers(author_id)
+    with transaction.atomic():
+        models.TimelineEntry.objects.filter(author=author_id)\
+            .exclude(owner=author_id).delete()
+        insert(author_entries(follower_ids, [author_id]))
+
+
+def rebuild(owners=None):
+    """
+    Rebuild the timelines of the owners (every user by default) from the
+    posts and the follow graph. Return the number of timelines rebuilt.
+    """
+    if owners is None:
+        owners = User.objects.all()
+    rebuilt = 0
+    for owner_id in owners.values_list('id', flat=True).iterator():
+        with transaction.atomic():
+            models.TimelineEntry.objects.filter(owner=owner_id).delete()
+            author_ids = [owner_id]
+            author_ids += followed_authors(owner_id, fanned_out=True)
+            insert(author_entries([owner_id], author_ids))
+        rebuilt += 1
+    return rebuilt
@@ -0,0 +1,79 @@
+"""
+In-memory sorted index of the usernames, for the autocomplete of the
+subscriptions page.
+
+The index is tagged with a version shared by every process through the
+Django cache (see :mod:`app.versions`): it is reloaded with one query when
+users are renamed or deleted, while signups of this process are inserted
+in place.
+"""
+import bisect
+import threading
+
+from django.contrib.auth.models import User
+
+from . import versions
+
+VERSION_KEY = 'usernames:version:{}'
+LIMIT = 10
+
+_lock = threading.Lock()
+_index = {'version': None, 'keys': [], 'usernames': []}
+
+
+def _current():
+    """
+    Return the sorted case-folded usernames and the usernames, in the same
+    order, reloading them if they are outdated.
+    """
+    version, = versions.get(VERSION_KEY, ['all'])
+    with _lock:
+        if _index['version'] != version:
+            entries = sorted((username.casefold(), username) for username
+                             in User.objects.values_list('username',
+                                                         flat=True))
+            _index['keys'] = [key for key, _ in entries]
+            _index['usernames'] = [username for _, username in entries]
+            _index['version'] = version
+        return _index['keys'], _index['usernames']
+
+
+def complete(prefix, limit=LIMIT):
+    """
+    Return the first usernames, in alphabetical order, starting with the
+    prefix (case-insensitive).
+    """
+    prefix = prefix.casefold()
+    if not prefix:
+        return []
+    keys, usernames = _current()
+    start = bisect.bisect_left(keys, prefix)
+    matches = []
+    for position in range(start, min(start + limit, len(keys))):
+        if not keys[position].startswith(prefix):
+            break
+        matches.append(usernames[position])
+    return matches
+
+
+def add(username):
+    """
+    Insert the username of a new user in the index.
+    """
+    previous, = versions.get(VERSION_KEY, ['all'])
+    versions.invalidate(VERSION_KEY, ['all'])
+    version, = versions.get(VERSION_KEY, ['all'])
+    with _lock:
+        if _index['version'] == previous:
+            key = username.casefold()
+            position = bisect.bisect_left(_index['keys'], key)
+            _index['keys'].insert(position, key)
+            _index['usernames'].insert(position, username)
+            _index['version'] = version
+
+
+def refresh():
+    """
+    Reload the index of every process on its next use.
+    """
+    versions.invalidate(VERSION_KEY, ['all'])
@@ -0,0 +1,33 @@
+"""
+Version tokens stored in the Django cache, shared by every process.
+
+Invalidating a version deletes it: the next read seeds a new one from the
+clock, so that concurrent invalidations are never lost and a version
+evicted from the cache never comes back with an old value.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def get(key_format, ids):
+    """
+    Return the versions of the ids, seeding the missing ones.
+    """
+    keys = [key_format.format(id) for id in ids]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = time.time_ns()
+            # another request may have seeded the version meanwhile
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def invalidate(key_format, ids):
+    """
+    Invalidate the versions of the ids.
+    """
+    cache.delete_many([key_format.format(id) for id in ids])
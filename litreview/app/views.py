@@ -1,131 +1,271 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Value, CharField
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ObjectDoesNotExist
-from itertools import chain
-from . import forms, models
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+from django.http import (HttpResponse, HttpResponseBadRequest,
+                         JsonResponse, StreamingHttpResponse)
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from . import (cards, database, export, feed, feed_cache, follow_graph,
+               forms, images, models, search, sharding, timeline, usernames)
 from django.contrib.auth.models import User
 
 
+def feed_validator(kind):
+    """
+    Return the keyword arguments of :func:`condition` validating the
+    viewer's kind ('flux' or 'posts') page, whose ETag is computed by
+    :func:`feed_cache.page_validator`.
+
+    The pages read from the replica have no ETag: built from a replica not
+    holding the last changes yet, they would carry the ETag of the current
+    versions, and the browser would keep revalidating its stale page.
+    """
+    def etag(request):
+        if database.reading_replica():
+            return None
+        viewer_id = request.user.id
+        read_authors = []
+        if kind == 'flux':
+            read_authors = timeline.followed_authors(viewer_id,
+                                                     fanned_out=False)
+        return feed_cache.page_validator(kind, viewer_id, read_authors)
+
+    return {'etag_func': etag}
+
+
 @login_required(login_url='login')
+@database.read_from_replica
+@cache_control(private=True, no_cache=True)
+@condition(**feed_validator('flux'))
 def flux(request):
     """
     Display the :model:`models.Ticket` and :model:`models.Review` posted by
-    the user logged in and the users followed by the user logged in.
+    the user logged in and the users followed by the user logged in, one
+    page at a time.
 
     **Context**
 
     ``posts``
-        List of dicts: :model:`myapp.Ticket` and has_review (bool) /
-        :model:`models.Review` and rating (dict).
+        List of dicts: :model:`myapp.Ticket`, has_review (bool) and own
+        (bool) / :model:`models.Review`, stars (HTML) and own (bool).
+    ``next_cursor``
+        Cursor of the next page, None on the last page.
     ``user_logged_in``
         An instance of :model:`User`
+    ``page``
+        'flux', for the cached cards (see :mod:`app.cards`).
+    ``card_cache_timeout``
+        Lifetime in seconds of the cached cards.
 
     **Template:**
 
     :template:`app/flux.html`
 
-    """
-    user_logged_in = User.objects.get(username=request.user)
-    users_to_display = [user_logged_in]
-    for subscription in models.UserFollows.objects.filter(user=request.user):
-        user = User.objects.get(username=subscription.followed_user)
-        users_to_display.append(user)
-    tickets = models.Ticket.objects.filter(user__in=users_to_display)
-    tickets = tickets.annotate(content_type=Value('TICKET', CharField()))
-
-    reviews = models.Review.objects.filter(user__in=users_to_display)
-    reviews = reviews.annotate(content_type=Value('REVIEW', CharField()))
+    Answers 304 Not Modified if the page did not change since the version
+    cached by the browser, see :func:`feed_validator`.
+    Reads from the replica, if there is one, see :mod:`app.database`.
 
-    posts = sorted(chain(reviews, tickets),
-                   key=lambda post: post.time_created, reverse=True)
+    """
+    user_logged_in = request.user
+    read_authors = timeline.followed_authors(user_logged_in.id,
+                                             fanned_out=False)
+    page = feed_cache.get_page(
+        'flux', user_logged_in.id, request.GET.get('cursor'),
+        lambda: timeline.sources(user_logged_in.id, read_authors),
+        authors=read_authors)
+    posts = page.posts
 
     for post in range(len(posts)):
         if posts[post].content_type == 'TICKET':
-            check_if_ticket_has_review(posts, post)
+            check_if_ticket_has_review(posts, post, user_logged_in)
         else:
-            handle_rating_stars(posts, post)
+            handle_rating_stars(posts, post, user_logged_in)
 
     context = {
         'posts': posts,
+        'next_cursor': page.next_cursor,
         'user_logged_in': user_logged_in,
+        'page': 'flux',
+        'card_cache_timeout': settings.CARD_CACHE_TIMEOUT,
     }
     return render(request, 'app/flux.html', context=context)
 
 
-def check_if_ticket_has_review(posts, post):
+@login_required(login_url='login')
+def flux_events(request):
+    """
+    Answer 204 No Content, which stops the EventSource of
+    :template:`app/flux.html`: the live notifications are only served by
+    the ASGI application of :mod:`litreview.asgi`, which handles this URL
+    before Django (see :mod:`app.live`).
+    """
+    return HttpResponse(status=204)
+
+
+def check_if_ticket_has_review(posts, post, user_logged_in):
     """
-    Create a dict containing the :model:`myapp.Ticket` and has_review (bool).
+    Create a dict containing the :model:`myapp.Ticket`, has_review (bool)
+    and own (bool, whether the user logged in wrote it).
+    has_review is read from the review_count of the ticket, see
+    :mod:`app.aggregates`.
     :arg: posts: List of :model:`myapp.Ticket`.
     :arg: post: Integer indicating the location of the post in the list of
     posts.
     """
-    ticket_in_review = models.Review.objects.filter(ticket=posts[post])
-    if len(ticket_in_review) == 1:
-        has_review = True
-    else:
-        has_review = False
     posts[post] = {"ticket": posts[post],
-                   "has_review": has_review}
+                   "has_review": posts[post].has_review,
+                   "own": posts[post].user_id == user_logged_in.id}
 
 
-def handle_rating_stars(posts, post):
+def handle_rating_stars(posts, post, user_logged_in):
     """
-    Create a dict containing the :model:`myapp.Review` and rating (dict).
+    Create a dict containing the :model:`myapp.Review`, stars (the HTML of
+    its rating, see :data:`cards.STARS`) and own (bool, whether the user
+    logged in wrote it).
     :arg: posts: List of :model:`myapp.Ticket`.
     :arg: post: Integer indicating the location of the post in the list
     of posts.
     """
-    rating = posts[post].rating
-    full_stars = [star for star in range(rating)]
-    empty_stars = [star for star in range(5 - rating)]
     posts[post] = {"review": posts[post],
-                   "rating": {"full_stars": full_stars,
-                              "empty_stars": empty_stars}}
+                   "stars": cards.STARS[posts[post].rating],
+                   "own": posts[post].user_id == user_logged_in.id}
 
 
 @login_required(login_url='login')
+@database.read_from_replica
+@cache_control(private=True, no_cache=True)
+@condition(**feed_validator('posts'))
 def display_posts(request):
     """
     Display the :model:`models.Ticket` and :model:`models.Review` posted by
-    the user logged in.
+    the user logged in, one page at a time.
 
     **Context**
 
     ``posts``
-        List of dicts: :model:`myapp.Ticket` / :model:`models.Review` and
-        rating (dict).
+        List of dicts: :model:`myapp.Ticket`, has_review (bool) and own
+        (bool) / :model:`models.Review`, stars (HTML) and own (bool).
+    ``next_cursor``
+        Cursor of the next page, None on the last page.
     ``user_logged_in``
         An instance of User.
+    ``page``
+        'posts', for the cached cards (see :mod:`app.cards`).
+    ``card_cache_timeout``
+        Lifetime in seconds of the cached cards.
 
     **Template:**
 
     :template:`app/posts.html`
 
-    """
-    user_logged_in = User.objects.get(username=request.user)
-    tickets = models.Ticket.objects.filter(user=user_logged_in)
-    tickets = tickets.annotate(content_type=Value('TICKET', CharField()))
-
-    reviews = models.Review.objects.filter(user=user_logged_in)
-    reviews = reviews.annotate(content_type=Value('REVIEW', CharField()))
+    Answers 304 Not Modified if the page did not change since the version
+    cached by the browser, see :func:`feed_validator`.
+    Reads from the replica, if there is one, see :mod:`app.database`.
 
-    posts = sorted(chain(reviews, tickets),
-                   key=lambda post: post.time_created, reverse=True)
+    """
+    user_logged_in = request.user
+    page = feed_cache.get_page(
+        'posts', user_logged_in.id, request.GET.get('cursor'),
+        lambda: feed.post_sources([user_logged_in.id]))
+    posts = page.posts
 
     for post in range(len(posts)):
         if posts[post].content_type == 'TICKET':
-            posts[post] = {"ticket": posts[post]}
+            check_if_ticket_has_review(posts, post, user_logged_in)
         else:
-            handle_rating_stars(posts, post)
+            handle_rating_stars(posts, post, user_logged_in)
 
     context = {
         'posts': posts,
+        'next_cursor': page.next_cursor,
         'user_logged_in': user_logged_in,
+        'page': 'posts',
+        'card_cache_timeout': settings.CARD_CACHE_TIMEOUT,
     }
     return render(request, 'app/posts.html', context=context)
 
 
+@login_required(login_url='login')
+@database.read_from_replica
+def search_posts(request):
+    """
+    Display the :model:`models.Ticket` and :model:`models.Review` posted by
+    the user logged in and the users followed by the user logged in which
+    match the ``q`` parameter, best match first, one page at a time.
+    See :mod:`app.search`.
+
+    **Context**
+
+    ``query``
+        The words searched.
+    ``posts``
+        List of dicts: :model:`myapp.Ticket`, has_review (bool) and own
+        (bool) / :model:`models.Review`, stars (HTML) and own (bool).
+    ``next_cursor``
+        Cursor of the next page, None on the last page.
+    ``page``
+        'flux': the results are the cached cards of the flux (see
+        :mod:`app.cards`).
+    ``card_cache_timeout``
+        Lifetime in seconds of the cached cards.
+
+    **Template:**
+
+    :template:`app/search.html`
+
+    Reads from the replica, if there is one, see :mod:`app.database`.
+
+    """
+    query = request.GET.get('q', '').strip()
+    authors = [request.user.id, *follow_graph.following(request.user.id)]
+    page = search.search(query, authors, request.GET.get('cursor'))
+    posts = page.posts
+
+    for post in range(len(posts)):
+        if posts[post].content_type == 'TICKET':
+            check_if_ticket_has_review(posts, post, request.user)
+        else:
+            handle_rating_stars(posts, post, request.user)
+
+    context = {
+        'query': query,
+        'posts': posts,
+        'next_cursor': page.next_cursor,
+        'page': 'flux',
+        'card_cache_timeout': settings.CARD_CACHE_TIMEOUT,
+    }
+    return render(request, 'app/search.html', context=context)
+
+
+@login_required(login_url='login')
+def export_posts(request):
+    """
+    Stream the :model:`models.Ticket` and :model:`models.Review` posted by
+    the user logged in, as NDJSON (``format=ndjson``, the default) or CSV
+    (``format=csv``), optionally only the posts created after the ``since``
+    date and time (ISO 8601). See :mod:`app.export`.
+    """
+    export_format = request.GET.get('format', 'ndjson')
+    if export_format not in export.FORMATS:
+        return HttpResponseBadRequest('Format inconnu.')
+    since = request.GET.get('since')
+    if since:
+        try:
+            since = export.parse_since(since)
+        except ValueError:
+            return HttpResponseBadRequest('Date invalide.')
+    content_type, extension, lines = export.FORMATS[export_format]
+    response = StreamingHttpResponse(
+        lines(export.records([request.user.id], since or None)),
+        content_type=content_type)
+    response['Content-Disposition'] = \
+        f'attachment; filename="litreview-posts.{extension}"'
+    return response
+
+
 @login_required(login_url='login')
 def follow_users(request):
     """
@@ -134,43 +274,77 @@ def follow_users(request):
 
     **Context**
 
-    ``users``
-        List of :model:`User`.
     ``subscriptions``
-        List of :model:`models.UserFollows`.
+        List of dicts: id and username of the :model:`User` followed by
+        the user logged in.
     ``followers``
-        List of :model:`models.UserFollows`.
+        List of dicts: id and username of the :model:`User` following the
+        user logged in.
+    ``suggestions``
+        List of dicts: suggested_user (id), username and score of the
+        :model:`User` suggested to the user logged in, best first, see
+        :mod:`app.suggestions`.
 
     **Template:**
 
     :template:`app/follow_users.html`
 
     """
-    users = User.objects.all()
-    subscriptions = [subscription.followed_user for subscription
-                     in models.UserFollows.objects.filter(user=request.user)]
-    followers = [follower.user for follower in
-                 models.UserFollows.objects.filter(followed_user=request.user)]
+    following = follow_graph.following(request.user.id)
+    following_me = follow_graph.followers(request.user.id)
+    related_users = User.objects.filter(id__in=following | following_me)\
+        .order_by('username').values('id', 'username')
+    subscriptions = [user for user in related_users
+                     if user['id'] in following]
+    followers = [user for user in related_users
+                 if user['id'] in following_me]
     if request.method == 'POST':
         try:
             user_to_follow = User.objects\
                 .get(username=request.POST['username'])
-            if user_to_follow != request.user and \
-                    user_to_follow not in subscriptions:
+            if user_to_follow.id != request.user.id and \
+                    user_to_follow.id not in following:
                 user_followed = models.UserFollows(
                     user=request.user, followed_user=user_to_follow)
-                user_followed.save()
+                # commits the follow with the writes of its receiver: the
+                # timeline backfill and the stale suggestions mark
+                try:
+                    with transaction.atomic():
+                        user_followed.save()
+                except IntegrityError:
+                    # followed meanwhile, e.g. from another tab
+                    pass
                 return redirect('subscriptions')
         except ObjectDoesNotExist:
             print("Impossible de s'abonner à cet utilisateur")
+    # computed by the compute_follow_suggestions command, see
+    # app.suggestions: the users followed since then are left out
+    suggestions = [
+        suggestion for suggestion in models.FollowSuggestion.objects
+        .filter(user=request.user.id).order_by('-score', 'suggested_user')
+        .values('suggested_user', 'score',
+                username=F('suggested_user__username'))
+        [:settings.FOLLOW_SUGGESTIONS]
+        if suggestion['suggested_user'] not in following]
     context = {
-        'users': users,
         'subscriptions': subscriptions,
         'followers': followers,
+        'suggestions': suggestions,
     }
     return render(request, 'app/follow_users.html', context=context)
 
 
+@login_required(login_url='login')
+def autocomplete_usernames(request):
+    """
+    Return, as JSON, the usernames starting with the ``q`` parameter
+    (case-insensitive), for the autocomplete of
+    :template:`app/follow_users.html`.
+    """
+    return JsonResponse(
+        {'usernames': usernames.complete(request.GET.get('q', ''))})
+
+
 @login_required(login_url='login')
 def unfollow_user(request, id):
     """
@@ -186,19 +360,22 @@ def unfollow_user(request, id):
     :template:`app/unfollow_user.html`
 
     """
-    user_selected = User.objects.get(id=id)
-    for user in models.UserFollows.objects.filter(user=request.user):
-        if user.followed_user == user_selected:
-            user_to_unfollow = user
-            username_of_user_to_unfollow =\
-                user_to_unfollow.followed_user.username
-            if request.method == 'POST':
-                user_to_unfollow.delete()
-                return redirect('subscriptions')
+    user_selected = get_object_or_404(User, id=id)
+    if user_selected.id not in follow_graph.following(request.user.id):
+        return redirect('subscriptions')
+    if request.method == 'POST':
+        user_followed = models.UserFollows.objects.filter(
+            user=request.user, followed_user=user_selected).first()
+        if user_followed is not None:
+            # commits the unfollow with the writes of its receiver; the
+            # transaction starts with the deletion, see database.upsert
+            with transaction.atomic():
+                user_followed.delete()
+        return redirect('subscriptions')
     return render(
         request,
         'app/unfollow_user.html',
-        context={'username_of_user_to_unfollow': username_of_user_to_unfollow})
+        context={'username_of_user_to_unfollow': user_selected.username})
 
 
 @login_required(login_url='login')
@@ -222,7 +399,11 @@ def create_ticket(request):
         if form.is_valid():
             ticket = form.save(commit=False)
             ticket.user = request.user
-            ticket.save()
+            # the ticket is committed with the job building its variants
+            with transaction.atomic(
+                    using=router.db_for_write(models.Ticket, instance=ticket)):
+                ticket.save()
+                images.image_changed(ticket)
             return redirect('flux')
     return render(request, 'app/create_ticket.html', context={'form': form})
 
@@ -244,15 +425,23 @@ def edit_ticket(request, id):
     :template:`app/edit_ticket.html`
 
     """
-    ticket = get_object_or_404(models.Ticket, id=id)
+    ticket = get_object_or_404(sharding.manager_of(models.Ticket, id), id=id)
     form = forms.TicketForm(instance=ticket)
     if request.user == ticket.user:
         if request.method == 'POST':
+            previous_image = ticket.image.name
+            previous_variants = ticket.image_variants
             form = forms.TicketForm(request.POST,
                                     request.FILES,
                                     instance=ticket)
             if form.is_valid():
-                form.save()
+                # the new image is committed with the files of the previous
+                # one to delete
+                with transaction.atomic(using=ticket._state.db):
+                    form.save()
+                    if 'image' in form.changed_data:
+                        images.image_changed(ticket, previous_image,
+                                             previous_variants)
                 return redirect('posts')
         return render(request,
                       'app/edit_ticket.html',
@@ -276,7 +465,7 @@ def delete_ticket(request, id):
     :template:`app/delete_ticket.html`
 
     """
-    ticket = get_object_or_404(models.Ticket, id=id)
+    ticket = get_object_or_404(sharding.manager_of(models.Ticket, id), id=id)
     if request.user == ticket.user:
         if request.method == 'POST':
             ticket.delete()
@@ -310,8 +499,8 @@ def create_review(request, id):
     :template:`app/create_review.html`
 
     """
-    user_logged_in = User.objects.get(username=request.user)
-    ticket = models.Ticket.objects.get(id=id)
+    user_logged_in = request.user
+    ticket = sharding.manager_of(models.Ticket, id).get(id=id)
     form = forms.ReviewForm()
     if request.method == 'POST':
         form = forms.ReviewForm(request.POST, request.FILES)
@@ -319,7 +508,9 @@ def create_review(request, id):
             review = form.save(commit=False)
             review.user = request.user
             review.ticket = ticket
-            review.save()
+            # commits the review with the aggregates of its ticket
+            with transaction.atomic(using=ticket._state.db):
+                review.save()
             return redirect('flux')
     rating_range = [number for number in range(6)]
     context = {
@@ -360,12 +551,16 @@ def create_review_without_ticket(request):
         if ticket_form.is_valid() and review_form.is_valid():
             ticket = ticket_form.save(commit=False)
             ticket.user = request.user
-            ticket.save()
-            review_ticket = models.Ticket.objects.get(id=ticket.id)
-            review = review_form.save(commit=False)
-            review.user = request.user
-            review.ticket = review_ticket
-            review.save()
+            with transaction.atomic(
+                    using=router.db_for_write(models.Ticket, instance=ticket)):
+                ticket.save()
+                images.image_changed(ticket)
+                review_ticket = models.Ticket.objects\
+                    .using(ticket._state.db).get(id=ticket.id)
+                review = review_form.save(commit=False)
+                review.user = request.user
+                review.ticket = review_ticket
+                review.save()
             return redirect('flux')
 
     context = {'ticket_form': ticket_form,
@@ -395,13 +590,14 @@ def edit_review(request, id):
     :template:`app/edit_review.html`
 
     """
-    review = get_object_or_404(models.Review, id=id)
+    review = get_object_or_404(sharding.manager_of(models.Review, id), id=id)
     form = forms.ReviewForm(instance=review)
     if request.user == review.user:
         if request.method == 'POST':
             form = forms.ReviewForm(request.POST, instance=review)
             if form.is_valid():
-                form.save()
+                with transaction.atomic(using=review._state.db):
+                    form.save()
                 return redirect('posts')
         rating_range = [number for number in range(6)]
         context = {
@@ -429,7 +625,7 @@ def delete_review(request, id):
     :template:`app/delete_review.html`
 
     """
-    review = get_object_or_404(models.Review, id=id)
+    review = get_object_or_404(sharding.manager_of(models.Review, id), id=id)
     if request.user == review.user:
         if request.method == 'POST':
             review.delete()
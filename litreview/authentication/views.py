@@ -10,7 +10,9 @@ def signup(request):
         form = forms.SignUpForm(request.POST)
         if form.is_valid():
             user = form.save()
-            login(request, user)
+            # the first of the authentication backends, the cached one
+            login(request, user,
+                  backend=settings.AUTHENTICATION_BACKENDS[0])
             return redirect(settings.LOGIN_REDIRECT_URL)
     return render(request,
                   'authentication/signup.html',
@@ -13,4 +13,21 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'litreview.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once Django is set up
+from django.urls import reverse  # noqa: E402
+
+from app import live  # noqa: E402
+
+EVENTS_PATH = reverse('flux_events')
+
+
+async def application(scope, receive, send):
+    """
+    Serve the live notifications of the flux (see app.live) without
+    blocking a thread per connection, and the rest with Django.
+    """
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await live.events_app(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -40,15 +40,17 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'authentication',
     'app',
-    'django_cleanup.apps.CleanupConfig',
 ]
 
 MIDDLEWARE = [
+    'app.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.middleware.ReplicaPinMiddleware',
+    'app.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -61,7 +63,6 @@ TEMPLATES = [
         'DIRS': [
             BASE_DIR.joinpath('templates')
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -69,6 +70,14 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # templates are parsed once per process, even with DEBUG:
+            # restart the server to see template changes
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -83,9 +92,96 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # seconds during which a connection is reused by the requests of
+        # its thread
+        'CONN_MAX_AGE': 60,
+        # a file rather than an in-memory database: the threads of the live
+        # server of the tests have their own connections, like in production
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Pragmas run by every new SQLite connection (see app.database): readers
+# and the writer do not block each other in WAL mode, which only needs
+# synchronous=NORMAL to stay consistent after a crash; mmap_size is in
+# bytes and a negative cache_size in KiB.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
+# Path of a copy of the database read by the feed pages, refreshed by
+# `manage.py sync_replica --interval REPLICA_MAX_LAG`, or None to read
+# everything from the database above
+REPLICA_DATABASE = None
+# Seconds the replica may lag behind: the users who have just written
+# read from the primary database for that long
+REPLICA_MAX_LAG = 10
+
+if REPLICA_DATABASE:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': REPLICA_DATABASE,
+        'CONN_MAX_AGE': 60,
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+
+# Aliases of the databases holding the tickets and reviews, each user's
+# posts being stored in one of them (see app.sharding), e.g.
+# ['shard0', 'shard1'], or [] to store them in the database above
+POST_SHARDS = []
+# Threads querying the shards in parallel
+SHARD_QUERY_WORKERS = 8
+
+for alias in POST_SHARDS:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+        'CONN_MAX_AGE': 60,
+    }
+
+DATABASE_ROUTERS = ['app.sharding.ShardRouter', 'app.database.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Sessions read from the cache and written to the database by a job, at
+# most once every SESSION_PERSIST_DELAY seconds per session (see
+# app.sessions)
+SESSION_ENGINE = 'app.sessions'
+SESSION_PERSIST_DELAY = 60
+
+# Users of the requests cached by the authentication backend (see
+# app.backends), for USER_CACHE_TIMEOUT seconds; the sessions opened with
+# the default backend, recorded in them, still load their user from it
+AUTHENTICATION_BACKENDS = [
+    'app.backends.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+USER_CACHE_TIMEOUT = 60 * 60
+
+# Lifetime in seconds of the cached flux and posts pages
+FEED_CACHE_TIMEOUT = 60 * 60
+# Lifetime in seconds of the cached ticket and review cards
+CARD_CACHE_TIMEOUT = 24 * 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -136,5 +232,73 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = 'flux'
 
+# Authors followed by at least this many users are not fanned out to the
+# timelines of their followers: their posts are read when the flux loads.
+# Run `manage.py rebuild_timeline` after changing it.
+TIMELINE_FANOUT_LIMIT = 10000
+
+# Maximum number of user ids held by the in-process follow graph caches
+FOLLOW_GRAPH_CACHE_SIZE = 1000000
+
+# Suggestions of users to follow stored per user by the
+# compute_follow_suggestions command (see app.suggestions)
+FOLLOW_SUGGESTIONS = 10
+
+# Per-request SQL and timing measures, sent in a Server-Timing header and
+# logged for the slow requests (see app.middleware)
+REQUEST_METRICS = False
+SLOW_REQUEST_MS = 500
+# Number of runs of the same query in a request logged as duplicates
+DUPLICATE_QUERY_COUNT = 3
+
+# cProfile profiles of the requests made by staff users with ?profile=1
+# and of this fraction of the requests, see the profile_report command
+PROFILING_SAMPLE_RATE = 0.0
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_MAX_FILES = 200
+
+# Background jobs, run by `manage.py runworker` (see app.jobs), or by the
+# code enqueueing them once its transaction commits if JOBS_EAGER
+JOBS_EAGER = False
+JOBS_MAX_ATTEMPTS = 5
+# Delay in seconds before the first retry of a failed job, doubled at
+# each attempt up to JOBS_MAX_RETRY_DELAY
+JOBS_RETRY_DELAY = 10
+JOBS_MAX_RETRY_DELAY = 60 * 60
+# Running jobs not finished after this many seconds are run again
+JOBS_TIMEOUT = 10 * 60
+# Days during which the finished jobs, and their idempotency keys, are kept
+JOBS_RETENTION_DAYS = 7
+
+# Live notifications of the new posts to the flux pages, served as
+# server-sent events by the ASGI application (see app.live). The local
+# backend reaches the connections of the process publishing the events,
+# the database backend those of every process.
+LIVE_EVENTS_BACKEND = 'app.live.LocalBackend'
+# Seconds between two comments keeping the idle connections open
+LIVE_HEARTBEAT_INTERVAL = 15
+# Events queued per connection, the next ones being dropped
+LIVE_QUEUE_SIZE = 100
+# Seconds between two polls of the database backend, and lifetime of its
+# events, deleted by each process once per lifetime
+LIVE_POLL_INTERVAL = 1.0
+LIVE_EVENTS_RETENTION = 5 * 60
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'app': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR.joinpath('media/')
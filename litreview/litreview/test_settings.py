@@ -0,0 +1,23 @@
+"""
+Settings of the test suite, run by ``python manage.py test``: the settings
+of litreview/settings.py, with two post shards, an in-process cache and
+eager jobs.
+"""
+from .settings import *  # noqa: F401, F403
+from .settings import BASE_DIR, DATABASES
+
+# enabled by ShardingTests only, with POST_SHARDS
+for alias in ('shard0', 'shard1'):
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{alias}.sqlite3',
+        'CONN_MAX_AGE': 60,
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+JOBS_EAGER = True
@@ -30,8 +30,13 @@ urlpatterns = [
     path('signup/', authentication.views.signup, name='signup'),
     path('logout/', LogoutView.as_view(next_page='login'), name='logout'),
     path('flux/', app.views.flux, name='flux'),
+    path('flux/events/', app.views.flux_events, name='flux_events'),
     path('posts/', app.views.display_posts, name="posts"),
+    path('posts/export/', app.views.export_posts, name='export_posts'),
+    path('search/', app.views.search_posts, name='search'),
     path('subscriptions/', app.views.follow_users, name='subscriptions'),
+    path('subscriptions/autocomplete/',
+         app.views.autocomplete_usernames, name='autocomplete_usernames'),
     path('subscriptions/<int:id>/unfollow/',
          app.views.unfollow_user, name='unfollow_user'),
     path('create-ticket/', app.views.create_ticket, name='create_ticket'),
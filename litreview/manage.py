@@ -6,7 +6,12 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'litreview.settings')
+    # the tests run with litreview/test_settings.py unless --settings or
+    # DJANGO_SETTINGS_MODULE says otherwise
+    settings_module = 'litreview.settings'
+    if sys.argv[1:2] == ['test']:
+        settings_module = 'litreview.test_settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: